@@ -1,43 +1,227 @@
-"""
-receving data from eye tracker
-"""
-
-import socket
-from threading import Thread
-from queue import Queue
-
-HOST = '127.0.0.1'
-PORT = 4242
-ADDRESS = (HOST, PORT)
-
-data_queue = Queue()
-
-def data_collector():
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.connect(ADDRESS)
-
-    # Send commands to initialize data streaming
-    s.send(str.encode('<SET ID="ENABLE_SEND_POG_FIX" STATE="1" />\r\n')) # fixation
-
-    # diameter
-    s.send(str.encode('<SET ID="ENABLE_SEND_EYE_LEFT" STATE="1" />\r\n')) 
-    s.send(str.encode('<SET ID="ENABLE_SEND_EYE_RIGHT" STATE="1" />\r\n'))
-    
-    s.send(str.encode('<SET ID="ENABLE_SEND_DATA" STATE="1" />\r\n'))
-
-    while True:
-        data = s.recv(1024).decode().split(" ")
-
-        keys = ["FPOGX", "FPOGY", "FPOGD"]
-        type_map = {"FPOGX": float, "FPOGY": float, "FPOGD": float}
-        result = {key: 0 for key in keys}
-
-        for el in data:
-            for key in keys:
-                if key in el:
-                    result[key] = type_map[key](el.split("\"")[1])
-
-        data_queue.put(result)
-
-collector_thread = Thread(target=data_collector)
-collector_thread.start()
+"""
+receving data from eye tracker
+"""
+
+import asyncio
+import re
+from threading import Lock, Thread
+
+import numpy as np
+
+import metrics
+from gaze_buffer import GazeRingBuffer
+
+HOST = '127.0.0.1'
+PORT = 4242
+ADDRESS = (HOST, PORT)
+
+# fields taken from every <REC .../> record, in tuple order
+# fixation (ENABLE_SEND_POG_FIX), left / right eye (ENABLE_SEND_EYE_LEFT / _RIGHT),
+# then tracker time in seconds (ENABLE_SEND_TIME)
+RECORD_FIELDS = ("FPOGX", "FPOGY", "FPOGD",
+                 "LEYEX", "LEYEY", "LEYEZ", "LPUPILD", "LPUPILV",
+                 "REYEX", "REYEY", "REYEZ", "RPUPILD", "RPUPILV",
+                 "TIME")
+RECORD_DTYPE = np.dtype([(field, np.float64 if field == "TIME" else np.float32) for field in RECORD_FIELDS])
+
+# commands sent after every (re)connect
+START_COMMANDS = (
+    b'<SET ID="ENABLE_SEND_TIME" STATE="1" />\r\n',
+    b'<SET ID="ENABLE_SEND_POG_FIX" STATE="1" />\r\n', # fixation
+    # diameter
+    b'<SET ID="ENABLE_SEND_EYE_LEFT" STATE="1" />\r\n',
+    b'<SET ID="ENABLE_SEND_EYE_RIGHT" STATE="1" />\r\n',
+    b'<SET ID="ENABLE_SEND_DATA" STATE="1" />\r\n',
+)
+
+class GazepointParser:
+    """
+    Incremental parser for the Gazepoint Open API stream.
+    Bytes are buffered until a CRLF terminated record is complete, so
+    records split across recv() calls are kept whole. Every <REC .../>
+    record becomes one tuple of floats in RECORD_FIELDS order, fields the
+    record does not carry are 0 like before. ACK and other records are
+    skipped, and so is a record with a value that is not a number (counted
+    in `malformed`), so one bad record does not end the stream.
+    """
+
+    def __init__(self, fields=RECORD_FIELDS):
+        self.fields = tuple(fields)
+        self.keys = [field.encode() for field in self.fields]
+        self.buffer = b""
+        self.malformed = 0
+        self.pattern = re.compile(rb' (' + b'|'.join(self.keys) + rb')="([^"]*)"')
+
+    def feed(self, chunk):
+        """
+        chunk  : bytes as received from the socket
+        return list of record tuples completed by this chunk
+        """
+        lines = (self.buffer + chunk).split(b"\r\n")
+        self.buffer = lines.pop()
+
+        records = []
+        keys = self.keys
+        for line in lines:
+            if not line.startswith(b"<REC"):
+                continue
+            values = dict(self.pattern.findall(line))
+            try:
+                records.append(tuple([float(values.get(key, 0)) for key in keys]))
+            except ValueError:
+                self.malformed += 1
+                metrics.count('records_malformed')
+        return records
+
+    def feed_array(self, chunk):
+        """
+        same as feed, but returns a structured NumPy array of RECORD_DTYPE rows
+        """
+        return np.array(self.feed(chunk), dtype=RECORD_DTYPE)
+
+class GazepointClient:
+    """
+    asyncio connection to the Gazepoint Open API server.
+    Nothing happens until start(), which runs the client on its own event
+    loop in a daemon thread. A lost or refused connection is retried with
+    exponential backoff between min_backoff and max_backoff seconds.
+    Parsed records are written straight into a GazeRingBuffer, which
+    overwrites the oldest samples when full, and to `recorder` (a
+    gaze_recording.GazeRecorder) when one is given. Consumers read it with
+    `async for columns in client.batches()` (or `async for sample in client`)
+    from coroutines submitted with submit().
+    """
+
+    def __init__(self, address=ADDRESS, capacity=1 << 16, min_backoff=0.5, max_backoff=10.0, recorder=None):
+        self.address = address
+        self.recorder = recorder
+        self.buffer = GazeRingBuffer(capacity)
+        self.dropped = 0
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.connects = 0
+        self.connect_failures = 0
+        self.connected = False
+        self.loop = None
+        self.thread = None
+        self.task = None
+        self.ready = None
+        self.lock = Lock()
+
+    def counters(self):
+        """return dict of connection and buffer counters"""
+        return {"received": self.buffer.head, "dropped": self.dropped,
+                "buffered": len(self.buffer), "connects": self.connects,
+                "connect_failures": self.connect_failures}
+
+    def start(self):
+        """start the client thread if it is not running yet, return self"""
+        with self.lock:
+            if self.thread is None:
+                self.loop = asyncio.new_event_loop()
+                self.ready = asyncio.Event()
+                self.thread = Thread(target=self._run_loop, daemon=True)
+                self.thread.start()
+        return self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.task = self.loop.create_task(self.run())
+        self.loop.run_forever()
+
+    def stop(self):
+        """close the connection and stop the client thread"""
+        with self.lock:
+            if self.thread is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop)
+            self.thread.join()
+            self.loop.close()
+            self.thread = None
+
+    async def _shutdown(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        asyncio.get_running_loop().stop()
+
+    def submit(self, coroutine):
+        """schedule a coroutine on the client loop, return its concurrent Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.start().loop)
+
+    async def run(self):
+        backoff = self.min_backoff
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(*self.address)
+            except OSError:
+                self.connect_failures += 1
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+
+            self.connects += 1
+            self.connected = True
+            backoff = self.min_backoff
+            try:
+                await self.stream(reader, writer)
+            except OSError:
+                pass
+            finally:
+                self.connected = False
+                writer.close()
+
+    async def stream(self, reader, writer):
+        for command in START_COMMANDS:
+            writer.write(command)
+        await writer.drain()
+
+        parser = GazepointParser()
+        while True:
+            chunk = await reader.read(4096)
+            if not chunk:
+                return
+            records = parser.feed(chunk)
+            if records:
+                if self.recorder is not None:
+                    # before the buffer, so every sample a consumer has read is recorded
+                    self.recorder.write(records, self.buffer.head)
+                self.buffer.extend_records(records)
+                metrics.count('samples_ingested', len(records))
+                self.ready.set()
+
+    async def batches(self, start=None, with_sequence=False):
+        """
+        async iterator over the samples written since the previous batch
+        start : sequence number to begin at, default the next sample
+        with_sequence : yield (sequence of the first sample, columns) instead
+        yield dict of zero-copy column views (see GazeRingBuffer.window),
+              samples overwritten before they were read count as dropped
+        """
+        cursor = self.buffer.head if start is None else start
+        while True:
+            while self.buffer.head == cursor:
+                self.ready.clear()
+                await self.ready.wait()
+            first, columns = self.buffer.window(cursor)
+            if first > cursor:
+                self.dropped += first - cursor
+                metrics.count('samples_dropped', first - cursor)
+            cursor = first + len(columns["x"])
+            yield (first, columns) if with_sequence else columns
+
+    async def __aiter__(self):
+        async for columns in self.batches():
+            for sample in zip(columns["x"], columns["y"], columns["duration"], columns["time"]):
+                yield sample
+
+_client = None
+
+def get_client():
+    """return the shared GazepointClient for ADDRESS, created on first use (not started)"""
+    global _client
+    if _client is None:
+        _client = GazepointClient(ADDRESS)
+    return _client
@@ -0,0 +1,175 @@
+"""
+flag assets for the Flask pages
+one registry of every flag code: image URLs, intrinsic score, default
+familiarity and a content hash (etag) that versions the image URLs, built
+at startup and rebuilt when the image directories or the CSVs change
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+static_dir = os.path.join(script_dir, 'static')
+intr_path = os.path.join(parent_dir, 'data', 'intrinsic_scores.csv')
+fam_path = os.path.join(parent_dir, 'data', 'flag_familiarity.csv')
+
+LEARNING_FOLDER = 'learningMaterial'
+RATING_FOLDER = 'rating'
+
+
+def file_etag(path):
+    '''short content hash of a file'''
+    with open(path, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()[:16]
+
+
+class AssetRegistry:
+    """
+    code -> {code, name, filename, image, rating_image, intrinsic, familiarity, etag}
+    image / rating_image are /static paths of the learning material and the
+    rating picture (None when the flag has none), etag the hash of the
+    learning material image; rating page URLs carry their image's hash as
+    ?v= too. Lookups are dict reads of the current tables, refresh()
+    rebuilds them from scratch and swaps them in, so readers never see a
+    half-built registry.
+    Nothing is read before the first lookup (or refresh()). After that the
+    sources are checked at most every `check_interval` seconds, by stat
+    only; a changed file list, mtime or size triggers a rebuild.
+    """
+
+    def __init__(self, static_dir=static_dir, intr_path=intr_path, fam_path=fam_path, check_interval=1.0):
+        self.static_dir = static_dir
+        self.intr_path = intr_path
+        self.fam_path = fam_path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.checked = 0.0
+        self.signature = None
+        self.assets = {}
+        self.learning = []
+        self.rating = []
+        self.rebuilds = 0
+
+    def _signature(self):
+        '''(name, mtime, size) of every source file'''
+        entries = []
+        for folder in (LEARNING_FOLDER, RATING_FOLDER):
+            directory = os.path.join(self.static_dir, folder)
+            if os.path.isdir(directory):
+                with os.scandir(directory) as scan:
+                    entries.extend((folder, entry.name, entry.stat().st_mtime_ns, entry.stat().st_size)
+                                   for entry in scan if entry.is_file())
+        for path in (self.intr_path, self.fam_path):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                entries.append(('data', path, stat.st_mtime_ns, stat.st_size))
+        return sorted(entries)
+
+    def refresh(self, force=False):
+        '''rebuild the tables if a source changed since the last check, return True if rebuilt'''
+        now = time.monotonic()
+        if not force and self.signature is not None and now - self.checked < self.check_interval:
+            return False
+        with self.lock:
+            if not force and self.signature is not None and now - self.checked < self.check_interval:
+                return False
+            self.checked = now
+            signature = self._signature()
+            if signature == self.signature:
+                return False
+            self._build()
+            self.signature = signature
+            self.rebuilds += 1
+            return True
+
+    def _build(self):
+        import pandas as pd
+        intrinsic, names = {}, {}
+        if os.path.exists(self.intr_path):
+            df_intr = pd.read_csv(self.intr_path)
+            intrinsic = dict(zip(df_intr['Code'], df_intr['Score'].astype(float)))
+            names = dict(zip(df_intr['Code'], df_intr['Country_Name']))
+        familiarity = {}
+        if os.path.exists(self.fam_path):
+            df_fam = pd.read_csv(self.fam_path)
+            familiarity = dict(zip(df_fam['Flag Name'], df_fam['Familiarity Level'].astype(int)))
+
+        def images(folder):
+            directory = os.path.join(self.static_dir, folder)
+            if not os.path.isdir(directory):
+                return {}
+            return {os.path.splitext(filename)[0]: filename for filename in sorted(os.listdir(directory))
+                    if os.path.isfile(os.path.join(directory, filename))}
+
+        learning, rating = images(LEARNING_FOLDER), images(RATING_FOLDER)
+        assets = {}
+        for code in sorted(set(learning) | set(rating)):
+            filename = learning.get(code)
+            assets[code] = {
+                'code': code,
+                'name': names.get(code, code),
+                'filename': filename,
+                'image': f'/static/{LEARNING_FOLDER}/{filename}' if filename else None,
+                'rating_image': f'/static/{RATING_FOLDER}/{rating[code]}' if code in rating else None,
+                'intrinsic': intrinsic.get(code),
+                'familiarity': familiarity.get(code),
+                'etag': file_etag(os.path.join(self.static_dir, LEARNING_FOLDER, filename)) if filename else None,
+            }
+        # rating form ids follow the sorted file names, so they do not change between requests
+        rating_flags = [{"id": idx + 1,
+                         "name": os.path.splitext(filename)[0],
+                         "image": f'/static/{RATING_FOLDER}/{filename}'
+                                  f'?v={file_etag(os.path.join(self.static_dir, RATING_FOLDER, filename))}',
+                         "info": f"Info about Country{idx + 1}"}
+                        for idx, filename in enumerate(rating.values())]
+        self.assets, self.learning, self.rating = assets, sorted(learning.values()), rating_flags
+
+    def get(self, code):
+        '''asset dict of a flag code (".jpg" is ignored), None if unknown'''
+        self.refresh()
+        return self.assets.get(code.replace(".jpg", ""))
+
+    def intrinsic(self, code):
+        '''intrinsic score of a flag code, None if the code is unknown or has no row in intrinsic_scores.csv'''
+        asset = self.get(code)
+        return asset['intrinsic'] if asset is not None else None
+
+    def has_image(self, code):
+        '''True if the flag code has a learning material image'''
+        asset = self.get(code)
+        return asset is not None and asset['image'] is not None
+
+    def image_url(self, code):
+        '''learning material URL with the content hash as version, safe to cache for good
+        raise, KeyError naming the code when it has no learning material image
+        '''
+        asset = self.get(code)
+        if asset is None or asset['image'] is None:
+            raise KeyError(f"no learning material image for flag {code!r} in {LEARNING_FOLDER}")
+        return f"{asset['image']}?v={asset['etag']}"
+
+    def learning_images(self):
+        '''file names of the learning material, as os.listdir(static/learningMaterial) sorted'''
+        self.refresh()
+        return self.learning
+
+    def rating_flags(self):
+        '''flags of the rating page: id, name, image, info'''
+        self.refresh()
+        return self.rating
+
+    def __len__(self):
+        return len(self.assets)
+
+
+registry = None
+
+def get_registry():
+    '''return the shared AssetRegistry, built on first use'''
+    global registry
+    if registry is None:
+        registry = AssetRegistry()
+    return registry
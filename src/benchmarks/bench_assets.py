@@ -0,0 +1,90 @@
+"""
+benchmark for the flag asset registry
+compares the per-page lookups view_flag used to do (listing
+static/learningMaterial, masking df_intr['Code']) with AssetRegistry, and
+checks through the Flask test client that versioned flag images are sent
+with a long-lived Cache-Control and that the registry picks up a new file;
+a flag without an intrinsic score gives None, an unknown one a KeyError
+naming it
+
+usage: python src/benchmarks/bench_assets.py [--lookups 2000]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from assets import AssetRegistry, intr_path, static_dir
+import ui_main
+
+
+def old_lookup(images_dir, df_intr):
+    images = os.listdir(images_dir)
+    current_flag = random.choice(images)
+    intr_norm = df_intr[df_intr['Code'] == current_flag.replace(".jpg", "")]["Score"]
+    return current_flag, float(intr_norm.iloc[0])
+
+
+def new_lookup(registry):
+    current_flag = random.choice(registry.learning_images())
+    return registry.image_url(current_flag), registry.intrinsic(current_flag)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    registry = AssetRegistry()
+    registry.refresh()
+    print(f"registry of {len(registry)} flags built in {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    images_dir = os.path.join(static_dir, 'learningMaterial')
+    df_intr = pd.read_csv(intr_path)
+    for name, lookup, lookup_args in (('listdir + df_intr mask', old_lookup, (images_dir, df_intr)),
+                                      ('AssetRegistry', new_lookup, (registry,))):
+        start = time.perf_counter()
+        for _ in range(args.lookups):
+            lookup(*lookup_args)
+        print(f"{name:>24}: {(time.perf_counter() - start) / args.lookups * 1e6:8.1f} us per page")
+
+    client = ui_main.app.test_client()
+    url = ui_main.flag_assets.image_url(ui_main.flag_assets.learning_images()[0])
+    response = client.get(url)
+    versioned = response.headers.get('Cache-Control')
+    response.close()
+    response = client.get(url.split('?')[0])
+    plain = response.headers.get('Cache-Control')
+    response.close()
+    print(f"GET {url}: Cache-Control {versioned!r}; without ?v: {plain!r}")
+
+    # a copy of the static folder, to add an image and watch the registry rebuild
+    directory = tempfile.mkdtemp(prefix='bench_assets_')
+    shutil.copytree(static_dir, os.path.join(directory, 'static'))
+    copy = AssetRegistry(os.path.join(directory, 'static'), check_interval=0)
+    shutil.copy(os.path.join(images_dir, 'jp.jpg'), os.path.join(directory, 'static', 'learningMaterial', 'zz.jpg'))
+    found = copy.get('zz') is not None
+    print(f"new image picked up: {found} ({copy.rebuilds} builds)")
+    # zz has an image but no row in intrinsic_scores.csv
+    missing = copy.intrinsic('zz') is None and copy.image_url('zz.jpg').startswith('/static/')
+    try:
+        copy.image_url('unknown')
+        named = False
+    except KeyError as e:
+        named = 'unknown' in str(e)
+    print(f"no intrinsic score gives None: {missing}, unknown flag raises a KeyError naming it: {named}")
+    if versioned != ui_main.IMMUTABLE_CACHE or not found or not missing or not named:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
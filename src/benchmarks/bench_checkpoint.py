@@ -0,0 +1,75 @@
+"""
+page-turn latency with and without background Q-table checkpoints
+times Learner.run_one_step (the work behind one test-group page turn)
+when the Q-table is pickled on every step, as before, and when a
+CheckpointWriter saves it off the request path; then checks that the
+last update reaches the checkpoint on close
+
+usage: python src/benchmarks/bench_checkpoint.py [--steps 2000] [--flush-every 10]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rl_algo
+from checkpoint import load_checkpoint
+from engagement_calibration import EngagementCalibration
+
+
+def step_latencies(q_table_file, steps, seed=0):
+    rng = np.random.default_rng(seed)
+    learner = rl_algo.Learner(q_table_file=q_table_file,
+                              engagement_source=lambda: float(rng.normal(0.4, 0.2)))
+    learner.initialize_learning()
+    latencies = np.empty(steps)
+    for i in range(steps):
+        start = time.perf_counter()
+        learner.run_one_step()
+        latencies[i] = time.perf_counter() - start
+    return learner, latencies
+
+
+def report(name, latencies):
+    ms = latencies * 1e3
+    print(f"{name:<28} p50 {np.percentile(ms, 50):7.3f} ms   p99 {np.percentile(ms, 99):7.3f} ms   "
+          f"max {ms.max():7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--flush-every', type=int, default=rl_algo.checkpoint_every)
+    args = parser.parse_args()
+    rl_algo.checkpoint_every = args.flush_every
+
+    directory = tempfile.mkdtemp(prefix='bench_checkpoint_')
+    rl_algo.engagement_calibration = EngagementCalibration(path=None)
+    _, sync = step_latencies(os.path.join(directory, 'q_table.pkl'), args.steps)
+    report('pickle on every step', sync)
+
+    # fresh process state, so the checkpoint run does not start from the pickled table
+    rl_algo.q_loaded = False
+    rl_algo.Q = np.zeros_like(rl_algo.Q)
+    rl_algo.q_steps = 0
+    path = os.path.join(directory, 'q_table.npz')
+    learner, background = step_latencies(path, args.steps)
+    report(f'background, flush every {args.flush_every}', background)
+
+    learner.checkpoint.close()
+    q_table, steps = load_checkpoint(path, rl_algo.state_space, rl_algo.action_space)
+    print(f"checkpoint writes: {learner.checkpoint.writes} for {args.steps} steps, "
+          f"{os.path.getsize(path)} bytes on disk")
+    if steps != rl_algo.q_steps or not np.array_equal(q_table, rl_algo.Q):
+        sys.exit(f"checkpoint holds step {steps}, expected {rl_algo.q_steps}")
+    print(f"checkpoint matches Q after step {steps}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+benchmark for the fixation density engines
+compares the windowed separable splat engine against the original
+GaussianMask loop in Fixpos2Densemap, and checks both agree
+
+usage: python src/benchmarks/bench_densemap.py [--fixations 10 40 160] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Fixpos2Densemap import Fixpos2Density, Fixpos2Densemap
+
+WIDTH, HEIGHT = 1920, 1080
+
+# agreement required between the two engines
+DENSITY_RTOL = 1e-5  # max |splat - mask| / max(mask) on the raw density
+HEATMAP_ATOL = 1     # max difference of the normalized uint8 heatmap level
+
+
+def random_fixations(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(0, WIDTH, n),
+                            rng.uniform(0, HEIGHT, n),
+                            rng.uniform(0, 1, n)])
+
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def normalized_levels(density):
+    return (density / np.amax(density) * 255).astype("uint8").astype(int)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixations', type=int, nargs='+', default=[10, 40, 160])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'fixations':>10} {'mask [s]':>10} {'splat [s]':>10} {'speedup':>8} {'density err':>12} {'level err':>10}")
+    for n in args.fixations:
+        fix_arr = random_fixations(n)
+        mask = Fixpos2Density(fix_arr, WIDTH, HEIGHT, engine="mask")
+        splat = Fixpos2Density(fix_arr, WIDTH, HEIGHT, engine="splat")
+        density_err = float(np.abs(splat - mask).max() / mask.max())
+        level_err = int(np.abs(normalized_levels(splat) - normalized_levels(mask)).max())
+
+        t_mask = best_time(lambda: Fixpos2Densemap(fix_arr, WIDTH, HEIGHT, None, engine="mask"), args.repeat)
+        t_splat = best_time(lambda: Fixpos2Densemap(fix_arr, WIDTH, HEIGHT, None, engine="splat"), args.repeat)
+        print(f"{n:>10} {t_mask:>10.4f} {t_splat:>10.4f} {t_mask / t_splat:>7.0f}x {density_err:>12.2e} {level_err:>10}")
+
+        if density_err > DENSITY_RTOL or level_err > HEATMAP_ATOL:
+            sys.exit(f"engines disagree for {n} fixations")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+benchmark for fixation detection
+runs I-VT and I-DT over synthetic tracker streams whose true fixations are
+known (FPOGID), printing samples/s, how many true fixations were found
+(a detected centroid within one degree of a true one) and how many
+fixations the old data_store[::250] decimation kept for comparison; then
+checks that feeding the samples in tracker-sized batches gives the same
+fixations as one call, and that short pages still get a fixation
+
+usage: python src/benchmarks/bench_fixations.py [--seconds 300] [--rate 150] [--batch 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GazepointAPI import GazepointParser
+from engagement_analysis import UI_HEIGHT, UI_WIDTH, EngagementAccumulator
+from fake_tracker import synthetic_records
+from fixations import METHODS, PIXELS_PER_DEGREE, FixationDetector, detect_fixations
+
+
+def samples(seconds, rate, seed=0):
+    '''(x px, y px, time, fixation id) of a synthetic stream'''
+    fields = ('FPOGX', 'FPOGY', 'TIME', 'FPOGID')
+    rows = np.array(GazepointParser(fields).feed(b''.join(synthetic_records(int(seconds * rate), rate, seed))))
+    return rows[:, 0] * UI_WIDTH, rows[:, 1] * UI_HEIGHT, rows[:, 2], rows[:, 3].astype(np.int64)
+
+
+def truth(x, y, ids):
+    '''centroids of the true fixations'''
+    starts = np.flatnonzero(np.diff(ids, prepend=-1))
+    counts = np.diff(np.append(starts, len(ids)))
+    return np.add.reduceat(x, starts) / counts, np.add.reduceat(y, starts) / counts
+
+
+def found(fixations, tx, ty):
+    '''share of true fixations with a detected centroid within one degree'''
+    distance = np.hypot(tx[:, None] - fixations['x'][None, :], ty[:, None] - fixations['y'][None, :])
+    return np.mean(distance.min(axis=1) <= PIXELS_PER_DEGREE) if len(fixations) else 0.0
+
+
+def batched(x, y, t, method, batch):
+    detector = FixationDetector(method)
+    parts = [detector.add(x[i:i + batch], y[i:i + batch], t[i:i + batch]) for i in range(0, len(t), batch)]
+    return np.concatenate(parts + [detector.flush()])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=300.0)
+    parser.add_argument('--rate', type=float, default=150.0)
+    parser.add_argument('--batch', type=int, default=8, help='samples per tracker batch')
+    args = parser.parse_args()
+
+    x, y, t, ids = samples(args.seconds, args.rate)
+    tx, ty = truth(x, y, ids)
+    print(f"{len(t)} samples at {args.rate:.0f} Hz, {len(tx)} true fixations")
+    print(f"data_store[::250]: {len(x[::250])} rows kept")
+    failures = []
+    for method in METHODS:
+        start = time.perf_counter()
+        fixations = detect_fixations(x, y, t, method)
+        elapsed = time.perf_counter() - start
+        print(f"{method}: {len(fixations)} fixations, {found(fixations, tx, ty):.1%} of the true ones found, "
+              f"median {np.median(fixations['duration']) * 1e3:.0f} ms, {len(t) / elapsed / 1e6:.2f} M samples/s")
+
+        start = time.perf_counter()
+        streamed = batched(x, y, t, method, args.batch)
+        elapsed = time.perf_counter() - start
+        print(f"{method} in batches of {args.batch}: {len(t) / elapsed / 1e3:.0f} k samples/s, "
+              f"{'same fixations' if np.array_equal(streamed, fixations) else 'DIFFERENT fixations'}")
+        if not np.array_equal(streamed, fixations):
+            failures.append(f'{method} batched')
+
+        # a 0.3 s page at the tracker rate: the decimation kept one sample of it at most
+        accumulator = EngagementAccumulator(method)
+        page = slice(0, int(0.3 * args.rate))
+        accumulator.add_batch(x[page] / UI_WIDTH, y[page] / UI_HEIGHT, t[page])
+        _, fixation_data, _ = accumulator.snapshot_and_reset()
+        if not len(fixation_data):
+            failures.append(f'{method} short page')
+
+    print(f"failures: {failures or 'none'}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+microbenchmarks for gaze sample storage
+compares the former list-of-dicts data_store with GazeRingBuffer:
+ingest rate, memory per sample and the cost of reading the page window
+
+usage: python src/benchmarks/bench_gaze_buffer.py [--samples 200000] [--batch 16]
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from gaze_buffer import GazeRingBuffer
+
+
+def make_records(n, seed=0):
+    """parsed tracker tuples, FPOGX, FPOGY, FPOGD first and TIME last"""
+    rng = np.random.default_rng(seed)
+    rows = rng.random((n, 14))
+    rows[:, -1] = np.arange(n) / 150.0
+    return [tuple(row) for row in rows.tolist()]
+
+
+def ingest_dicts(records):
+    data_store = []
+    for record in records:
+        data_store.append({"FPOGX": record[0], "FPOGY": record[1], "FPOGD": record[2]})
+    return data_store
+
+
+def ingest_ring(records, batch):
+    buffer = GazeRingBuffer(len(records))
+    for i in range(0, len(records), batch):
+        buffer.extend_records(records[i:i + batch])
+    return buffer
+
+
+def dicts_to_array(data_store):
+    """what scoring had to do with data_store, row by row"""
+    return np.array([[d["FPOGX"], d["FPOGY"], d["FPOGD"]] for d in data_store])
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def allocated(func, *args):
+    tracemalloc.start()
+    result = func(*args)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', type=int, default=200000)
+    parser.add_argument('--batch', type=int, default=16, help='records per recv() chunk')
+    args = parser.parse_args()
+
+    records = make_records(args.samples)
+    n = len(records)
+
+    data_store, t_dicts = timed(ingest_dicts, records)
+    buffer, t_ring = timed(ingest_ring, records, args.batch)
+    print(f"ingest   list of dicts: {n / t_dicts:>12,.0f} samples/s")
+    print(f"ingest   ring buffer:   {n / t_ring:>12,.0f} samples/s (batches of {args.batch})")
+
+    _, dict_bytes = allocated(ingest_dicts, records)
+    print(f"memory   list of dicts: {dict_bytes / n:>8.1f} bytes/sample")
+    print(f"memory   ring buffer:   {buffer.nbytes / buffer.capacity:>8.1f} bytes/sample "
+          f"(preallocated, mirrored)")
+
+    _, t_copy = timed(dicts_to_array, data_store)
+    (_, columns), t_view = timed(buffer.window, 0)
+    print(f"window   list of dicts: {t_copy * 1e3:>10.3f} ms (copy to array)")
+    print(f"window   ring buffer:   {t_view * 1e3:>10.3f} ms (views, shares memory: "
+          f"{np.shares_memory(columns['x'], buffer.columns['x'])})")
+
+
+if __name__ == '__main__':
+    main()
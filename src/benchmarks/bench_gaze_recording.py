@@ -0,0 +1,164 @@
+"""
+benchmark for gaze recordings
+records a synthetic session (pages of tracker records at 60 Hz) the way
+GazepointClient and GazeStream do, then measures the file size against the
+raw tracker stream, read speed, re-scoring speed as a multiple of real time
+(checked against the scores given while recording) and a ReplayClient run;
+also checks that reading from every page_offsets entry gives the same pages
+as reading the whole file, on a recording with rows carried across markers
+
+usage: python src/benchmarks/bench_gaze_recording.py [--pages 20] [--seconds 30] [--speed 50]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GazepointAPI import RECORD_DTYPE, GazepointParser
+from engagement_analysis import EngagementAccumulator, GazeStream, score_fixations, score_recording
+from fake_tracker import synthetic_records
+from gaze_recording import GazeRecorder, ReplayClient, iter_pages, load_recording, page_offsets
+from pupillometry import record_pupils
+
+
+def record_session(path, records, pages, chunk_rows, compression, fast):
+    '''
+    feed records to a recorder and an accumulator in tracker-sized batches,
+    cutting `pages` equal pages; return (live scores, seconds spent recording)
+    '''
+    recorder = GazeRecorder(path, chunk_rows, compression)
+    accumulator = EngagementAccumulator()
+    per_page = len(records) // pages
+    scores, spent = [], 0.0
+    for page in range(pages):
+        for i in range(page * per_page, (page + 1) * per_page, 8):
+            batch = records[i:min(i + 8, (page + 1) * per_page)]
+            start = time.perf_counter()
+            recorder.write(batch, i)
+            spent += time.perf_counter() - start
+            # float32 columns, as the ring buffer hands them to GazeStream
+            rows = np.array(batch, RECORD_DTYPE)
+            accumulator.add_batch(rows['FPOGX'], rows['FPOGY'], rows['TIME'], i, record_pupils(rows))
+        seen, fixation_data, pupil = accumulator.snapshot_and_reset()
+        score = score_fixations(fixation_data, fast, pupil)
+        start = time.perf_counter()
+        recorder.mark(accumulator.cut, samples=seen, score=score)
+        # what ui_main adds after every page, the replay has to skip it
+        recorder.annotate(page=page + 1, flag='flag', normalized=score)
+        spent += time.perf_counter() - start
+        scores.append(score)
+    recorder.close()
+    return scores, spent
+
+
+def carried_session(path, records):
+    '''
+    a recording whose markers cut into written chunks (rows read after the
+    page was scored), with a client restart in between, like a live session
+    '''
+    recorder = GazeRecorder(path, chunk_rows=100)
+    recorder.write(records[:250], 0)
+    recorder.mark(120, page=1)
+    recorder.annotate(flag='a')
+    recorder.write(records[250:400], 250)
+    recorder.mark(180, page=2)
+    recorder.mark(390, page=3)
+    # a new client numbers its records from 0 again
+    recorder.write(records[400:600], 0)
+    recorder.mark(50, page=4)
+    recorder.annotate(flag='b')
+    recorder.write(records[600:700], 200)
+    recorder.mark(260, page=5)
+    recorder.close()
+
+
+def check_page_offsets(path):
+    '''number of pages where starting from the page_offsets entry differs from a full read'''
+    pages = list(iter_pages(path))
+    offsets = page_offsets(path)
+    differ = abs(len(offsets) - len(pages))
+    for (marker, samples), offset in zip(pages, offsets):
+        first, rows = next(iter_pages(path, offset))
+        differ += first != marker or not np.array_equal(rows, samples)
+    return differ
+
+
+async def replay(path, speed):
+    client = ReplayClient(path, speed)
+    stream = GazeStream(client)
+    client.start()
+    future = stream.start().reader_future
+    start = time.perf_counter()
+    while client.finished is None:
+        await asyncio.sleep(0.01)
+    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(client.finished.wait(), client.loop))
+    elapsed = time.perf_counter() - start
+    await asyncio.sleep(0.05)
+    seen = stream.accumulator.seen
+    future.cancel()
+    client.stop()
+    return seen, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=30.0, help='dwell per page')
+    parser.add_argument('--rate', type=float, default=60.0, help='tracker records per second')
+    parser.add_argument('--chunk-rows', type=int, default=1024)
+    parser.add_argument('--compression', type=int, default=6, help='zlib level, 0 for raw chunks')
+    parser.add_argument('--speed', type=float, default=50.0, help='ReplayClient speed, 0 to skip')
+    parser.add_argument('--fast', action='store_true', help='score on the coarse lattice')
+    args = parser.parse_args()
+
+    n = int(args.pages * args.seconds * args.rate)
+    stream = b''.join(synthetic_records(n, args.rate))
+    records = GazepointParser().feed(stream)
+    duration = n / args.rate
+
+    directory = tempfile.mkdtemp(prefix='bench_gaze_recording_')
+    path = os.path.join(directory, 'session.gaze')
+    live, spent = record_session(path, records, args.pages, args.chunk_rows, args.compression, args.fast)
+    size = os.path.getsize(path)
+    print(f"{n} records, {args.pages} pages, {duration:.0f} s of tracker time")
+    print(f"recording: {size / 1e6:.2f} MB ({size / n:.1f} bytes/record), raw tracker stream "
+          f"{len(stream) / 1e6:.2f} MB, {n / spent:,.0f} records/s written")
+
+    start = time.perf_counter()
+    samples, sequences, markers = load_recording(path)
+    t_load = time.perf_counter() - start
+    start = time.perf_counter()
+    pages = sum(1 for _ in iter_pages(path))
+    t_pages = time.perf_counter() - start
+    print(f"load: {len(samples) / t_load:,.0f} records/s, split into {pages} pages in {t_pages * 1e3:.1f} ms")
+    carried = os.path.join(directory, 'carried.gaze')
+    carried_session(carried, records)
+    differ = check_page_offsets(path) + check_page_offsets(carried)
+    print(f"page offsets: {differ} pages differ when read from their offset")
+
+    start = time.perf_counter()
+    results = score_recording(path, args.fast)
+    t_score = time.perf_counter() - start
+    mismatches = sum(1 for (marker, score), expected in zip(results, live) if score != expected)
+    print(f"re-score: {t_score:.2f} s, {duration / t_score:,.0f}x real time, "
+          f"{mismatches} of {len(results)} pages differ from the live scores")
+
+    if args.speed:
+        seen, elapsed = asyncio.run(replay(path, args.speed))
+        print(f"ReplayClient at {args.speed:g}x: {seen} of {n} samples into a GazeStream in {elapsed:.2f} s "
+              f"({duration / elapsed:.1f}x real time)")
+        if seen != n:
+            mismatches += 1
+    if mismatches or differ or pages != args.pages:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+throughput benchmark for the Gazepoint stream parser
+feeds a recorded stream file to GazepointParser in recv()-sized chunks and
+compares it with the former split(" ") collector loop, then measures the
+parser end to end over a socket against the fake tracker; a stream with
+malformed values has to lose only those records
+
+usage: python src/benchmarks/bench_gazepoint_parser.py [--recording stream.txt] [--records 100000]
+"""
+
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_tracker import FakeTracker, read_recording, synthetic_records
+from GazepointAPI import GazepointParser
+
+
+def chunks(stream, size):
+    return [stream[i:i + size] for i in range(0, len(stream), size)]
+
+
+def legacy_parse(chunk):
+    """the collector loop this parser replaced, one dict per chunk
+    raises on a record torn across chunks, which ended the old collector thread
+    """
+    data = chunk.decode().split(" ")
+    keys = ["FPOGX", "FPOGY", "FPOGD"]
+    result = {key: 0 for key in keys}
+    for el in data:
+        for key in keys:
+            if key in el:
+                result[key] = float(el.split("\"")[1])
+    return result
+
+
+def check_malformed(records):
+    '''feed records with empty and non-numeric values in between, return (parsed, malformed)'''
+    bad = [b'<REC FPOGX="" FPOGY="0.5" FPOGD="0.1" TIME="1.0" />\r\n',
+           b'<REC FPOGX="0.5" FPOGY="abc" FPOGD="0.1" TIME="1.0" />\r\n']
+    stream = b''.join(record + bad[i % 2] for i, record in enumerate(records[:1000]))
+    parser = GazepointParser()
+    parsed = sum(len(parser.feed(chunk)) for chunk in chunks(stream, 1024))
+    return parsed, parser.malformed
+
+
+def socket_throughput(records, seconds):
+    tracker = FakeTracker(records, rate=None, port=0).start_in_thread()
+    s = socket.create_connection((tracker.host, tracker.port))
+    s.sendall(b'<SET ID="ENABLE_SEND_DATA" STATE="1" />\r\n')
+    parser = GazepointParser()
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        count += len(parser.feed(s.recv(65536)))
+    elapsed = time.perf_counter() - start
+    s.close()
+    tracker.stop_thread()
+    return count / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recording', help='raw tracker stream file (default: synthetic records)')
+    parser.add_argument('--records', type=int, default=100000, help='synthetic records when no recording is given')
+    parser.add_argument('--chunk', type=int, default=1024, help='bytes per simulated recv()')
+    parser.add_argument('--seconds', type=float, default=2.0, help='duration of the socket run')
+    args = parser.parse_args()
+
+    records = read_recording(args.recording) if args.recording else synthetic_records(args.records)
+    stream_chunks = chunks(b''.join(records), args.chunk)
+    print(f"{len(records)} records, {sum(map(len, stream_chunks)) / 1e6:.1f} MB in {len(stream_chunks)} chunks")
+
+    start = time.perf_counter()
+    gaze_parser = GazepointParser()
+    parsed = sum(len(gaze_parser.feed(chunk)) for chunk in stream_chunks)
+    t_parser = time.perf_counter() - start
+    print(f"GazepointParser.feed:       {parsed / t_parser:>12,.0f} records/s ({parsed} records)")
+
+    start = time.perf_counter()
+    gaze_parser = GazepointParser()
+    parsed_rows = sum(len(gaze_parser.feed_array(chunk)) for chunk in stream_chunks)
+    t_array = time.perf_counter() - start
+    print(f"GazepointParser.feed_array: {parsed_rows / t_array:>12,.0f} records/s")
+
+    start = time.perf_counter()
+    torn = 0
+    for chunk in stream_chunks:
+        try:
+            legacy_parse(chunk)
+        except (ValueError, IndexError):
+            torn += 1
+    t_legacy = time.perf_counter() - start
+    # the old loop produced one dict per chunk, not per record
+    print(f"legacy split loop:          {len(records) / t_legacy:>12,.0f} records/s equivalent "
+          f"({len(stream_chunks)} dicts, {torn} chunks with a torn value)")
+
+    print(f"socket + parser:            {socket_throughput(records, args.seconds):>12,.0f} records/s")
+    if parsed != len(records):
+        sys.exit(f"parser returned {parsed} of {len(records)} records")
+    good, malformed = check_malformed(records)
+    print(f"malformed values: {good} records parsed, {malformed} skipped")
+    if good != min(len(records), 1000) or malformed != good:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+overhead benchmark for metrics.py
+times an empty `with metrics.timed(...)` block and metrics.count() with
+metrics on and with METRICS_ENABLED=0 (in a fresh interpreter, the switch
+is read at import), against a bare loop, and checks that render() gives
+well-formed Prometheus text
+
+usage: python src/benchmarks/bench_metrics.py [--calls 200000]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, src_dir)
+import metrics
+
+PROBE = '''
+import time, metrics
+calls = {calls}
+start = time.perf_counter()
+for _ in range(calls):
+    pass
+bare = time.perf_counter() - start
+start = time.perf_counter()
+for _ in range(calls):
+    with metrics.timed('stage'):
+        pass
+timed = time.perf_counter() - start
+start = time.perf_counter()
+for _ in range(calls):
+    metrics.count('counter')
+counted = time.perf_counter() - start
+print((timed - bare) / calls * 1e9, (counted - bare) / calls * 1e9)
+'''
+
+
+def overhead(calls, enabled):
+    '''(ns per timed block, ns per count) in a fresh interpreter'''
+    env = dict(os.environ, METRICS_ENABLED='1' if enabled else '0')
+    process = subprocess.run([sys.executable, '-c', PROBE.format(calls=calls)], cwd=src_dir, env=env,
+                             capture_output=True, text=True, check=True)
+    return [float(value) for value in process.stdout.split()]
+
+
+def check_exposition():
+    '''problems found in render() after a few observations, [] if none'''
+    metrics.reset()
+    with metrics.timed('page_turn'):
+        metrics.count('samples_ingested', 60)
+    problems = []
+    seen_types = set()
+    for line in metrics.render().splitlines():
+        if line.startswith('# TYPE'):
+            seen_types.add(line.split()[2])
+        elif not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            float(value)
+            if name.split('{')[0].rsplit('_', 1)[0] not in seen_types and name.split('{')[0] not in seen_types:
+                problems.append(f'sample without TYPE: {line}')
+    if 'study_stage_seconds_bucket{stage="page_turn",le="+Inf"} 1' not in metrics.render():
+        problems.append('page_turn +Inf bucket missing')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000)
+    args = parser.parse_args()
+
+    for enabled in (True, False):
+        timed, counted = overhead(args.calls, enabled)
+        print(f"metrics {'on ' if enabled else 'off'}: timed() {timed:7.0f} ns, count() {counted:7.0f} ns per call")
+    problems = check_exposition()
+    print(f"exposition: {'ok' if not problems else problems}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+benchmark for the pupillometry stage
+feeds synthetic tracker pupil streams (with blinks) to PupilFeatures in
+tracker-sized batches and reports the cost per sample against the
+tracker's sample interval, the samples held after a long page (memory must
+not grow with the page), and checks that batched and single-call features
+are identical, that a dilation added after the baseline period is
+measured back, and that only runs of invalid samples as long as a blink
+are counted, not one-sample dropouts or lost track
+
+usage: python src/benchmarks/bench_pupillometry.py [--seconds 600] [--rate 150] [--batch 8]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GazepointAPI import GazepointParser
+from fake_tracker import synthetic_records
+from pupillometry import BASELINE_SECONDS, BLINK_MAX, BLINK_MIN, PupilFeatures
+
+FIELDS = ('LPUPILD', 'LPUPILV', 'RPUPILD', 'RPUPILV', 'TIME')
+
+
+def stream(seconds, rate, seed=0):
+    '''columns of FIELDS of a synthetic stream'''
+    rows = np.array(GazepointParser(FIELDS).feed(b''.join(synthetic_records(int(seconds * rate), rate, seed))))
+    return [rows[:, i] for i in range(len(FIELDS))]
+
+
+def feed(features, columns, batch):
+    for i in range(0, len(columns[-1]), batch):
+        features.add(*[column[i:i + batch] for column in columns])
+    return features.features()
+
+
+def blink_page(rate, dropouts, blinks, lost=2.0):
+    '''
+    columns of FIELDS of a 60 s page with valid pupils except for `dropouts`
+    isolated one-sample dropouts, `blinks` runs of 150 ms and one run of
+    `lost` seconds without track
+    '''
+    time = np.arange(int(60 * rate)) / rate
+    valid = np.ones(len(time))
+    rng = np.random.default_rng(0)
+    # dropouts in the first half, far enough apart to stay isolated
+    valid[rng.choice(np.arange(10, int(30 * rate), 10), dropouts, replace=False)] = 0
+    for start in np.linspace(32, 48, blinks):
+        valid[(time >= start) & (time < start + 0.15)] = 0
+    valid[(time >= 52) & (time < 52 + lost)] = 0
+    pupil = np.where(valid > 0, 0.004, 0.0)
+    return [pupil, valid, pupil, valid, time]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=600.0)
+    parser.add_argument('--rate', type=float, default=150.0)
+    parser.add_argument('--batch', type=int, default=8, help='samples per tracker batch')
+    args = parser.parse_args()
+
+    columns = stream(args.seconds, args.rate)
+    n = len(columns[-1])
+    failures = []
+
+    features = PupilFeatures()
+    start = time.perf_counter()
+    for i in range(0, n, args.batch):
+        features.add(*[column[i:i + args.batch] for column in columns])
+    elapsed = time.perf_counter() - start
+    held = len(features.raw[2]) + len(features.clean[2]) + sum(len(v) for v in features.baseline_values)
+    batched = features.features()
+    per_sample = elapsed / n * 1e6
+    print(f"{n} samples at {args.rate:.0f} Hz in batches of {args.batch}: {per_sample:.1f} us per sample "
+          f"({per_sample * args.rate / 1e4:.2f}% of real time), {held} samples held at the end")
+    print(f"features: {batched}")
+    if held > 2 * args.rate:
+        failures.append(f'{held} samples held')
+
+    whole = PupilFeatures()
+    whole.add(*columns)
+    if whole.features() != batched:
+        failures.append('batched features differ from one call')
+
+    # the same page with and without a 0.2 mm dilation from one second on
+    page = [column[:int(5 * args.rate)].copy() for column in columns]
+    plain = feed(PupilFeatures(), page, args.batch)
+    after = page[-1] - page[-1][0] >= max(1.0, BASELINE_SECONDS)
+    for i in (0, 2):
+        page[i][after & (page[i] > 0)] += 0.0002
+    dilated = feed(PupilFeatures(), page, args.batch)
+    added = dilated['dilation'] - plain['dilation']
+    print(f"0.2 mm step after 1 s: dilation {plain['dilation']:.3f} -> {dilated['dilation']:.3f} mm "
+          f"(+{added:.3f}), peak {plain['peak_dilation']:.3f} -> {dilated['peak_dilation']:.3f} mm")
+    if not 0.15 < added < 0.2 + 1e-6:
+        failures.append(f"added dilation {added:.3f} mm")
+
+    dropouts, blinks = 100, 10
+    page = blink_page(args.rate, dropouts, blinks)
+    counted = feed(PupilFeatures(), page, args.batch)['blinks']
+    print(f"{dropouts} one-sample dropouts, {blinks} blinks of 150 ms and 2 s of lost track: {counted} blinks "
+          f"counted ({BLINK_MIN * 1e3:.0f}-{BLINK_MAX * 1e3:.0f} ms runs)")
+    if counted != blinks:
+        failures.append(f"{counted} blinks counted instead of {blinks}")
+
+    print(f"failures: {failures or 'none'}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+cost of stepping many learners: per-learner scalar updates vs one QEngine call
+each step is the epsilon-greedy choice plus the TD update of run_one_step,
+for n learners over the 18-state space and the 378-state page space
+
+usage: python src/benchmarks/bench_q_engine.py [--learners 1 16 256 4096] [--steps 200]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rl_algo
+from q_engine import QEngine
+
+
+def scalar_steps(tables, states, actions, rewards, next_states, steps, rng, gamma=0.95, learn_rate=0.8):
+    """the Learner.run_one_step arithmetic, one learner at a time"""
+    for step in range(steps):
+        epsilon = np.exp(-step / 35.0)
+        for l, Q in enumerate(tables):
+            s = states[step, l]
+            if rng.random() < epsilon:
+                a = actions[step, l]
+            else:
+                a = np.argmax(Q[s, :])
+            s1 = next_states[step, l]
+            Q[s, a] = (1 - learn_rate) * Q[s, a] + learn_rate * (rewards[step, l] + gamma * np.max(Q[s1, :]))
+
+
+def engine_steps(engine, states, rewards, next_states, steps):
+    for step in range(steps):
+        actions = engine.select(states[step], np.full(engine.n_learners, step))
+        engine.update(states[step], actions, rewards[step], next_states[step])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--learners', type=int, nargs='+', default=[1, 16, 256, 4096])
+    parser.add_argument('--steps', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for consider_page in (False, True):
+        dimensions = rl_algo.state_dimensions(consider_page)
+        n_states = int(np.prod([len(values) for values in dimensions]))
+        print(f"{n_states} states x {len(rl_algo.action_space)} actions")
+        for n in args.learners:
+            states, next_states = (rng.integers(0, n_states, (args.steps, n)) for _ in range(2))
+            actions = rng.integers(0, len(rl_algo.action_space), (args.steps, n))
+            rewards = rng.normal(0.5, 0.5, (args.steps, n))
+
+            tables = [np.zeros((n_states, len(rl_algo.action_space))) for _ in range(n)]
+            start = time.perf_counter()
+            scalar_steps(tables, states, actions, rewards, next_states, args.steps, rng)
+            t_scalar = time.perf_counter() - start
+
+            engine = QEngine(n, dimensions, rl_algo.action_space, seed=0)
+            start = time.perf_counter()
+            engine_steps(engine, states, rewards, next_states, args.steps)
+            t_engine = time.perf_counter() - start
+
+            updates = n * args.steps
+            print(f"  {n:>5} learners: scalar {updates / t_scalar:>12,.0f} updates/s   "
+                  f"QEngine {updates / t_engine:>12,.0f} updates/s   ({t_scalar / t_engine:6.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
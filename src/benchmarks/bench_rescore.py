@@ -0,0 +1,102 @@
+"""
+scaling benchmark for rescore.py
+writes a synthetic cohort of gaze recordings (annotated with flags like
+the app does) and scores it with 1, 2, 4, ... workers, printing pages/s and
+the speedup over one worker; then checks that a second run resumes from the
+finished units without scoring anything
+
+usage: python src/benchmarks/bench_rescore.py [--participants 16] [--seconds 10] [--workers 1 2 4]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from GazepointAPI import GazepointParser
+from fake_tracker import synthetic_records
+from gaze_recording import GazeRecorder
+import rescore
+
+
+def write_cohort(directory, participants, pages, seconds, rate, codes):
+    '''one recording per participant, pages of `seconds` seconds each'''
+    per_page = int(seconds * rate)
+    paths = []
+    for p in range(participants):
+        records = GazepointParser().feed(b''.join(synthetic_records(pages * per_page, rate, seed=p)))
+        path = os.path.join(directory, f'participant{p:03d}.gaze')
+        recorder = GazeRecorder(path, info={'participant': f'participant{p:03d}',
+                                            'group': 'group1' if p % 2 else 'group2'})
+        for page in range(pages):
+            recorder.write(records[page * per_page:(page + 1) * per_page], page * per_page)
+            recorder.mark((page + 1) * per_page, samples=per_page)
+            recorder.annotate(page=page + 1, flag=random.choice(codes))
+        recorder.close()
+        paths.append(path)
+    return paths
+
+
+def run(units, workers, fast, intrinsic):
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(rescore.score_unit, path, first, stop, offset, fast, intrinsic, part_file)
+                   for path, first, stop, offset, part_file in units]
+        results = [future.result() for future in futures]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--participants', type=int, default=16)
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--seconds', type=float, default=10.0, help='dwell per page')
+    parser.add_argument('--rate', type=float, default=60.0)
+    parser.add_argument('--unit-pages', type=int, default=5)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--fast', action='store_true')
+    args = parser.parse_args()
+
+    random.seed(0)
+    directory = tempfile.mkdtemp(prefix='bench_rescore_')
+    intrinsic = rescore.read_intrinsic_scores()
+    paths = write_cohort(directory, args.participants, args.pages, args.seconds, args.rate, sorted(intrinsic))
+    pages = args.participants * args.pages
+    print(f"{args.participants} recordings x {args.pages} pages, {os.cpu_count()} CPUs")
+
+    version = rescore.scoring_version()
+    baseline, reference = None, None
+    print(f"{'workers':>8} {'seconds':>8} {'pages/s':>8} {'speedup':>8}")
+    for workers in args.workers:
+        parts = os.path.join(directory, f'parts_{workers}')
+        os.makedirs(parts)
+        units = rescore.plan_units(paths, args.unit_pages, args.fast, version, parts)
+        results, elapsed = run(units, workers, args.fast, intrinsic)
+        baseline = baseline or elapsed
+        scores = np.concatenate([result['raw_score'] for result in results])
+        if reference is None:
+            reference = scores
+        elif not np.array_equal(scores, reference, equal_nan=True):
+            print(f"scores with {workers} workers differ from the first run")
+            sys.exit(1)
+        print(f"{workers:>8} {elapsed:>8.2f} {pages / elapsed:>8.1f} {baseline / elapsed:>8.2f}")
+
+    # resume: a planned run over the same parts has nothing left to score
+    units = rescore.plan_units(paths, args.unit_pages, args.fast, version, parts)
+    left = [unit for unit in units if not os.path.exists(unit[4])]
+    columns = rescore.write_results([rescore.load_part(unit[4]) for unit in units], directory)
+    print(f"resume: {len(left)} of {len(units)} units left to score, "
+          f"{np.count_nonzero(~np.isnan(columns['normalized_score']))} of {len(columns['page'])} pages normalized")
+    if left:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
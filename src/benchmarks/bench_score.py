@@ -0,0 +1,99 @@
+"""
+benchmark for the fast engagement score
+compares DensemapScore (coarse lattice) against np.sum of the rendered
+Fixpos2Densemap heatmap, the pixel path used by calculate_engagement, and
+checks that pages whose weights calculate_engagement normalizes to 0 (one
+fixation, equal durations) get a finite score on both paths without warnings
+
+usage: python src/benchmarks/bench_score.py [--steps 2 4 8] [--trials 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Fixpos2Densemap import DensemapScore, Fixpos2Densemap
+from engagement_analysis import calculate_engagement
+
+WIDTH, HEIGHT = 1920, 1080
+
+# documented bound in DensemapScore, absolute error on the raw score
+ERROR_BOUND = {2: 1e4, 4: 2e4, 8: 1e5}
+
+
+def page_fixations(rng):
+    """random fixation set rescaled the same way as calculate_engagement"""
+    n = rng.integers(2, 80)
+    fix_arr = np.column_stack([rng.uniform(0, 1, n), rng.uniform(0, 1, n), rng.uniform(0, 1, n)])
+    fix_arr -= fix_arr.min(axis=0)
+    fix_arr /= fix_arr.max(axis=0)
+    fix_arr[:, 0] *= WIDTH
+    fix_arr[:, 1] *= HEIGHT
+    return fix_arr
+
+
+def check_zero_weights():
+    '''problems with pages left without a positive weight, [] if none'''
+    pages = {'one fixation': [[500.0, 300.0, 0.2]],
+             'equal durations': [[500.0, 300.0, 0.2], [900.0, 700.0, 0.2], [1500.0, 100.0, 0.2]]}
+    problems = []
+    for name, rows in pages.items():
+        scores = []
+        for fast in (False, True):
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                try:
+                    scores.append(calculate_engagement(np.array(rows), WIDTH, HEIGHT, fast))
+                except RuntimeWarning as warning:
+                    problems.append(f'{name}, fast={fast}: {warning}')
+                    continue
+            if not np.isfinite(scores[-1]):
+                problems.append(f'{name}, fast={fast}: score {scores[-1]}')
+        if len(scores) == 2 and abs(scores[0] - scores[1]) > ERROR_BOUND[4]:
+            problems.append(f'{name}: pixel {scores[0]:.0f} and lattice {scores[1]:.0f} disagree')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--steps', type=int, nargs='+', default=[2, 4, 8])
+    parser.add_argument('--trials', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    pages = [page_fixations(rng) for _ in range(args.trials)]
+
+    start = time.perf_counter()
+    reference = [float(np.sum(Fixpos2Densemap(fix_arr, WIDTH, HEIGHT, None))) for fix_arr in pages]
+    t_pixel = (time.perf_counter() - start) / args.trials
+
+    print(f"{'step':>6} {'pixel [ms]':>11} {'lattice [ms]':>13} {'max |err|':>10} {'max rel err':>12}")
+    for step in args.steps:
+        start = time.perf_counter()
+        scores = [DensemapScore(fix_arr, WIDTH, HEIGHT, step) for fix_arr in pages]
+        t_lattice = (time.perf_counter() - start) / args.trials
+
+        errors = np.abs(np.array(scores) - np.array(reference))
+        # relative to the part of the score above the flat background
+        signal = np.array(reference) - 128 * WIDTH * HEIGHT
+        print(f"{step:>6} {t_pixel * 1e3:>11.2f} {t_lattice * 1e3:>13.2f} "
+              f"{errors.max():>10.0f} {(errors / signal).max():>12.2e}")
+
+        if step in ERROR_BOUND and errors.max() > ERROR_BOUND[step]:
+            sys.exit(f"step {step} exceeds its documented error bound")
+
+    problems = check_zero_weights()
+    print(f"pages without positive weights: {problems or 'ok'}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
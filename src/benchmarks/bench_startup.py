@@ -0,0 +1,83 @@
+"""
+start-up benchmark for the Flask app
+imports ui_main in fresh interpreters with -X importtime and reports the
+wall time, the slowest imports, which heavy modules were loaded (none of
+cv2, pandas, tqdm should be) and the threads running after the import (no
+tracker client may start); then times ui_main.warm_up(), the part moved
+out of the import, and the heavy modules on their own for comparison
+
+usage: python src/benchmarks/bench_startup.py [--runs 5] [--top 12]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY = ('cv2', 'pandas', 'tqdm')
+
+PROBE = '''
+import json, sys, threading, time
+start = time.perf_counter()
+import ui_main
+imported = time.perf_counter() - start
+start = time.perf_counter()
+ui_main.warm_up() if {warm} else None
+warm = time.perf_counter() - start
+print(json.dumps({{'import': imported, 'warm_up': warm, 'threads': threading.active_count(),
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+
+def run_probe(warm):
+    '''one fresh interpreter importing ui_main, return (result dict, importtime lines)'''
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE.format(warm=warm, heavy=HEAVY)],
+                             cwd=src_dir, capture_output=True, text=True, check=True)
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    return result, [line for line in process.stderr.splitlines() if line.startswith('import time:')]
+
+
+def slowest(lines, top):
+    '''(cumulative us, module) of the slowest imports below ui_main'''
+    imports = []
+    for line in lines[1:]:
+        _, cumulative, name = line.split('|')
+        if name.strip() != name.rstrip():
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=12)
+    args = parser.parse_args()
+
+    run_probe(False)  # byte-compile and fill the page cache first
+    results = [run_probe(False) for _ in range(args.runs)]
+    times = np.array([result['import'] for result, _ in results]) * 1e3
+    result, lines = results[-1]
+    print(f"import ui_main: median {np.median(times):.0f} ms, min {times.min():.0f} ms over {args.runs} runs")
+    print(f"heavy modules loaded: {result['heavy'] or 'none'}, threads after import: {result['threads']}")
+    print("slowest imports (cumulative):")
+    for cumulative, name in slowest(lines, args.top):
+        print(f"  {cumulative / 1e3:8.1f} ms  {name}")
+
+    warm, _ = run_probe(True)
+    print(f"warm_up(): {warm['warm_up'] * 1e3:.0f} ms, loads {warm['heavy']}")
+    process = subprocess.run([sys.executable, '-c', 'import time; t = time.perf_counter(); '
+                              f'import {", ".join(HEAVY)}; print(time.perf_counter() - t)'],
+                             capture_output=True, text=True, check=True)
+    print(f"import {', '.join(HEAVY)} alone: {float(process.stdout) * 1e3:.0f} ms")
+    if result['heavy'] or result['threads'] != 1:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
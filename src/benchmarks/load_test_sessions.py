@@ -0,0 +1,183 @@
+"""
+load test for concurrent participants
+starts one fake tracker per participant and drives the Flask app through
+its test client from one thread per participant: opening page, ratings,
+then every flag page with a short dwell, as a study station would (the
+first flag page is opened at once, so its page turn has nothing to score).
+reports view_flag latency percentiles, pages per second, errors and the
+per-stage p50 / p99 of /metrics, checks that every flag page shows an image
+the page before told the browser to prefetch, and that re-scoring every
+session's gaze recording gives the live scores; then that a replaced
+session is only closed once its request in flight is done, that idle
+sessions are reaped and that a second process cannot take the Q-table
+
+usage: python src/benchmarks/load_test_sessions.py [--participants 8] [--dwell 0.3] [--group group2]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fake_tracker import FakeTracker, synthetic_records
+from engagement_analysis import score_recording
+from engagement_calibration import EngagementCalibration
+from sessions import SessionRegistry
+import rl_algo
+import metrics
+import ui_main
+
+
+PREFETCH = re.compile(r'<link rel="prefetch" href="([^"]+)"')
+IMAGE = re.compile(r'<img src="([^"]+)"')
+
+
+def participant(app, tracker, group, dwell, pages, latencies, errors, prefetch_hits):
+    client = app.test_client()
+    client.post('/submit_group', data={'group': group, 'tracker': f'{tracker.host}:{tracker.port}'})
+    response = client.post('/submit_ratings', data={'familiar': ['1', '3', '5']})
+    if response.status_code != 302:
+        errors.append(f'submit_ratings: {response.status_code}')
+        return
+    prefetched = None
+    for page_num in range(1, pages + 2):
+        # page 1 right after the ratings, with no fixation yet to score, as a quick click would
+        if page_num > 1:
+            time.sleep(dwell)
+        start = time.perf_counter()
+        try:
+            response = client.get(f'/view_flag?page_num={page_num}')
+        except Exception as error:  # the test client re-raises view exceptions
+            errors.append(f'page {page_num}: {error!r}')
+            return
+        if page_num <= pages:
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(f'page {page_num}: {response.status_code}')
+                return
+            html = response.get_data(as_text=True)
+            if prefetched is not None:
+                prefetch_hits.append(IMAGE.search(html).group(1) in prefetched)
+            prefetched = PREFETCH.findall(html)
+            if not prefetched and page_num < pages:
+                errors.append(f'page {page_num}: nothing to prefetch')
+        elif response.status_code != 302:
+            errors.append(f'last page: {response.status_code}')
+
+
+def check_lifecycle(registry, tracker, errors):
+    '''session replacement, idle reaping and the Q-table process lock'''
+    address = (tracker.host, tracker.port)
+    first = registry.create('group1', address)
+    in_flight = threading.Event()
+
+    def request():
+        with first.lock:  # a page turn of the first participant
+            in_flight.set()
+            time.sleep(0.2)
+            if first.closed:
+                errors.append('replaced session closed during its request')
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    in_flight.wait()
+    second = registry.create('group1', address)
+    thread.join()
+    if not first.closed or registry.get(first.participant_id) is not None:
+        errors.append('replaced session left open')
+    if registry.reap(time.monotonic() + registry.idle_timeout + 1) != 1 or not second.closed or len(registry):
+        errors.append('idle session not reaped')
+
+    code = "import sys; from checkpoint import lock_process; lock_process(sys.argv[1])"
+    other = subprocess.run([sys.executable, '-c', code, registry.q_table_file + '.lock'],
+                           cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), capture_output=True)
+    if other.returncode == 0:
+        errors.append('a second process could lock the Q-table')
+    print(f"lifecycle: replaced session closed after its request, idle session reaped, "
+          f"second process {'refused' if other.returncode else 'NOT refused'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--participants', type=int, default=8)
+    parser.add_argument('--dwell', type=float, default=0.3, help='seconds on each page before turning it')
+    parser.add_argument('--pages', type=int, default=ui_main.page_num_max)
+    parser.add_argument('--group', default='group2', help='group1 (control) or group2 (test)')
+    parser.add_argument('--rate', type=float, default=150.0, help='fake tracker records per second')
+    args = parser.parse_args()
+
+    records = synthetic_records(3000, args.rate)
+    trackers = [FakeTracker(records, args.rate, port=0).start_in_thread() for _ in range(args.participants)]
+
+    # keep Q-tables, familiarity files and scores out of the repository
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    os.chdir(workdir)
+    ui_main.registry = SessionRegistry(os.path.join(workdir, 'familiarity'), os.path.join(workdir, 'q_table.npz'),
+                                       os.path.join(workdir, 'transitions.csv'), os.path.join(workdir, 'recordings'),
+                                       os.path.join(workdir, 'metrics'))
+    ui_main.output_dir = workdir
+    rl_algo.engagement_calibration = EngagementCalibration(os.path.join(workdir, 'engagement_calibration.json'))
+    ui_main.page_num_max = args.pages
+
+    latencies, errors, prefetch_hits = [], [], []
+    threads = [threading.Thread(target=participant,
+                                args=(ui_main.app, tracker, args.group, args.dwell, args.pages, latencies, errors,
+                                      prefetch_hits))
+               for tracker in trackers]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for tracker in trackers:
+        tracker.stop_thread()
+
+    recordings = [os.path.join(workdir, 'recordings', name) for name in os.listdir(os.path.join(workdir, 'recordings'))]
+    replayed = 0
+    for path in recordings:
+        for page, (marker, score) in enumerate(score_recording(path), 1):
+            replayed += 1
+            if marker['score'] != score:
+                errors.append(f'{os.path.basename(path)} page {page}: replayed {score}, live {marker["score"]}')
+
+    if latencies:
+        ms = np.array(latencies) * 1e3
+        print(f"{args.participants} participants x {args.pages} pages ({args.group}) in {elapsed:.1f} s, "
+              f"dwell {args.dwell} s")
+        print(f"view_flag latency: p50 {np.percentile(ms, 50):.1f} ms, p99 {np.percentile(ms, 99):.1f} ms, "
+              f"max {ms.max():.1f} ms")
+        print(f"throughput: {len(latencies) / elapsed:.1f} pages/s, open sessions left: {len(ui_main.registry)}")
+        print(f"replayed {replayed} pages from {len(recordings)} gaze recordings")
+        print(f"next image prefetched on {sum(prefetch_hits)} of {len(prefetch_hits)} page turns")
+        if not all(prefetch_hits):
+            errors.append(f'{len(prefetch_hits) - sum(prefetch_hits)} page turns showed an image not prefetched')
+        print("stages (/metrics histograms):")
+        for stage, hist in sorted(metrics.histograms.items()):
+            print(f"  {stage:<16} n {hist.count:>5}  p50 {hist.quantile(0.5) * 1e3:8.2f} ms  "
+                  f"p99 {hist.quantile(0.99) * 1e3:8.2f} ms")
+        print(f"session summaries: {len(os.listdir(os.path.join(workdir, 'metrics')))} in "
+              f"{os.path.join(workdir, 'metrics')}")
+        exposition = ui_main.app.test_client().get('/metrics').get_data(as_text=True)
+        if metrics.enabled and 'study_stage_seconds_count{stage="page_turn"}' not in exposition:
+            errors.append('/metrics has no page_turn histogram')
+    check_lifecycle(ui_main.registry, trackers[0], errors)
+    print(f"errors: {len(errors)}")
+    for error in errors[:10]:
+        print("  " + error)
+    print(f"scores written to {os.path.join(workdir, 'cumulative_scores.csv')}")
+    if errors:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+checks that the precomputed next-flag table gives exactly decide_flag's answer
+for every flag and action, over random familiarity ratings and the edge cases
+(nothing or everything familiar) that hit the random fallback, which both
+paths take from the same seeded random.Random; then times the two.
+On the first --reference ratings, decide_flag, familiar and similar are also
+checked against the pandas versions they replaced (pandas_* below, as in
+the first commit), with the one intended change applied to familiar: it
+compared the level to the string 'Familiar' and so always returned 1.
+
+usage: python src/benchmarks/verify_next_flag_table.py [--ratings 50] [--reference 6] [--seed 0]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import rl_algo
+from flag_index import FlagIndex
+
+
+def write_ratings(path, familiar):
+    with open(path, 'w') as file:
+        file.write('Flag Name,Familiarity Level\n')
+        file.writelines(f'{flag},{2 if known else 1}\n' for flag, known in zip(rl_algo.get_flags(), familiar))
+
+
+def pandas_familiar(flag, fam_path):
+    '''familiar() before FlagIndex, comparing with level 2 instead of the string "Familiar"'''
+    df_fam = pd.read_csv(fam_path)
+    if flag in df_fam[df_fam['Familiarity Level'] == 2]['Flag Name'].values:
+        return 2
+    else:
+        return 1
+
+
+def pandas_similar(current_flag, next_flag):
+    '''similar() before FlagIndex'''
+    csv_path = os.path.join(rl_algo.sim_directory, current_flag+'.csv')
+    df_sim = pd.read_csv(csv_path)
+    sim = float(df_sim[df_sim["Image"] == next_flag]["Similarity"].iloc[0])
+
+    if sim >= rl_algo.sim_high:
+        return 3
+    elif sim >= rl_algo.sim_low and sim < rl_algo.sim_high:
+        return 2
+    else:
+        return 1
+
+
+def pandas_decide_flag(current_flag, action, flags, fam_path, rng):
+    '''decide_flag() before FlagIndex, with the fallback drawn from rng'''
+    (familiarity, similarity) = action
+
+    # sort out (un)familiar flags
+    df_fam = pd.read_csv(fam_path)
+    df_fam = df_fam[df_fam['Flag Name'].isin(flags)]
+    df_fam = df_fam[df_fam['Familiarity Level'] == familiarity]
+    familiar_flags = set(df_fam['Flag Name'])
+    # sort out (dis)similar flags
+    sim_pattern = os.path.join(rl_algo.sim_directory, current_flag +'.csv')
+    df_sim = pd.read_csv(sim_pattern)
+
+    df_sim_filter1 = df_sim[df_sim['Image'].isin(familiar_flags)].sort_values(by=['Similarity'])
+
+    if not df_sim_filter1.empty:
+        if similarity == 3:
+            flag_chosen = df_sim_filter1.iloc[0]['Image']
+        elif similarity == 2:
+            median_index = len(df_sim_filter1) // 2
+            flag_chosen = df_sim_filter1.iloc[median_index]['Image']
+        else:
+            flag_chosen = df_sim_filter1.iloc[-1]['Image']
+    else:
+        flag_chosen = rng.choice([item for item in flags if item != current_flag])
+
+    return flag_chosen
+
+
+def compare_reference(index, fam_path, seed):
+    '''return the lookups where FlagIndex and the pandas versions disagree'''
+    flags = rl_algo.get_flags()
+    mismatches = []
+    for flag in flags:
+        expected, got = pandas_familiar(flag, fam_path), rl_algo.familiar(flag, index)
+        if got != expected:
+            mismatches.append(('familiar', flag, expected, got))
+        for action in rl_algo.action_space:
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = pandas_decide_flag(flag, action, flags, fam_path, random.Random(seed))
+                got = rl_algo.decide_flag(flag, action, flags, index, random.Random(seed))
+            if got != expected:
+                mismatches.append(('decide_flag', flag, action, expected, got))
+            elif pandas_similar(flag, got) != rl_algo.similar(flag, got, index):
+                mismatches.append(('similar', flag, got, pandas_similar(flag, got), rl_algo.similar(flag, got, index)))
+    return mismatches
+
+
+def compare(index, seed):
+    '''return the (flag, action) pairs where the table and decide_flag disagree'''
+    mismatches = []
+    for flag in rl_algo.get_flags():
+        for a, action in enumerate(rl_algo.action_space):
+            # the fallback prints, keep the report readable
+            with contextlib.redirect_stdout(io.StringIO()):
+                expected = rl_algo.decide_flag(flag, action, rl_algo.get_flags(), index, random.Random(seed))
+                got = rl_algo.next_flag_for(flag, a, rl_algo.get_flags(), index, random.Random(seed))
+            if got != expected:
+                mismatches.append((flag, action, expected, got))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ratings', type=int, default=50, help='random familiarity ratings to check')
+    parser.add_argument('--reference', type=int, default=6,
+                        help='ratings also checked against the pandas implementation (slow)')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n = len(rl_algo.get_flags())
+    ratings = [np.zeros(n, bool), np.ones(n, bool)] + [rng.random(n) < rng.uniform(0.05, 0.95)
+                                                       for _ in range(args.ratings)]
+    fam_path = os.path.join(tempfile.mkdtemp(prefix='next_flag_'), 'ratings.csv')
+    checked, fallbacks, failures, referenced = 0, 0, [], 0
+    for i, familiar in enumerate(ratings):
+        write_ratings(fam_path, familiar)
+        index = FlagIndex(rl_algo.get_flags(), rl_algo.sim_directory, fam_path, rl_algo.sim_matrix_path)
+        table = index.transition_table(rl_algo.action_space)
+        fallbacks += int((table < 0).sum())
+        checked += table.size
+        failures += compare(index, args.seed + i)
+        if i < args.reference:
+            failures += compare_reference(index, fam_path, args.seed + i)
+            referenced += 1
+
+        # ratings change: the table must follow the new file
+        write_ratings(fam_path, ~familiar)
+        os.utime(fam_path, ns=(time.time_ns(), time.time_ns() + 1))
+        index.refresh()
+        checked += index.transition_table(rl_algo.action_space).size
+        failures += compare(index, args.seed + i)
+
+    print(f"{checked} (flag, action) pairs over {2 * len(ratings)} ratings, {fallbacks} random fallbacks, "
+          f"{len(failures)} mismatches; {referenced} ratings also checked against the pandas decide_flag, "
+          f"familiar and similar")
+    for failure in failures[:10]:
+        print("  ", failure)
+
+    write_ratings(fam_path, ratings[2])
+    index = FlagIndex(rl_algo.get_flags(), rl_algo.sim_directory, fam_path, rl_algo.sim_matrix_path)
+    pairs = [(flag, a, action) for flag in rl_algo.get_flags() for a, action in enumerate(rl_algo.action_space)] * 20
+    start = time.perf_counter()
+    for flag, _, action in pairs:
+        rl_algo.decide_flag(flag, action, rl_algo.get_flags(), index)
+    t_decide = time.perf_counter() - start
+    start = time.perf_counter()
+    index.transition_table(rl_algo.action_space)
+    t_build = time.perf_counter() - start
+    start = time.perf_counter()
+    for flag, a, _ in pairs:
+        rl_algo.next_flag_for(flag, a, rl_algo.get_flags(), index)
+    t_table = time.perf_counter() - start
+    print(f"decide_flag:   {t_decide / len(pairs) * 1e6:8.2f} us/call")
+    print(f"table lookup:  {t_table / len(pairs) * 1e6:8.2f} us/call (table built in {t_build * 1e3:.2f} ms)")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+similarity threshold calibration
+computes the exact tercile cut points of the pairwise flag similarities and
+writes them to data/similarity_thresholds.json, which rl_algo reads at
+startup as sim_low / sim_high (config.yaml can still override them)
+
+usage: python src/calibrate_thresholds.py [--flags active|complete] [--out data/similarity_thresholds.json]
+       python src/calibrate_thresholds.py --directory data/Similarity --dry-run
+"""
+
+import argparse
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+from rl_config import thresholds_path
+from similarity_matrix import default_matrix_path, load_similarity, read_similarity_csvs, similarity_subset
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+active_directory = os.path.join(parent_dir, 'data', 'Similarity')
+
+QUANTILES = (1 / 3, 2 / 3)
+
+
+def directory_codes(directory):
+    '''codes of the flags with a similarity CSV in directory'''
+    return sorted(os.path.splitext(os.path.basename(f))[0] for f in glob.glob(os.path.join(directory, '*.csv')))
+
+
+def similarity_values(flags=None, directory=active_directory, matrix_path=default_matrix_path):
+    '''Collect the pairwise similarities of a flag set, every (i, j) entry
+    except the missing diagonal, like the CSV rows filter.py used to read
+    input param
+        flags: flag codes, None for every flag of the compiled matrix
+        directory: CSVs to read when the compiled matrix lacks some of the flags
+    return, 1-D float64 array
+    '''
+    if os.path.exists(matrix_path):
+        codes, matrix = load_similarity(matrix_path)
+        if flags is None:
+            block = np.asarray(matrix)
+        elif set(flags) <= set(codes):
+            block = similarity_subset(codes, matrix, flags)
+        else:
+            block = read_similarity_csvs(directory, flags)
+    else:
+        block = read_similarity_csvs(directory, flags if flags is not None else directory_codes(directory))
+    return block[~np.isnan(block)].astype(np.float64)
+
+
+def tercile_thresholds(values, quantiles=QUANTILES):
+    '''exact quantiles of values (linear interpolation between order statistics)'''
+    low, high = np.quantile(values, quantiles)
+    return float(low), float(high)
+
+
+def write_thresholds(path, sim_low, sim_high, **details):
+    '''write the artifact atomically: a JSON object with sim_low, sim_high and how they were computed'''
+    record = {'sim_low': sim_low, 'sim_high': sim_high, **details}
+    with open(path + '.tmp', 'w') as file:
+        json.dump(record, file, indent=1)
+        file.write('\n')
+    os.replace(path + '.tmp', path)
+    return record
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flags', choices=['active', 'complete'], default='active',
+                        help='active: flags of data/Similarity (the ones rl_algo uses), '
+                             'complete: all flags of the compiled matrix')
+    parser.add_argument('--directory', help='use the flags with a CSV in this directory instead')
+    parser.add_argument('--matrix', default=default_matrix_path)
+    parser.add_argument('--out', default=thresholds_path)
+    parser.add_argument('--dry-run', action='store_true', help='print the thresholds without writing them')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    directory = args.directory or active_directory
+    if args.directory or args.flags == 'active':
+        flags = directory_codes(directory)
+        source = os.path.relpath(directory, parent_dir)
+    else:
+        flags = load_similarity(args.matrix)[0]
+        source = os.path.relpath(args.matrix, parent_dir)
+    values = similarity_values(flags, directory, args.matrix)
+    sim_low, sim_high = tercile_thresholds(values)
+    elapsed = time.perf_counter() - start
+
+    n_flags = len(flags)
+    print(f"{n_flags} flags, {len(values)} similarity pairs ({source}), {elapsed * 1e3:.1f} ms")
+    print("X value for the first line (1/3 of total):", sim_low)
+    print("X value for the second line (2/3 of total):", sim_high)
+    if not args.dry_run:
+        write_thresholds(args.out, sim_low, sim_high, quantiles=list(QUANTILES), flags=n_flags,
+                         pairs=len(values), source=source)
+        print(f"written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
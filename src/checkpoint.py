@@ -0,0 +1,167 @@
+"""
+Q-table checkpoints
+versioned .npz files written atomically by a background writer
+"""
+
+import atexit
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+import metrics
+
+FORMAT_VERSION = 1
+
+
+def save_checkpoint(path, q_table, state_space, action_space, steps=0):
+    '''Write a checkpoint atomically: the data goes to a temporary file in the
+    same directory, is flushed to disk and then renamed over path, so a crash
+    leaves either the old or the new checkpoint, never a torn one.
+    input param
+        q_table: (states, actions) array
+        state_space, action_space: lists of tuples, stored so a checkpoint is
+                                   never loaded against a different layout
+        steps: number of Q updates the table has seen
+    '''
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.q_table-', suffix='.tmp', dir=directory)
+    try:
+        with metrics.timed('checkpoint_write'), os.fdopen(fd, 'wb') as file:
+            np.savez(file, version=np.int32(FORMAT_VERSION), q=np.asarray(q_table),
+                     state_space=np.asarray(state_space, np.int8), action_space=np.asarray(action_space, np.int8),
+                     steps=np.int64(steps))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    metrics.count('checkpoint_writes')
+
+
+def lock_process(path):
+    '''Hold an exclusive lock on path (created if missing) until the returned
+    file is closed or the process ends, so only one process learns into a Q-table
+    raise, RuntimeError when another process holds it
+    '''
+    file = open(path, 'a+b')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        raise RuntimeError(f"{path} is held by another process: Q lives in one process, "
+                           f"serve the app with a single worker (threads, not processes)")
+    return file
+
+
+def load_checkpoint(path, state_space=None, action_space=None):
+    '''Read a checkpoint written by save_checkpoint
+    input param
+        state_space, action_space: when given, must match the stored spaces
+    return, (q_table, steps)
+    raise, ValueError for an unknown version or mismatching spaces
+    '''
+    with np.load(path) as data:
+        version = int(data['version'])
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported checkpoint version {version}")
+        for name, expected in (('state_space', state_space), ('action_space', action_space)):
+            if expected is not None and not np.array_equal(data[name], np.asarray(expected, np.int8)):
+                raise ValueError(f"{path}: {name} does not match the current model")
+        return data['q'].copy(), int(data['steps'])
+
+
+class CheckpointWriter:
+    """
+    Saves the latest Q-table snapshot off the request path.
+    update() only stores a reference to the snapshot and returns; the
+    writer thread saves the newest one, so updates that arrive while a
+    write is in flight are coalesced into the next write.
+    flush_every : write after this many updates (1 writes after every step)
+    The pending snapshot is also written by flush(), close() and at
+    interpreter exit.
+    """
+
+    def __init__(self, path, state_space, action_space, flush_every=10):
+        self.path = path
+        self.state_space = state_space
+        self.action_space = action_space
+        self.flush_every = flush_every
+        self.condition = threading.Condition()
+        self.snapshot = None
+        # steps is a running count of Q updates, the writer only compares it
+        self.steps = 0
+        self.pending = 0
+        self.written = 0
+        self.writes = 0
+        self.flush_requested = False
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name='q-checkpoint', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def update(self, q_snapshot, steps):
+        '''hand over a Q-table copy that the caller no longer modifies'''
+        with self.condition:
+            self.snapshot = q_snapshot
+            self.steps = steps
+            self.pending += 1
+            if self.pending >= self.flush_every:
+                self.condition.notify()
+
+    def flush(self, timeout=None):
+        '''write the pending snapshot now and wait until it is on disk'''
+        with self.condition:
+            if self.written >= self.steps or self.closed:
+                return
+            target = self.steps
+            self.error = None
+            self.flush_requested = True
+            self.condition.notify()
+            self.condition.wait_for(lambda: self.written >= target or self.error is not None or self.closed,
+                                    timeout)
+
+    def close(self):
+        '''flush and stop the writer thread'''
+        self.flush()
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        atexit.unregister(self.close)
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or self.flush_requested
+                                        or self.pending >= self.flush_every)
+                if self.pending == 0:
+                    self.flush_requested = False
+                    if self.closed:
+                        return
+                    continue
+                snapshot, steps = self.snapshot, self.steps
+                self.pending = 0
+                self.flush_requested = False
+            try:
+                save_checkpoint(self.path, snapshot, self.state_space, self.action_space, steps)
+                error = None
+            except Exception as e:
+                print(f"Error saving Q-table checkpoint: {e}")
+                error = e
+            with self.condition:
+                self.error = error
+                if error is None:
+                    self.written = max(self.written, steps)
+                    self.writes += 1
+                self.condition.notify_all()
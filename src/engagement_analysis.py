@@ -3,26 +3,198 @@ script for evaluating engagement
 """
 
 import numpy as np
-from Fixpos2Densemap import Fixpos2Densemap
-from GazepointAPI import data_queue
+import metrics
+from Fixpos2Densemap import Fixpos2Densemap, DensemapScore
+from fixations import FixationDetector
+from pupillometry import PupilFeatures, record_pupils
+from GazepointAPI import get_client
+from gaze_recording import iter_pages
 import threading
 
-data_store = []
+# Placeholder dimensions for the UI and areas of interest
+UI_WIDTH, UI_HEIGHT = 1920, 1080
+# engagement points per percent of relative pupil dilation added to the
+# heatmap score, 0 (heatmap only) until it is fitted against the ratings
+PUPIL_WEIGHT = 0.0
 
-def continuous_data_reader():
-    global data_store 
-    while True:
-        data = data_queue.get()
-        # print(data)
-        data_store.append(data)
+class EngagementAccumulator:
+    """
+    Folds gaze samples into the current page's fixation set as they arrive.
+    Samples with a zero gaze point are dropped and the rest go through a
+    streaming fixation detector (see fixations.py, I-VT by default), so the
+    page is scored on its real fixations: centroid in UI pixels and
+    duration, one row each. Only the samples of the fixation still open are
+    held between batches, and each sample costs O(1) amortized. The pupil
+    columns, when given, feed the page's dilation features (see
+    pupillometry.py).
+    The density map and the score are not kept running: calculate_engagement
+    min/max-normalizes the page's fixations to the UI before rasterizing, so
+    a new fixation can move every earlier one and the score is only defined
+    for the whole page. The fixation set is what is built incrementally; the
+    page turn scores it (a few dozen rows, see DensemapScore for fast=True).
+    `end` is the tracker sequence number after the last sample added and
+    `cut` its value at the last snapshot, the page boundary.
+    method, thresholds : fixation detection method ('ivt' or 'idt') and its
+                         keyword arguments, see FixationDetector
+    """
 
-def start_data_reader():
-    thread = threading.Thread(target=continuous_data_reader)
-    thread.daemon = True  
-    thread.start()
+    def __init__(self, method='ivt', capacity=256, **thresholds):
+        self.detector = FixationDetector(method, **thresholds)
+        self.pupils = PupilFeatures()
+        # x, y, duration of the page's fixations, grown when full
+        self.fixations = np.empty((capacity, 3), np.float64)
+        self.lock = threading.Lock()
+        self.end = 0
+        self.cut = 0
+        self.reset()
+
+    def reset(self):
+        self.detector.reset()
+        self.pupils.reset()
+        self.seen = 0
+        self.count = 0
+
+    def _append(self, fixations):
+        n = len(fixations)
+        if self.count + n > len(self.fixations):
+            grown = np.empty((max(2 * len(self.fixations), self.count + n), 3), np.float64)
+            grown[:self.count] = self.fixations[:self.count]
+            self.fixations = grown
+        rows = self.fixations[self.count:self.count + n]
+        rows[:, 0] = fixations['x']
+        rows[:, 1] = fixations['y']
+        rows[:, 2] = fixations['duration']
+        self.count += n
+
+    def add_batch(self, x, y, time, first=None, pupils=None):
+        """
+        x, y   : arrays of gaze points as sent by the tracker (fraction of the screen)
+        time   : array of tracker times in seconds
+        first  : tracker sequence number of the first sample, if known
+        pupils : dict of left_pupil, left_valid, right_pupil, right_valid arrays
+                 (GazeRingBuffer columns), if known
+        """
+        with self.lock:
+            if first is not None:
+                self.end = first + len(x)
+            self.seen += len(x)
+            x, y = np.asarray(x), np.asarray(y)
+            valid = (x != 0) & (y != 0)
+            self._append(self.detector.add(x[valid] * np.float64(UI_WIDTH), y[valid] * np.float64(UI_HEIGHT),
+                                           np.asarray(time)[valid]))
+            if pupils is not None:
+                self.pupils.add(pupils["left_pupil"], pupils["left_valid"],
+                                pupils["right_pupil"], pupils["right_valid"], time)
+
+    def snapshot_and_reset(self):
+        """
+        close the open fixation, return (samples seen, fixation array of
+        x, y, duration rows, pupil feature dict) and start a new page
+        """
+        with self.lock:
+            self._append(self.detector.flush())
+            pupil = self.pupils.features()
+            seen = self.seen
+            fixation_data = self.fixations[:self.count].copy()
+            self.cut = self.end
+            self.reset()
+        return seen, fixation_data, pupil
+
+class GazeStream:
+    """
+    One eye tracker connection feeding one participant's accumulator.
+    client : GazepointClient, default the shared client for GazepointAPI.ADDRESS
+    Page boundaries are marked in the client's recorder, if it has one.
+    """
 
-# Placeholder dimensions for the UI and areas of interest
-UI_WIDTH, UI_HEIGHT = 1920, 1080
+    def __init__(self, client=None):
+        self.client = client or get_client()
+        self.accumulator = EngagementAccumulator()
+        self.pupil_features = None  # of the page scored last
+        self.reader_future = None
+
+    async def continuous_data_reader(self):
+        async for first, columns in self.client.batches(with_sequence=True):
+            # zero-copy views of the samples written since the last batch
+            self.accumulator.add_batch(columns["x"], columns["y"], columns["time"], first, columns)
+
+    def start(self):
+        """
+        Start the tracker client (once) and keep feeding its samples to the accumulator.
+        """
+        if self.reader_future is None:
+            self.reader_future = self.client.submit(self.continuous_data_reader())
+        return self
+
+    def stop(self):
+        """stop reading and close the tracker connection"""
+        if self.reader_future is not None:
+            self.reader_future.cancel()
+            self.reader_future = None
+        self.client.stop()
+
+    def current_engagement_score(self, fast=False):
+        """
+        Score the samples collected since the previous call, see get_current_engagement_score.
+        """
+        with metrics.timed('drain'):
+            seen, fixation_data, pupil = self.accumulator.snapshot_and_reset()
+        self.pupil_features = pupil
+        with metrics.timed('score'):
+            engagement_score = score_fixations(fixation_data, fast, pupil)
+        metrics.count('pages_scored' if engagement_score is not None else 'pages_unscored')
+        metrics.count('fixations_scored', len(fixation_data))
+        recorder = self.client.recorder
+        if recorder is not None:
+            with metrics.timed('record'):
+                recorder.mark(self.accumulator.cut, samples=seen, fixations=len(fixation_data),
+                              pupil=pupil, score=engagement_score)
+        return engagement_score
+
+def score_fixations(fixation_data, fast=False, pupil=None):
+    """
+    Engagement score of one page's fixations (EngagementAccumulator rows).
+    pupil : the page's pupil features, weighted in by PUPIL_WEIGHT
+    """
+    if not len(fixation_data):
+        return None  # Return None or some default value if no data is available
+
+    real_time_engagement_score = calculate_engagement(fixation_data, UI_WIDTH, UI_HEIGHT, fast)
+    engagement_score = (real_time_engagement_score - 265000000)/1000000
+    if PUPIL_WEIGHT and pupil and pupil['relative_dilation'] is not None:
+        engagement_score += PUPIL_WEIGHT * 100 * pupil['relative_dilation']
+
+    return float(engagement_score)
+
+def score_recording(path, fast=False, accumulator=None):
+    """
+    Score every page of a gaze recording the way the live session did, as
+    fast as the scoring allows.
+    return list of (marker, score), marker being the recorded page boundary
+           with the score given at the time
+    """
+    accumulator = accumulator or EngagementAccumulator()
+    results = []
+    for marker, samples in iter_pages(path):
+        accumulator.add_batch(samples["FPOGX"], samples["FPOGY"], samples["TIME"], pupils=record_pupils(samples))
+        _, fixation_data, pupil = accumulator.snapshot_and_reset()
+        results.append((marker, score_fixations(fixation_data, fast, pupil)))
+    return results
+
+gaze_stream = None
+
+def get_gaze_stream():
+    """return the GazeStream of the shared tracker client, created on first use"""
+    global gaze_stream
+    if gaze_stream is None:
+        gaze_stream = GazeStream()
+    return gaze_stream
+
+def start_data_reader():
+    """
+    Start the eye tracker client (once) and keep feeding its samples to the accumulator.
+    """
+    get_gaze_stream().start()
 
 def parse_gaze_data(gaze_data_dic):
     """
@@ -44,16 +216,24 @@ def parse_gaze_data(gaze_data_dic):
 
     return fixation_data
 
-def calculate_engagement(fixation_data, width, height):
+def calculate_engagement(fixation_data, width, height, fast=False):
     """
     Calculate the aggregate engagement level based on fixation data.
+    With fast=True the score is computed on a coarse lattice by
+    DensemapScore instead of summing the rendered color heatmap, see its
+    docstring for the error bound.
     """
-    # Normalize and scale the fixation data
+    # Normalize and scale the fixation data, a column with a single value maps to 0
     fixation_data -= fixation_data.min(axis=0)
-    fixation_data /= fixation_data.max(axis=0)
+    span = fixation_data.max(axis=0)
+    span[span == 0] = 1
+    fixation_data /= span
     fixation_data[:, 0] *= width
     fixation_data[:, 1] *= height
 
+    if fast:
+        return DensemapScore(fixation_data, width, height)
+
     # Generate the heatmap for the entire UI
     heatmap = Fixpos2Densemap(fixation_data, width, height, None)
 
@@ -63,22 +243,10 @@ def calculate_engagement(fixation_data, width, height):
     return engagement_score
 
 
-def get_current_engagement_score():
+def get_current_engagement_score(fast=False):
     """
     Calculate and return the current engagement score based on the latest fixation data.
+    fast: score on a coarse lattice instead of the full heatmap
     """
 
-    if not data_store:
-        return None  # Return None or some default value if no data is available
-
-    filtered_data_store = data_store[::250]
-    filtered2_data_store = [item for item in filtered_data_store if item['FPOGX'] != 0 and item['FPOGY'] != 0]
-    print(filtered2_data_store)
-    fixation_data = parse_gaze_data(filtered2_data_store)
-
-    real_time_engagement_score = calculate_engagement(fixation_data, UI_WIDTH, UI_HEIGHT)
-    engagement_score = (real_time_engagement_score - 265000000)/1000000
-    
-    data_store.clear()
-
-    return engagement_score
\ No newline at end of file
+    return get_gaze_stream().current_engagement_score(fast)
@@ -0,0 +1,224 @@
+"""
+adaptive engagement levels from streaming quantiles
+P2Quantile estimates a quantile in constant memory; EngagementCalibration
+keeps the station-wide distribution of engagement scores (persisted across
+sessions) and gives every participant level edges from their own scores
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+calibration_path = os.path.join(parent_dir, 'data', 'engagement_calibration.json')
+
+# level 1 below the first, 3 above the last; the median is kept for normalize()
+QUANTILES = (1 / 3, 1 / 2, 2 / 3)
+
+
+class P2Quantile:
+    """
+    P-square estimate of the p-quantile of a stream (Jain & Chlamtac, 1985):
+    five markers whose heights follow the minimum, p/2, p, (1+p)/2 quantiles
+    and the maximum, adjusted with a piecewise-parabolic formula. Constant
+    memory; exact while fewer than five values have been seen.
+    """
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def update(self, x):
+        x = float(x)
+        self.count += 1
+        q, n = self.heights, self.positions
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                height = self._parabolic(i, d)
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def _parabolic(self, i, d):
+        q, n = self.heights, self.positions
+        return q[i] + d / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+
+    def value(self):
+        '''current estimate, None before the first value'''
+        if self.count == 0:
+            return None
+        if self.count <= 5:
+            return float(np.quantile(self.heights, self.p))
+        return self.heights[2]
+
+    @classmethod
+    def from_samples(cls, p, samples):
+        '''estimator continuing from a list of samples, markers placed at their exact quantiles'''
+        estimator = cls(p)
+        n = len(samples)
+        if n <= 5:
+            for x in samples:
+                estimator.update(x)
+            return estimator
+        probabilities = [0, p / 2, p, (1 + p) / 2, 1]
+        estimator.count = n
+        estimator.heights = np.quantile(samples, probabilities).tolist()
+        estimator.desired = [1 + (n - 1) * probability for probability in probabilities]
+        positions = [int(round(d)) for d in estimator.desired]
+        for i in (1, 2, 3):
+            positions[i] = min(max(positions[i], positions[i - 1] + 1), n - 4 + i)
+        estimator.positions = positions
+        return estimator
+
+    def to_dict(self):
+        return {'p': self.p, 'count': self.count, 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+    @classmethod
+    def from_dict(cls, state):
+        estimator = cls(state['p'])
+        estimator.count = state['count']
+        estimator.heights = list(state['heights'])
+        estimator.positions = list(state['positions'])
+        estimator.desired = list(state['desired'])
+        return estimator
+
+
+class EngagementQuantiles:
+    """
+    One P2Quantile per entry of QUANTILES over the same stream of scores.
+    The first `exact_limit` scores are kept and the quantiles are exact
+    until then, which covers a whole 20-page session; after that the P2
+    markers start from those exact quantiles.
+    """
+
+    def __init__(self, quantiles=QUANTILES, exact_limit=64):
+        # exact_limit of at least 5, the P2 markers need five samples
+        self.quantiles = list(quantiles)
+        self.estimators = [P2Quantile(p) for p in quantiles]
+        self.exact_limit = exact_limit
+        self.samples = []
+
+    @property
+    def count(self):
+        return max(len(self.samples), self.estimators[0].count)
+
+    def update(self, score):
+        if len(self.samples) < self.exact_limit:
+            self.samples.append(float(score))
+            if len(self.samples) == self.exact_limit:
+                self.estimators = [P2Quantile.from_samples(p, self.samples) for p in self.quantiles]
+            return
+        for estimator in self.estimators:
+            estimator.update(score)
+
+    def values(self):
+        if len(self.samples) < self.exact_limit:
+            if not self.samples:
+                return [None] * len(self.quantiles)
+            return np.quantile(self.samples, self.quantiles).tolist()
+        return [estimator.value() for estimator in self.estimators]
+
+    def edges(self):
+        '''(low, high) level edges, the first and last quantile'''
+        values = self.values()
+        return values[0], values[-1]
+
+    def normalize(self, score):
+        '''score centred on the median and scaled by the spread between the edges'''
+        low, median, high = self.values()
+        return (score - median) / (high - low) if high > low else 0.0
+
+    def to_dict(self):
+        return {'estimators': [estimator.to_dict() for estimator in self.estimators],
+                'exact_limit': self.exact_limit, 'samples': self.samples}
+
+    @classmethod
+    def from_dict(cls, state):
+        quantiles = cls([s['p'] for s in state['estimators']], state.get('exact_limit', 64))
+        quantiles.estimators = [P2Quantile.from_dict(s) for s in state['estimators']]
+        quantiles.samples = list(state.get('samples', []))
+        return quantiles
+
+
+class EngagementCalibration:
+    """
+    Engagement level edges that follow the scores instead of egm_low/egm_high.
+    Every score updates the station-wide estimate, saved to `path` every
+    `save_every` scores and on save(), and the participant's own estimate.
+    edges() uses the participant's quantiles once they have `warmup`
+    scores, the station's before that, and None (fixed egm edges) on a
+    station without history.
+    """
+
+    def __init__(self, path=calibration_path, warmup=5, save_every=20):
+        self.path = path
+        self.warmup = warmup
+        self.save_every = save_every
+        self.lock = threading.Lock()
+        self.station = EngagementQuantiles()
+        if path and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    self.station = EngagementQuantiles.from_dict(json.load(file))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Error loading engagement calibration: {e}")
+
+    def participant(self):
+        '''return a new per-participant estimate to pass to record() and edges()'''
+        return EngagementQuantiles()
+
+    def record(self, score, participant=None):
+        with self.lock:
+            self.station.update(score)
+            save = self.path and self.station.count % self.save_every == 0
+        if participant is not None:
+            participant.update(score)
+        if save:
+            self.save()
+
+    def edges(self, participant=None):
+        if participant is not None and participant.count >= self.warmup:
+            return participant.edges()
+        with self.lock:
+            if self.station.count >= self.warmup:
+                return self.station.edges()
+        return None
+
+    def save(self):
+        '''write the station-wide estimate atomically'''
+        if not self.path:
+            return
+        with self.lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self.station.to_dict(), file)
+            os.replace(tmp_path, self.path)
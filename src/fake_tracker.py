@@ -0,0 +1,180 @@
+"""
+local stand-in for the Gazepoint Control server (Open API, port 4242)
+answers SET commands with ACK and, once ENABLE_SEND_DATA is set, streams
+<REC .../> records from a recorded stream file or synthetic ones
+
+usage: python src/fake_tracker.py [--recording stream.txt] [--rate 60] [--port 4242]
+       python src/fake_tracker.py --write-recording stream.txt --records 10000
+"""
+
+import argparse
+import asyncio
+import re
+import threading
+
+import numpy as np
+
+HOST = '127.0.0.1'
+PORT = 4242
+
+SET_PATTERN = re.compile(rb'<SET ID="([A-Z_]+)" STATE="(\d)"')
+
+
+def synthetic_records(n, rate=60.0, seed=0):
+    '''Generate n records that look like the tracker output at the given rate
+    gaze rests on a fixation for 0.1-0.6 s with a little jitter, then jumps;
+    about 1% of the samples are blinks with invalid pupils
+    return, records: list of bytes, each terminated by CRLF
+    '''
+    rng = np.random.default_rng(seed)
+    records = []
+    fix_id, fix_start, fix_len = 0, 0.0, 0.0
+    fx, fy = 0.5, 0.5
+    for i in range(n):
+        t = i / rate
+        if t - fix_start >= fix_len:
+            fix_id += 1
+            fix_start, fix_len = t, rng.uniform(0.1, 0.6)
+            fx, fy = rng.uniform(0.05, 0.95), rng.uniform(0.05, 0.95)
+        blink = rng.random() < 0.01
+        pupil = 0.0 if blink else 0.004 + 0.0005 * np.sin(t / 3) + rng.normal(0, 0.0001)
+        valid = 0 if blink else 1
+        records.append(
+            (f'<REC TIME="{t:.5f}" FPOGX="{fx + rng.normal(0, 0.003):.5f}" FPOGY="{fy + rng.normal(0, 0.003):.5f}" '
+             f'FPOGS="{fix_start:.5f}" FPOGD="{t - fix_start:.5f}" FPOGID="{fix_id}" FPOGV="1" '
+             f'LEYEX="-0.03120" LEYEY="0.01044" LEYEZ="0.62011" LPUPILD="{pupil:.5f}" LPUPILV="{valid}" '
+             f'REYEX="0.03305" REYEY="0.01107" REYEZ="0.61897" RPUPILD="{pupil * 1.02:.5f}" RPUPILV="{valid}" />\r\n'
+             ).encode())
+    return records
+
+
+def write_recording(path, n, rate=60.0, seed=0):
+    '''write n synthetic records to a stream file'''
+    with open(path, 'wb') as file:
+        file.writelines(synthetic_records(n, rate, seed))
+
+
+def read_recording(path):
+    '''return records of a stream file (raw tracker output) as a list of bytes'''
+    with open(path, 'rb') as file:
+        return [line + b'\r\n' for line in file.read().split(b'\r\n') if line]
+
+
+class FakeTracker:
+    """
+    Asyncio TCP server speaking enough of the Open API for GazepointAPI.
+    records : list of record bytes to replay, looped until the client leaves
+    rate    : records per second, None streams as fast as the socket allows
+    """
+
+    def __init__(self, records=None, rate=60.0, host=HOST, port=PORT):
+        self.records = records if records is not None else synthetic_records(600, rate or 60.0)
+        self.rate = rate
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = 0
+        self.writers = set()
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self.writers.add(writer)
+        sending = asyncio.Event()
+        streamer = asyncio.ensure_future(self.stream(writer, sending))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                match = SET_PATTERN.search(line)
+                if match:
+                    key, state = match.groups()
+                    writer.write(b'<ACK ID="%s" STATE="%s" />\r\n' % (key, state))
+                    if key == b'ENABLE_SEND_DATA' and state == b'1':
+                        sending.set()
+                    elif key == b'ENABLE_SEND_DATA':
+                        sending.clear()
+        except ConnectionError:
+            pass
+        finally:
+            streamer.cancel()
+            self.writers.discard(writer)
+            writer.close()
+
+    async def stream(self, writer, sending):
+        try:
+            while True:
+                for i, record in enumerate(self.records):
+                    await sending.wait()
+                    if writer.is_closing():
+                        return
+                    writer.write(record)
+                    if self.rate:
+                        await asyncio.sleep(1 / self.rate)
+                    elif i % 256 == 0:
+                        await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        # port 0 asks the OS for a free port
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        '''stop listening and drop every open connection'''
+        self.server.close()
+        for writer in list(self.writers):
+            writer.close()
+        await self.server.wait_closed()
+
+    def start_in_thread(self):
+        '''Run the server on its own event loop in a daemon thread, for synchronous callers
+        return, self once the server is listening
+        '''
+        started = threading.Event()
+        self.loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_until_complete(self.start())
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return self
+
+    def stop_thread(self):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recording', help='stream file to replay (default: synthetic records)')
+    parser.add_argument('--rate', type=float, default=60.0, help='records per second, 0 for unthrottled')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--write-recording', metavar='PATH', help='write a synthetic stream file and exit')
+    parser.add_argument('--records', type=int, default=10000, help='records for --write-recording')
+    args = parser.parse_args()
+
+    if args.write_recording:
+        write_recording(args.write_recording, args.records, args.rate or 60.0)
+        return
+
+    records = read_recording(args.recording) if args.recording else None
+    tracker = FakeTracker(records, args.rate or None, port=args.port)
+
+    async def serve():
+        await tracker.start()
+        print(f"fake tracker listening on {tracker.host}:{tracker.port}")
+        await tracker.server.serve_forever()
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+"""
+fixation detection over columns of gaze samples
+velocity-threshold (I-VT) and dispersion-threshold (I-DT) identification,
+vectorized with NumPy, turning the samples of a page into fixation events:
+centroid, start, duration and number of samples
+
+Both detectors work on a stream: called with final=False they only decide
+the samples that later samples can no longer change and report how many
+they consumed, so the caller keeps the rest (at most one open fixation) and
+passes it again with the next batch. Fed in batches or all at once they
+give the same fixations. FixationDetector does that bookkeeping.
+
+Coordinates are pixels, times seconds (the tracker's TIME field).
+"""
+
+import numpy as np
+
+# about one degree of visual angle on a 24" 1920 px wide screen at 60 cm
+PIXELS_PER_DEGREE = 38.0
+
+VELOCITY_THRESHOLD = 100.0 * PIXELS_PER_DEGREE  # px/s, I-VT: slower samples belong to a fixation
+DISPERSION_THRESHOLD = 2.0 * PIXELS_PER_DEGREE  # px, I-DT: (max x - min x) + (max y - min y) of a fixation
+MIN_DURATION = 0.1                             # s between the first and last sample of a fixation
+MAX_GAP = 0.075                                # s, a longer pause between samples (blink, lost track) ends a fixation
+
+FIXATION_DTYPE = np.dtype([('x', np.float64), ('y', np.float64), ('start', np.float64),
+                           ('duration', np.float64), ('count', np.int64)])
+
+METHODS = ('ivt', 'idt')
+
+
+def _fixations(x, y, t, starts, stops):
+    '''FIXATION_DTYPE rows of the sample runs starts[i] .. stops[i]-1'''
+    fixations = np.empty(len(starts), FIXATION_DTYPE)
+    if not len(starts):
+        return fixations
+    # sums over each run alone (not differences of a running total), so a
+    # fixation gets the same centroid however the samples were batched
+    bounds = np.column_stack((starts, stops)).ravel()
+    count = stops - starts
+    fixations['x'] = np.add.reduceat(np.append(x, 0.0), bounds)[::2] / count
+    fixations['y'] = np.add.reduceat(np.append(y, 0.0), bounds)[::2] / count
+    fixations['start'] = t[starts]
+    fixations['duration'] = t[stops - 1] - t[starts]
+    fixations['count'] = count
+    return fixations
+
+
+def ivt(x, y, t, velocity_threshold=VELOCITY_THRESHOLD, min_duration=MIN_DURATION,
+        max_gap=MAX_GAP, final=True):
+    '''
+    Velocity-threshold identification: consecutive samples closer in time
+    than max_gap and moving slower than velocity_threshold form one run, a
+    run lasting min_duration or more is a fixation.
+    x, y, t : 1-D float arrays of the samples in time order
+    final   : False leaves the run still open at the end undecided
+    return (FIXATION_DTYPE array, number of samples consumed)
+    '''
+    n = len(t)
+    if n == 0:
+        return np.empty(0, FIXATION_DTYPE), 0
+    dt = np.diff(t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        velocity = np.hypot(np.diff(x), np.diff(y)) / dt
+    # linked[i]: sample i + 1 continues the run of sample i
+    linked = (dt <= max_gap) & (dt > 0) & (velocity < velocity_threshold)
+    starts = np.flatnonzero(np.concatenate(([True], ~linked)))
+    stops = np.append(starts[1:], n)
+    consumed = n
+    if not final:
+        # the last run may go on in the next batch
+        consumed = int(starts[-1])
+        starts, stops = starts[:-1], stops[:-1]
+    keep = t[stops - 1] - t[starts] >= min_duration
+    starts, stops = starts[keep], stops[keep]
+    return _fixations(x, y, t, starts, stops), consumed
+
+
+def idt(x, y, t, dispersion_threshold=DISPERSION_THRESHOLD, min_duration=MIN_DURATION,
+        max_gap=MAX_GAP, final=True, window=64):
+    '''
+    Dispersion-threshold identification (Salvucci & Goldberg): a window
+    starting at a sample grows while its dispersion, (max x - min x) +
+    (max y - min y), stays within dispersion_threshold and no pause is
+    longer than max_gap; if it lasts min_duration or more it is a fixation
+    and the next window starts after it, otherwise the next window starts
+    one sample later.
+    Each window is measured with running maxima / minima over a slice that
+    doubles until the window ends inside it, so the work is linear in the
+    samples; the Python loop runs once per fixation and per saccade sample.
+    x, y, t : 1-D float arrays of the samples in time order
+    final   : False leaves the window still open at the end undecided
+    return (FIXATION_DTYPE array, number of samples consumed)
+    '''
+    n = len(t)
+    gap = np.concatenate((np.diff(t) > max_gap, [False]))  # gap[i]: pause after sample i
+    starts, stops = [], []
+    i = 0
+    while i < n:
+        size = window
+        while True:
+            stop = min(i + size, n)
+            xs, ys = x[i:stop], y[i:stop]
+            dispersion = (np.maximum.accumulate(xs) - np.minimum.accumulate(xs)
+                          + np.maximum.accumulate(ys) - np.minimum.accumulate(ys))
+            # first sample that would break the window, if any in this slice
+            breaks = dispersion > dispersion_threshold
+            breaks[1:] |= gap[i:stop - 1]
+            end = int(np.argmax(breaks)) if breaks.any() else stop - i
+            if end < stop - i or stop == n:
+                break
+            size *= 2
+        end += i
+        if end == n and not final:
+            break  # may still grow with the next batch
+        if t[end - 1] - t[i] >= min_duration:
+            starts.append(i)
+            stops.append(end)
+            i = end
+        elif end == n:
+            i = n  # too short and nothing left to grow into
+        else:
+            i += 1
+    return _fixations(x, y, t, np.array(starts, np.int64), np.array(stops, np.int64)), i
+
+
+DETECTORS = {'ivt': ivt, 'idt': idt}
+
+
+class FixationDetector:
+    """
+    Streaming fixation detection over batches of samples.
+    method     : 'ivt' or 'idt'
+    thresholds : keyword arguments of the detector (velocity_threshold,
+                 dispersion_threshold, min_duration, max_gap)
+    add() returns the fixations the batch closed and keeps the samples of
+    the one still open; flush() closes it at the end of the page.
+    """
+
+    def __init__(self, method='ivt', **thresholds):
+        if method not in DETECTORS:
+            raise ValueError(f"unknown fixation detection method {method!r}, expected one of {METHODS}")
+        self.method = method
+        self.detect = DETECTORS[method]
+        self.thresholds = thresholds
+        self.reset()
+
+    def reset(self):
+        empty = np.empty(0, np.float64)
+        self.pending = (empty, empty, empty)
+
+    def _run(self, x, y, t, final):
+        px, py, pt = self.pending
+        if len(pt):
+            x, y, t = np.concatenate((px, x)), np.concatenate((py, y)), np.concatenate((pt, t))
+        fixations, consumed = self.detect(x, y, t, final=final, **self.thresholds)
+        self.pending = (x[consumed:], y[consumed:], t[consumed:])
+        return fixations
+
+    def add(self, x, y, t):
+        '''
+        x, y, t : samples of a batch, pixels and seconds
+        return FIXATION_DTYPE array of the fixations that ended in the batch
+        '''
+        return self._run(np.asarray(x, np.float64), np.asarray(y, np.float64), np.asarray(t, np.float64), False)
+
+    def flush(self):
+        '''return the fixations left open (at most one) and start over'''
+        empty = np.empty(0, np.float64)
+        fixations = self._run(empty, empty, empty, True)
+        self.reset()
+        return fixations
+
+
+def detect_fixations(x, y, t, method='ivt', **thresholds):
+    '''FIXATION_DTYPE array of every fixation in a complete run of samples'''
+    if method not in DETECTORS:
+        raise ValueError(f"unknown fixation detection method {method!r}, expected one of {METHODS}")
+    return DETECTORS[method](np.asarray(x, np.float64), np.asarray(y, np.float64),
+                             np.asarray(t, np.float64), final=True, **thresholds)[0]
@@ -0,0 +1,126 @@
+"""
+in-memory similarity / familiarity index for the RL loop
+"""
+
+import os
+
+import numpy as np
+
+from similarity_matrix import load_similarity, read_similarity_csvs, similarity_subset
+
+
+def candidate_position(count, similarity):
+    '''Position decide_flag takes among `count` candidates sorted by ascending
+    similarity: the first for similarity level 3, the median for 2, the last otherwise
+    '''
+    if similarity == 3:
+        return 0
+    elif similarity == 2:
+        return count // 2
+    return count - 1
+
+
+class FlagIndex:
+    """
+    Holds everything decide_flag, similar and familiar need, so a step is a
+    few array lookups instead of reading CSV files.
+
+    codes       : list of flag codes, row/column order of the arrays
+    similarity  : N x N float32 similarity matrix, NaN where there is no entry
+    familiarity : N int8 familiarity levels from the familiarity file (0 if missing)
+    familiar_mask : N bool, True for flags rated familiar (level 2)
+    neighbors   : {level: list of N int arrays}, for every flag the indices of
+                  the other flags with that familiarity level, sorted by
+                  ascending similarity
+    next_flags  : N x actions int array, the flag decide_flag picks for every
+                  (flag, action), -1 where it falls back to a random flag;
+                  built by transition_table() and dropped when familiarity reloads
+    """
+
+    def __init__(self, flags, sim_directory, fam_path, matrix_path=None):
+        '''
+        input param
+            flags: list of flag codes in play
+            sim_directory: directory with one similarity CSV per flag
+            fam_path: familiarity CSV written by /submit_ratings
+            matrix_path: compiled similarity matrix (see similarity_matrix.py),
+                         used instead of the CSVs when it exists
+        '''
+        self.codes = list(flags)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.sim_directory = sim_directory
+        self.fam_path = fam_path
+        self.similarity = self._load_similarity(matrix_path)
+        # sort each row once, missing entries (NaN) go last and are dropped later
+        self._order = np.argsort(self.similarity, axis=1, kind='stable')
+        self._fam_mtime = None
+        self.load_familiarity()
+
+    def _load_similarity(self, matrix_path):
+        if matrix_path is not None and os.path.exists(matrix_path):
+            codes, matrix = load_similarity(matrix_path)
+            if set(self.codes) <= set(codes):
+                return similarity_subset(codes, matrix, self.codes)
+        return read_similarity_csvs(self.sim_directory, self.codes)
+
+    def load_familiarity(self):
+        '''(Re)load the familiarity file and rebuild the familiarity buckets'''
+        import pandas as pd
+        self._fam_mtime = os.stat(self.fam_path).st_mtime_ns
+        df_fam = pd.read_csv(self.fam_path)
+        levels = dict(zip(df_fam['Flag Name'], df_fam['Familiarity Level']))
+        self.familiarity = np.array([levels.get(code, 0) for code in self.codes], np.int8)
+        self.familiar_mask = self.familiarity == 2
+        self.next_flags = None
+        self._table_actions = None
+
+        self.neighbors = {}
+        for level in np.unique(self.familiarity):
+            in_level = self.familiarity == level
+            self.neighbors[int(level)] = [
+                order[in_level[order] & ~np.isnan(self.similarity[i, order])]
+                for i, order in enumerate(self._order)
+            ]
+
+    def refresh(self):
+        '''Reload familiarity if the file changed on disk, return True if it did'''
+        if os.stat(self.fam_path).st_mtime_ns == self._fam_mtime:
+            return False
+        self.load_familiarity()
+        return True
+
+    def familiar(self, flag):
+        '''return 2 for a flag rated familiar, 1 otherwise'''
+        i = self.index.get(flag)
+        return 2 if i is not None and self.familiar_mask[i] else 1
+
+    def similarity_between(self, current_flag, next_flag):
+        '''return similarity of next_flag as listed in current_flag's table'''
+        return float(self.similarity[self.index[current_flag], self.index[next_flag]])
+
+    def transition_table(self, action_space):
+        '''Return next_flags for action_space (list of (familiarity, similarity)
+        tuples), computing it for all flags and actions on first use
+        '''
+        if self.next_flags is not None and (self._table_actions is action_space
+                                            or self._table_actions == list(action_space)):
+            return self.next_flags
+        table = np.full((len(self.codes), len(action_space)), -1, np.intp)
+        for a, (familiarity, similarity) in enumerate(action_space):
+            rows = self.neighbors.get(familiarity)
+            if rows is None:
+                continue
+            for i, candidates in enumerate(rows):
+                if len(candidates):
+                    table[i, a] = candidates[candidate_position(len(candidates), similarity)]
+        self.next_flags = table
+        self._table_actions = action_space
+        return table
+
+    def candidates(self, current_flag, familiarity):
+        '''return indices (into codes) of flags with the given familiarity level,
+        by ascending similarity to current_flag'''
+        rows = self.neighbors.get(familiarity)
+        if rows is None:
+            return np.zeros(0, int)
+        return rows[self.index[current_flag]]
@@ -0,0 +1,91 @@
+"""
+fixed-capacity columnar ring buffer for gaze samples
+"""
+
+import threading
+
+import numpy as np
+
+COLUMNS = ("x", "y", "duration", "left_pupil", "left_valid", "right_pupil", "right_valid", "time")
+COLUMN_DTYPES = {**dict.fromkeys(COLUMNS, np.float32), "time": np.float64}
+# positions of the columns in a GazepointAPI.RECORD_FIELDS tuple
+RECORD_INDEX = {"x": 0, "y": 1, "duration": 2, "left_pupil": 6, "left_valid": 7,
+                "right_pupil": 11, "right_valid": 12, "time": -1}
+
+
+class GazeRingBuffer:
+    """
+    Preallocated ring of gaze samples stored column by column.
+    Every sample is written twice, at slot and slot + capacity, so any run of
+    up to `capacity` consecutive samples is one contiguous slice and
+    window() can return plain NumPy views without copying.
+
+    Samples are addressed by sequence number: the n-th sample ever written
+    has sequence n, and `head` is the sequence of the next one. Samples
+    older than head - capacity have been overwritten.
+
+    One writer (the tracker client) and any number of readers; a view stays
+    valid until the writer laps it, so readers use it right away.
+    """
+
+    def __init__(self, capacity=1 << 16):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(2 * capacity, COLUMN_DTYPES[name]) for name in COLUMNS}
+        self.head = 0
+        self.lock = threading.Lock()
+
+    def extend(self, x, y, duration, time, **pupils):
+        """
+        append samples, each argument is a 1-D array of the same length;
+        only the last `capacity` samples are kept if more are given
+        pupils : left_pupil, left_valid, right_pupil, right_valid columns,
+                 missing ones are stored as 0 (no valid pupil)
+        """
+        n = len(x)
+        values = {"x": x, "y": y, "duration": duration, "time": time}
+        for name in ("left_pupil", "left_valid", "right_pupil", "right_valid"):
+            values[name] = pupils.get(name, np.zeros(n, np.float32))
+        with self.lock:
+            if n > self.capacity:
+                values = {name: column[-self.capacity:] for name, column in values.items()}
+                self.head += n - self.capacity
+                n = self.capacity
+            start = self.head % self.capacity
+            first = min(n, self.capacity - start)
+            for name, column in self.columns.items():
+                value = values[name]
+                column[start:start + first] = value[:first]
+                column[start + self.capacity:start + self.capacity + first] = value[:first]
+                if first < n:
+                    # wrapped: continue at the start of both halves
+                    column[:n - first] = value[first:]
+                    column[self.capacity:self.capacity + n - first] = value[first:]
+            self.head += n
+
+    def extend_records(self, records):
+        """append parsed tracker records (RECORD_FIELDS tuples)"""
+        if not records:
+            return
+        rows = np.array(records, np.float64)
+        self.extend(**{name: rows[:, index] for name, index in RECORD_INDEX.items()})
+
+    def window(self, start):
+        """
+        start : sequence number of the first sample wanted
+        return (first, columns), first is the sequence actually returned
+               (later than start if samples were overwritten) and columns a
+               dict of zero-copy views of samples first .. head-1
+        """
+        with self.lock:
+            head = self.head
+        first = max(start, head - self.capacity, 0)
+        offset = first % self.capacity
+        n = head - first
+        return first, {name: column[offset:offset + n] for name, column in self.columns.items()}
+
+    def __len__(self):
+        return min(self.head, self.capacity)
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
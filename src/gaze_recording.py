@@ -0,0 +1,409 @@
+"""
+binary gaze session recordings
+GazeRecorder appends the parsed tracker records of a session, every field
+of RECORD_FIELDS, and a marker at every page boundary to an append-only
+chunked file; the readers below split a recording back into pages, and
+ReplayClient plays one into a GazeStream in real time (or faster)
+
+file layout: MAGIC, uint32 length and a JSON header (fields, dtype), then
+chunks of CHUNK_HEADER (kind, payload bytes, rows, sequence) + payload
+    SMPL / SMPZ  rows of RECORD_DTYPE, raw / zlib compressed; sequence is
+                 the client sequence number of the first row
+    MARK         JSON object of a page boundary; sequence is the first
+                 sample of the next page
+    NOTE         JSON object of what the app knew after scoring the page
+                 (page number, flag, ...), merged into the previous MARK
+"""
+
+import asyncio
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from GazepointAPI import ADDRESS, RECORD_DTYPE, RECORD_FIELDS, GazepointClient
+
+MAGIC = b'GAZEREC1'
+LENGTH = struct.Struct('<I')
+CHUNK_HEADER = struct.Struct('<4sIIQ')
+SAMPLES, SAMPLES_ZLIB, MARKER, NOTE = b'SMPL', b'SMPZ', b'MARK', b'NOTE'
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+recordings_directory = os.path.join(parent_dir, 'output', 'recordings')
+
+
+def read_header(file):
+    '''read and check the file header, return it as a dict'''
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError(f"{getattr(file, 'name', file)} is not a gaze recording")
+    (length,) = LENGTH.unpack(file.read(LENGTH.size))
+    header = json.loads(file.read(length))
+    if header['fields'] != list(RECORD_FIELDS):
+        raise ValueError(f"recording fields {header['fields']} do not match RECORD_FIELDS")
+    return header
+
+
+def iter_chunks(file):
+    '''
+    yield (kind, rows, sequence, payload) for every complete chunk after the
+    header; a chunk cut short by a crash ends the iteration
+    '''
+    while True:
+        head = file.read(CHUNK_HEADER.size)
+        if len(head) < CHUNK_HEADER.size:
+            return
+        kind, size, rows, sequence = CHUNK_HEADER.unpack(head)
+        payload = file.read(size)
+        if len(payload) < size:
+            return
+        yield kind, rows, sequence, payload
+
+
+def decode_samples(kind, payload):
+    '''payload of a sample chunk as a RECORD_DTYPE array'''
+    if kind == SAMPLES_ZLIB:
+        payload = zlib.decompress(payload)
+    return np.frombuffer(payload, RECORD_DTYPE)
+
+
+class GazeRecorder:
+    """
+    Append-only writer for one recording file, shared by the tracker
+    client thread (write) and the request thread (mark).
+    Rows are buffered and written as one chunk every `chunk_rows` rows and
+    before every marker, so a page is on disk once it has been scored.
+    An existing file is appended to; an incomplete chunk at its end (a
+    crash mid-write) is cut off first.
+    compression : zlib level of the sample chunks, 0 to store them raw
+    info        : JSON-serializable session details (participant, group)
+                  stored in the header of a new file
+    """
+
+    def __init__(self, path, chunk_rows=1024, compression=6, info=None):
+        self.path = path
+        self.info = info or {}
+        self.chunk_rows = chunk_rows
+        self.compression = compression
+        self.lock = threading.Lock()
+        self.pending = []
+        self.pending_rows = 0
+        self.sequence = 0
+        self.samples = 0
+        self.markers = 0
+        self.bytes_written = 0
+        self.file = self._open(path)
+
+    def _open(self, path):
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'rb') as file:
+                read_header(file)
+                end = file.tell()
+                for kind, rows, sequence, payload in iter_chunks(file):
+                    end = file.tell()
+            file = open(path, 'r+b')
+            file.truncate(end)
+            file.seek(end)
+            return file
+        file = open(path, 'wb')
+        header = json.dumps({'fields': list(RECORD_FIELDS), 'dtype': RECORD_DTYPE.descr,
+                             'created': time.time(), **self.info}).encode()
+        file.write(MAGIC + LENGTH.pack(len(header)) + header)
+        return file
+
+    def write(self, records, first):
+        '''
+        records : parsed tracker records, list of RECORD_FIELDS tuples or a RECORD_DTYPE array
+        first   : client sequence number of the first record
+        '''
+        if not len(records):
+            return
+        rows = records if isinstance(records, np.ndarray) else np.array(records, RECORD_DTYPE)
+        with self.lock:
+            if self.file is None:
+                return
+            if not self.pending:
+                self.sequence = first
+            elif first != self.sequence + self.pending_rows:
+                # not contiguous (a new client), start a new chunk
+                self._flush()
+                self.sequence = first
+            self.pending.append(rows)
+            self.pending_rows += len(rows)
+            if self.pending_rows >= self.chunk_rows:
+                self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        rows = np.concatenate(self.pending) if len(self.pending) > 1 else self.pending[0]
+        payload = rows.tobytes()
+        kind = SAMPLES
+        if self.compression:
+            payload, kind = zlib.compress(payload, self.compression), SAMPLES_ZLIB
+        self._write_chunk(kind, len(rows), self.sequence, payload)
+        self.samples += len(rows)
+        self.sequence += len(rows)
+        self.pending = []
+        self.pending_rows = 0
+
+    def _write_chunk(self, kind, rows, sequence, payload):
+        self.file.write(CHUNK_HEADER.pack(kind, len(payload), rows, sequence) + payload)
+        self.bytes_written += CHUNK_HEADER.size + len(payload)
+
+    def mark(self, sequence, **info):
+        '''
+        write a page boundary: the samples before `sequence` belong to the
+        page just scored, info (samples, score, ...) is stored with it
+        '''
+        with self.lock:
+            if self.file is None:
+                return
+            self._flush()
+            marker = {'sequence': sequence, 'time': time.time(), **info}
+            self._write_chunk(MARKER, 0, sequence, json.dumps(marker).encode())
+            self.file.flush()
+            self.markers += 1
+
+    def annotate(self, **info):
+        '''add info to the last page boundary, e.g. the flag it was scored for'''
+        with self.lock:
+            if self.file is None:
+                return
+            self._write_chunk(NOTE, 0, 0, json.dumps(info).encode())
+            self.file.flush()
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self._flush()
+                self.file.flush()
+
+    def close(self):
+        '''write what is buffered and close the file, later writes are ignored'''
+        with self.lock:
+            if self.file is None:
+                return
+            self._flush()
+            self.file.close()
+            self.file = None
+
+
+def load_recording(path):
+    '''
+    read a whole recording
+    return (samples, sequences, markers): RECORD_DTYPE array of every
+           sample, int64 array of their client sequence numbers, and the
+           list of marker dicts in file order
+    '''
+    rows, sequences, markers = [], [], []
+    with open(path, 'rb') as file:
+        read_header(file)
+        for kind, n, sequence, payload in iter_chunks(file):
+            if kind == MARKER:
+                markers.append(json.loads(payload))
+            elif kind == NOTE:
+                if markers:
+                    markers[-1].update(json.loads(payload))
+            else:
+                rows.append(decode_samples(kind, payload))
+                sequences.append(np.arange(sequence, sequence + n, dtype=np.int64))
+    if not rows:
+        return np.empty(0, RECORD_DTYPE), np.empty(0, np.int64), markers
+    return np.concatenate(rows), np.concatenate(sequences), markers
+
+
+def iter_pages(path, start=None):
+    '''
+    yield (marker, samples) for every page of a recording, samples being the
+    RECORD_DTYPE rows the live session scored for it: those written before
+    the marker with a sequence below marker['sequence']. Later rows written
+    before the marker were not read yet and go to the next page. Samples
+    after the last marker (an unfinished page) are not yielded. A page is
+    yielded once the next marker (or the end) is read, with its NOTEs
+    merged into the marker.
+    start : an entry of page_offsets(path), to begin at that page without
+            reading the pages before it
+    '''
+    pending = []
+    page = None
+    with open(path, 'rb') as file:
+        read_header(file)
+        if start is not None:
+            offset, carried = start
+            for chunk, first in carried:
+                file.seek(chunk)
+                kind, n, sequence, payload = next(iter_chunks(file))
+                pending.append((first, decode_samples(kind, payload)[first - sequence:]))
+            file.seek(offset)
+        for kind, n, sequence, payload in iter_chunks(file):
+            if kind == NOTE:
+                if page is not None:
+                    page[0].update(json.loads(payload))
+                continue
+            if kind != MARKER:
+                if pending and sequence < pending[-1][0]:
+                    # sequence numbers start over: a new client, the rest of the old one was never scored
+                    pending = []
+                pending.append((sequence, decode_samples(kind, payload)))
+                continue
+            if page is not None:
+                yield page
+            marker = json.loads(payload)
+            cut = marker['sequence']
+            rows_of_page, rest = [], []
+            for first, rows in pending:
+                split = min(max(cut - first, 0), len(rows))
+                if split:
+                    rows_of_page.append(rows[:split])
+                if split < len(rows):
+                    rest.append((first + split, rows[split:]))
+            pending = rest
+            page = (marker, np.concatenate(rows_of_page) if rows_of_page else np.empty(0, RECORD_DTYPE))
+    if page is not None:
+        yield page
+
+
+def iter_chunk_headers(file):
+    '''
+    yield (offset, kind, size, rows, sequence) for every complete chunk after
+    the header without reading the payloads; the file position is only
+    defined right after a yield, at the payload
+    '''
+    length = os.fstat(file.fileno()).st_size
+    offset = file.tell()
+    while True:
+        file.seek(offset)
+        head = file.read(CHUNK_HEADER.size)
+        if len(head) < CHUNK_HEADER.size:
+            return
+        kind, size, rows, sequence = CHUNK_HEADER.unpack(head)
+        end = offset + CHUNK_HEADER.size + size
+        if end > length:
+            # cut short by a crash
+            return
+        yield offset, kind, size, rows, sequence
+        offset = end
+
+
+def count_pages(path):
+    '''number of page markers of a recording, found without reading the samples'''
+    with open(path, 'rb') as file:
+        read_header(file)
+        return sum(kind == MARKER for _, kind, _, _, _ in iter_chunk_headers(file))
+
+
+def page_offsets(path):
+    '''
+    where every page of a recording starts, found from the chunk headers and
+    markers alone, without reading the samples
+    return, one (offset, carried) per page: offset is the file position after
+           the previous marker, carried the (chunk offset, first sequence) of
+           the rows written before it that belong to the page (see iter_pages);
+           iter_pages(path, start=entry) begins at that page
+    '''
+    offsets = []
+    pending = []  # (chunk offset, first sequence, rows) as iter_pages keeps them
+    with open(path, 'rb') as file:
+        read_header(file)
+        start = (file.tell(), [])
+        for offset, kind, size, n, sequence in iter_chunk_headers(file):
+            if kind == NOTE:
+                continue
+            if kind != MARKER:
+                if pending and sequence < pending[-1][1]:
+                    pending = []
+                pending.append((offset, sequence, n))
+                continue
+            offsets.append(start)
+            cut = json.loads(file.read(size))['sequence']
+            rest = []
+            for chunk, first, rows in pending:
+                split = min(max(cut - first, 0), rows)
+                if split < rows:
+                    rest.append((chunk, first + split, rows - split))
+            pending = rest
+            start = (offset + CHUNK_HEADER.size + size, [(chunk, first) for chunk, first, _ in pending])
+    return offsets
+
+
+def read_info(path):
+    '''header of a recording: fields, dtype, created and the recorder's info'''
+    with open(path, 'rb') as file:
+        return read_header(file)
+
+
+class ReplayClient(GazepointClient):
+    """
+    GazepointClient that plays a recording into its ring buffer instead of
+    connecting to a tracker, so a GazeStream can run on it unchanged.
+    speed : 1.0 paces the samples by their TIME field, 10.0 ten times
+            faster, None feeds them as fast as the consumer keeps up
+    repeat: start over at the end instead of stopping
+    Page markers are not replayed, the consumer decides its own pages; use
+    iter_pages to score recorded pages exactly as they were.
+    """
+
+    def __init__(self, path, speed=1.0, repeat=False, batch_seconds=0.02, capacity=1 << 16):
+        super().__init__(ADDRESS, capacity)
+        self.path = path
+        self.speed = speed
+        self.repeat = repeat
+        self.batch_seconds = batch_seconds
+        self.finished = None
+
+    async def run(self):
+        self.finished = asyncio.Event()
+        self.connects += 1
+        self.connected = True
+        # a moment for consumers submitted together with start() to subscribe
+        await asyncio.sleep(self.batch_seconds)
+        try:
+            while True:
+                await self.play()
+                if not self.repeat:
+                    break
+        finally:
+            self.connected = False
+            self.finished.set()
+
+    async def play(self):
+        clock = asyncio.get_running_loop().time
+        anchor, previous = None, None
+        with open(self.path, 'rb') as file:
+            read_header(file)
+            for kind, n, sequence, payload in iter_chunks(file):
+                if kind in (MARKER, NOTE):
+                    continue
+                rows = decode_samples(kind, payload)
+                times = rows['TIME']
+                if self.speed:
+                    # batches of batch_seconds of tracker time
+                    step = self.batch_seconds
+                    bounds = np.searchsorted(times, np.arange(times[0] + step, times[-1] + step, step))
+                    starts = np.concatenate(([0], bounds))
+                else:
+                    starts = np.array([0])
+                for start, end in zip(starts, np.append(starts[1:], len(rows))):
+                    if start >= end:
+                        continue
+                    batch = rows[start:end]
+                    if self.speed:
+                        t = float(batch['TIME'][0])
+                        if previous is None or t < previous:
+                            # first sample, or tracker time went back (a new session in the file)
+                            anchor = (clock(), t)
+                        previous = t
+                        delay = anchor[0] + (t - anchor[1]) / self.speed - clock()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    self.buffer.extend(batch['FPOGX'], batch['FPOGY'], batch['FPOGD'], batch['TIME'],
+                                       left_pupil=batch['LPUPILD'], left_valid=batch['LPUPILV'],
+                                       right_pupil=batch['RPUPILD'], right_valid=batch['RPUPILV'])
+                    self.ready.set()
+                    if not self.speed:
+                        await asyncio.sleep(0)
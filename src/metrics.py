@@ -0,0 +1,231 @@
+"""
+latency and throughput metrics of the page-turn path
+process-wide counters and stage histograms, rendered in the Prometheus text
+format for /metrics, plus per-session stage timings summarized (p50 / p99)
+when a participant's session ends
+
+    with metrics.timed('score'):
+        ...
+    metrics.count('fixations_scored', len(fixation_data))
+
+Stages timed on the request thread while a session is active (see
+session()) are also kept for that session. Set METRICS_ENABLED=0 to turn
+everything into no-ops.
+"""
+
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+enabled = os.environ.get('METRICS_ENABLED', '1') != '0'
+
+# upper bounds in seconds, from 0.1 ms to 10 s
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+STAGE_HELP = 'Seconds spent in each stage of a page turn'
+COUNTER_HELP = {
+    'samples_ingested': 'Gaze samples received from the tracker',
+    'samples_dropped': 'Gaze samples overwritten in the ring buffer before they were read',
+    'records_malformed': 'Tracker records skipped for a value that is not a number',
+    'fixations_scored': 'Fixations passed to the engagement score',
+    'pages_scored': 'Pages given an engagement score',
+    'pages_unscored': 'Pages without a fixation to score',
+    'q_updates': 'Q-table updates',
+    'checkpoint_writes': 'Q-table checkpoints written to disk',
+}
+_NULL = nullcontext()
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram as Prometheus expects: per bucket the
+    number of observations at or below its bound, plus sum and count.
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        '''(cumulative buckets, sum, count) read together'''
+        with self.lock:
+            counts, total, n = list(self.counts), self.sum, self.count
+        return list(zip(self.bounds + [float('inf')], np.cumsum(counts).tolist())), total, n
+
+    def cumulative(self):
+        '''(bound, observations <= bound) pairs, the last bound is +Inf'''
+        return self.snapshot()[0]
+
+    def quantile(self, q):
+        '''q-quantile interpolated within its bucket, like histogram_quantile(); None when empty'''
+        buckets = self.cumulative()
+        total = buckets[-1][1]
+        if total == 0:
+            return None
+        rank = q * total
+        lower, below = 0.0, 0
+        for bound, cumulative in buckets:
+            if cumulative >= rank:
+                if bound == float('inf'):
+                    return lower
+                return lower + (bound - lower) * (rank - below) / max(cumulative - below, 1)
+            lower, below = bound, cumulative
+        return lower
+
+
+class SessionMetrics:
+    """
+    Stage timings and counters of one participant's session, kept in full
+    (a session is a few dozen pages) so summary() gives exact percentiles.
+    """
+
+    def __init__(self, participant_id=''):
+        self.participant_id = participant_id
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.stages.setdefault(stage, []).append(seconds)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        '''{participant, seconds, counters, stages: {stage: count, p50_ms, p99_ms, max_ms, total_ms}}'''
+        with self.lock:
+            stages = {stage: np.array(values) * 1e3 for stage, values in self.stages.items()}
+            counters = dict(self.counters)
+        return {
+            'participant': self.participant_id,
+            'seconds': time.time() - self.started,
+            'counters': counters,
+            'stages': {stage: {'count': len(ms), 'p50_ms': float(np.percentile(ms, 50)),
+                               'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max()),
+                               'total_ms': float(ms.sum())}
+                       for stage, ms in stages.items()},
+        }
+
+    def dump(self, path):
+        '''write summary() as JSON, atomically'''
+        with open(path + '.tmp', 'w') as file:
+            json.dump(self.summary(), file, indent=1)
+        os.replace(path + '.tmp', path)
+
+
+histograms = {}
+counters = {}
+_registry_lock = threading.Lock()
+_session = contextvars.ContextVar('metrics_session', default=None)
+
+
+def histogram(stage):
+    hist = histograms.get(stage)
+    if hist is None:
+        with _registry_lock:
+            hist = histograms.setdefault(stage, Histogram())
+    return hist
+
+
+def observe(stage, seconds):
+    '''record one duration of a stage, in the process histogram and the active session'''
+    if not enabled:
+        return
+    histogram(stage).observe(seconds)
+    session_metrics = _session.get()
+    if session_metrics is not None:
+        session_metrics.observe(stage, seconds)
+
+
+def count(name, n=1):
+    '''add n to a process counter (and the active session's)'''
+    if not enabled:
+        return
+    with _registry_lock:
+        counters[name] = counters.get(name, 0) + n
+    session_metrics = _session.get()
+    if session_metrics is not None:
+        session_metrics.count(name, n)
+
+
+class _Timer:
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+def timed(stage):
+    '''context manager timing its block as `stage`; a shared no-op when disabled'''
+    return _Timer(stage) if enabled else _NULL
+
+
+@contextmanager
+def session(session_metrics):
+    '''attribute the stages and counts of the block (this thread / task) to a SessionMetrics'''
+    token = _session.set(session_metrics)
+    try:
+        yield session_metrics
+    finally:
+        _session.reset(token)
+
+
+def _number(value):
+    return '+Inf' if value == float('inf') else f'{value:g}'
+
+
+def render():
+    '''all metrics in the Prometheus text exposition format (version 0.0.4)'''
+    lines = []
+    with _registry_lock:
+        counter_values = dict(counters)
+        stages = dict(histograms)
+    for name in sorted(set(COUNTER_HELP) | set(counter_values)):
+        metric = f'study_{name}_total'
+        lines.append(f'# HELP {metric} {COUNTER_HELP.get(name, name)}')
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric} {counter_values.get(name, 0)}')
+    metric = 'study_stage_seconds'
+    lines.append(f'# HELP {metric} {STAGE_HELP}')
+    lines.append(f'# TYPE {metric} histogram')
+    for stage in sorted(stages):
+        buckets, total, n = stages[stage].snapshot()
+        for bound, cumulative in buckets:
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="{_number(bound)}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{stage="{stage}"}} {total:.9g}')
+        lines.append(f'{metric}_count{{stage="{stage}"}} {n}')
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    '''forget every process metric'''
+    with _registry_lock:
+        histograms.clear()
+        counters.clear()
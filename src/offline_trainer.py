@@ -0,0 +1,139 @@
+"""
+offline Q-learning from logged transitions
+pretrains the Q-table from transitions.csv files of earlier sessions before
+a study cohort starts; the result is written with rl_algo.save_q_table
+
+usage: python src/offline_trainer.py output/transitions.csv [more.csv ...] [--out src/q_table.npz]
+       python src/offline_trainer.py --synthetic 1000000      (throughput check on random transitions)
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import rl_algo
+from rl_config import load_rl_config
+from transitions import read_transitions
+
+
+def empirical_model(s, a, r, s1, n_states, n_actions):
+    '''Summarize transitions per (state, action) cell
+    return, (counts, mean_reward, next_state_probability)
+            counts: (states * actions,) transitions per cell
+            mean_reward: (states * actions,) average reward, 0 for unseen cells
+            next_state_probability: (states * actions, states) empirical distribution of s1
+    '''
+    cells = n_states * n_actions
+    cell = s * n_actions + a
+    counts = np.bincount(cell, minlength=cells).astype(np.float64)
+    seen = counts > 0
+    mean_reward = np.bincount(cell, weights=r, minlength=cells)
+    mean_reward[seen] /= counts[seen]
+    next_state_probability = np.bincount(cell * n_states + s1, minlength=cells * n_states)
+    next_state_probability = next_state_probability.reshape(cells, n_states).astype(np.float64)
+    next_state_probability[seen] /= counts[seen, None]
+    return counts, mean_reward, next_state_probability
+
+
+def fitted_q(s, a, r, s1, n_states, n_actions, gamma=0.95, iterations=500, tol=1e-8, q_init=None):
+    '''Batched fitted-Q iteration
+    Every iteration sets each visited cell to the mean of r + gamma * max Q[s1]
+    over all its logged transitions. The transitions are first reduced to an
+    empirical model, so an iteration costs O(states^2 * actions) whatever the
+    number of transitions. Unvisited cells keep their q_init value.
+    return, (Q, iterations run)
+    '''
+    counts, mean_reward, next_state_probability = empirical_model(s, a, r, s1, n_states, n_actions)
+    seen = counts > 0
+    Q = np.zeros(n_states * n_actions) if q_init is None else np.array(q_init, np.float64).ravel()
+    for iteration in range(1, iterations + 1):
+        target = mean_reward + gamma * (next_state_probability @ Q.reshape(n_states, n_actions).max(axis=1))
+        delta = np.max(np.abs(target[seen] - Q[seen]), initial=0.0)
+        Q[seen] = target[seen]
+        if delta < tol:
+            break
+    return Q.reshape(n_states, n_actions), iteration
+
+
+def replay(s, a, r, s1, n_states, n_actions, gamma=0.95, learn_rate=0.8, epochs=20, batch_size=256,
+           seed=0, q_init=None):
+    '''Experience replay with the update rule of Learner.run_one_step
+    Transitions are shuffled every epoch and applied in minibatches; all
+    transitions of a batch see the same Q, and several hitting one cell are
+    averaged into one update.
+    return, Q
+    '''
+    rng = np.random.default_rng(seed)
+    cells = n_states * n_actions
+    cell = s * n_actions + a
+    Q = np.zeros(n_states * n_actions) if q_init is None else np.array(q_init, np.float64).ravel()
+    for _ in range(epochs):
+        order = rng.permutation(len(s))
+        for start in range(0, len(order), batch_size):
+            batch = order[start:start + batch_size]
+            target = r[batch] + gamma * Q.reshape(n_states, n_actions)[s1[batch]].max(axis=1)
+            counts = np.bincount(cell[batch], minlength=cells)
+            hit = counts > 0
+            mean_target = np.bincount(cell[batch], weights=target, minlength=cells)[hit] / counts[hit]
+            Q[hit] = (1 - learn_rate) * Q[hit] + learn_rate * mean_target
+    return Q.reshape(n_states, n_actions)
+
+
+def synthetic_transitions(n, n_states, n_actions, seed=0):
+    '''random transitions for throughput checks'''
+    rng = np.random.default_rng(seed)
+    s = rng.integers(0, n_states, n)
+    a = rng.integers(0, n_actions, n)
+    s1 = rng.integers(0, n_states, n)
+    r = rng.normal(0.0, 0.5, n) + 0.2 * a
+    return s, a, r, s1
+
+
+def main():
+    # the live learner's hyperparameters, rl_model in config.yaml
+    config = load_rl_config()
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='*', help='transitions.csv files')
+    parser.add_argument('--out', default=rl_algo.shaped_path(rl_algo.q_table_path),
+                        help='Q-table to write (.npz checkpoint or .pkl)')
+    parser.add_argument('--method', choices=['fitted', 'replay'], default='fitted')
+    parser.add_argument('--gamma', type=float, default=config['discount_factor'],
+                        help='default rl_model.discount_factor of config.yaml')
+    parser.add_argument('--learn-rate', type=float, default=config['learning_rate'],
+                        help='replay only, default rl_model.learning_rate of config.yaml')
+    parser.add_argument('--epochs', type=int, default=20, help='replay only')
+    parser.add_argument('--iterations', type=int, default=500, help='fitted only')
+    parser.add_argument('--init', help='start from this Q-table instead of zeros')
+    parser.add_argument('--synthetic', type=int, help='train on this many random transitions, nothing is written')
+    args = parser.parse_args()
+
+    n_states, n_actions = len(rl_algo.state_space), len(rl_algo.action_space)
+    if args.synthetic:
+        s, a, r, s1 = synthetic_transitions(args.synthetic, n_states, n_actions)
+    elif args.logs:
+        s, a, r, s1 = read_transitions(args.logs, n_states)
+    else:
+        parser.error('give transition logs or --synthetic')
+    q_init = rl_algo.load_q_table(args.init) if args.init else None
+
+    start = time.perf_counter()
+    if args.method == 'fitted':
+        Q, iterations = fitted_q(s, a, r, s1, n_states, n_actions, args.gamma, args.iterations, q_init=q_init)
+        detail, processed = f"{iterations} iterations", len(s)
+    else:
+        Q = replay(s, a, r, s1, n_states, n_actions, args.gamma, args.learn_rate, args.epochs, q_init=q_init)
+        detail, processed = f"{args.epochs} epochs", len(s) * args.epochs
+    elapsed = time.perf_counter() - start
+    covered = len(np.unique(s * n_actions + a))
+    print(f"{len(s)} transitions, {covered} of {n_states * n_actions} state-action cells visited")
+    print(f"{args.method}: {detail} in {elapsed:.3f} s, {processed / elapsed:,.0f} transitions/s")
+
+    if not args.synthetic:
+        rl_algo.save_q_table(Q, filename=args.out, steps=len(s))
+        print(f"Q-table written to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""
+pupil dilation features of a page from the tracker's eye streams
+left / right pupil diameter (LPUPILD / RPUPILD, meters) and validity
+(LPUPILV / RPUPILV) per sample are merged into one diameter, samples
+without a valid pupil and the samples around them are masked, and the rest
+is reduced to a few baseline-corrected dilation features per page. A run of
+invalid samples is a blink when it lasts as long as one (BLINK_MIN ..
+BLINK_MAX, from its first invalid sample to the next valid one); shorter
+runs are tracker dropouts and longer ones lost track, masked but not counted:
+
+    baseline          median diameter over the first baseline_seconds of the page, mm
+    dilation          mean diameter after the baseline period minus the baseline, mm
+    peak_dilation     largest `window`-second rolling mean after the baseline period minus the baseline, mm
+    relative_dilation dilation / baseline
+    blinks            runs of samples without a valid pupil lasting BLINK_MIN .. BLINK_MAX
+    blink_rate        blinks per minute of the page
+    valid_fraction    share of the page's samples left after blink masking
+
+PupilFeatures works on a stream in bounded memory: it only keeps the last
+blink_pad + window seconds of samples and the baseline period. Diameters
+are held as integer micrometers so rolling and running sums are exact, and
+the features do not depend on how the samples were batched.
+"""
+
+import numpy as np
+
+MIN_DIAMETER, MAX_DIAMETER = 1.5e-3, 9e-3  # m, a diameter outside is a tracking error
+BASELINE_SECONDS = 0.5  # page onset, before the response to the new flag sets in
+BLINK_PAD = 0.1         # s masked on both sides of a blink, the lid distorts the pupil there
+WINDOW = 0.25           # s, rolling mean of the peak dilation
+BLINK_MIN, BLINK_MAX = 0.05, 0.5  # s, duration of a blink; shorter is a dropout, longer lost track
+
+
+def merge_eyes(left, left_valid, right, right_valid):
+    '''
+    one diameter per sample: mean of the valid eyes, in integer micrometers
+    return (diameters int64, bad), bad where neither eye has a plausible pupil
+    '''
+    left, right = np.asarray(left, np.float64), np.asarray(right, np.float64)
+    left_ok = (np.asarray(left_valid) > 0) & (left >= MIN_DIAMETER) & (left <= MAX_DIAMETER)
+    right_ok = (np.asarray(right_valid) > 0) & (right >= MIN_DIAMETER) & (right <= MAX_DIAMETER)
+    both = left_ok & right_ok
+    diameter = np.where(both, (left + right) / 2, np.where(left_ok, left, right))
+    bad = ~(left_ok | right_ok)
+    return np.where(bad, 0, np.rint(diameter * 1e6)).astype(np.int64), bad
+
+
+class PupilFeatures:
+    """
+    Streaming pupillometry of one page at a time.
+    add() takes the pupil columns of a batch, features() closes the page
+    and returns its feature dict (see the module docstring), reset()
+    starts the next page without returning anything.
+    """
+
+    def __init__(self, baseline_seconds=BASELINE_SECONDS, blink_pad=BLINK_PAD, window=WINDOW):
+        self.baseline_seconds = baseline_seconds
+        self.blink_pad = blink_pad
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        empty_int, empty_bool, empty_time = np.empty(0, np.int64), np.empty(0, bool), np.empty(0, np.float64)
+        # samples waiting for blink masking, the first `masked` of them already passed on (context)
+        self.raw = (empty_int, empty_bool, empty_time)
+        self.masked = 0
+        # masked samples kept as context of the rolling window
+        self.clean = (empty_int, empty_bool, empty_time)
+        self.start = None
+        self.last = None
+        self.run_start = None  # time of the first sample of the invalid run still open
+        self.blinks = 0
+        self.samples = 0
+        self.valid = 0
+        self.baseline_values = []
+        self.response_sum = 0
+        self.response_count = 0
+        self.peak = None
+
+    def add(self, left, left_valid, right, right_valid, time):
+        '''pupil columns of a batch (see merge_eyes) and the tracker times in seconds'''
+        if not len(time):
+            return
+        diameter, bad = merge_eyes(left, left_valid, right, right_valid)
+        time = np.asarray(time, np.float64)
+        if self.start is None:
+            self.start = float(time[0])
+        self.last = float(time[-1])
+        self.samples += len(time)
+        # runs of bad samples, from their first sample to the next good one
+        previous = np.concatenate(([self.run_start is not None], bad[:-1]))
+        starts, ends = time[bad & ~previous], time[~bad & previous]
+        if self.run_start is not None:
+            starts = np.concatenate(([self.run_start], starts))
+        self.blinks += self._count_blinks(ends - starts[:len(ends)])
+        self.run_start = float(starts[-1]) if bad[-1] else None
+        raw = self.raw
+        self.raw = (np.concatenate((raw[0], diameter)), np.concatenate((raw[1], bad)),
+                    np.concatenate((raw[2], time)))
+        self._mask(final=False)
+
+    @staticmethod
+    def _count_blinks(durations):
+        return int(np.count_nonzero((durations >= BLINK_MIN) & (durations <= BLINK_MAX)))
+
+    def _mask(self, final):
+        '''pass the samples whose blink_pad neighbourhood is complete on to the rolling window'''
+        diameter, bad, time = self.raw
+        if not len(time):
+            return
+        pad = self.blink_pad
+        # samples more than pad before the newest one have all their neighbours
+        decided = len(time) if final else int(np.searchsorted(time, time[-1] - pad, 'left'))
+        if decided > self.masked:
+            index = np.arange(self.masked, decided)
+            bad_count = np.concatenate(([0], np.cumsum(bad)))
+            lo = np.searchsorted(time, time[index] - pad, 'left')
+            hi = np.searchsorted(time, time[index] + pad, 'right')
+            ok = bad_count[hi] - bad_count[lo] == 0
+            self._roll(diameter[index], ok, time[index])
+        if final:
+            self.raw = (diameter[:0], bad[:0], time[:0])
+            self.masked = 0
+        else:
+            # keep what the next undecided sample still looks back on
+            keep = int(np.searchsorted(time, time[decided] - pad, 'left'))
+            self.raw = (diameter[keep:], bad[keep:], time[keep:])
+            self.masked = decided - keep
+
+    def _roll(self, diameter, ok, time):
+        '''add blink-masked samples to the baseline, the response totals and the rolling peak'''
+        self.valid += int(np.count_nonzero(ok))
+        n = len(time)
+        clean = self.clean
+        values = np.concatenate((clean[0], np.where(ok, diameter, 0)))
+        oks = np.concatenate((clean[1], ok))
+        times = np.concatenate((clean[2], time))
+        new = np.arange(len(times) - n, len(times))
+
+        onset = self.start + self.baseline_seconds
+        baseline = ok & (time < onset)
+        if baseline.any():
+            self.baseline_values.append(diameter[baseline])
+        response = ok & (time >= onset)
+        self.response_sum += int(diameter[response].sum())
+        self.response_count += int(np.count_nonzero(response))
+
+        # rolling sums over (t - window, t] of integer diameters are exact
+        value_sum = np.concatenate(([0], np.cumsum(values)))
+        ok_sum = np.concatenate(([0], np.cumsum(oks)))
+        lo = np.searchsorted(times, times[new] - self.window, 'right')
+        count = ok_sum[new + 1] - ok_sum[lo]
+        # windows after the baseline period with at least half their samples valid
+        full = (time >= onset) & (count > 0) & (2 * count >= new + 1 - lo)
+        if full.any():
+            peak = float(np.max((value_sum[new + 1] - value_sum[lo])[full] / count[full]))
+            self.peak = peak if self.peak is None else max(self.peak, peak)
+
+        keep = int(np.searchsorted(times, times[-1] - self.window, 'right'))
+        self.clean = (values[keep:], oks[keep:], times[keep:])
+
+    def features(self):
+        '''close the page, return its feature dict and start the next page'''
+        self._mask(final=True)
+        if self.run_start is not None:  # a run still open at the end of the page, as long as it went
+            self.blinks += self._count_blinks(np.array([self.last - self.run_start]))
+        baseline = float(np.median(np.concatenate(self.baseline_values))) if self.baseline_values else None
+        minutes = (self.last - self.start) / 60 if self.samples else 0.0
+        result = {
+            'baseline': None, 'dilation': None, 'peak_dilation': None, 'relative_dilation': None,
+            'blinks': self.blinks,
+            'blink_rate': self.blinks / minutes if minutes > 0 else None,
+            'valid_fraction': self.valid / self.samples if self.samples else None,
+        }
+        if baseline:
+            result['baseline'] = baseline / 1e3
+            if self.response_count:
+                dilation = self.response_sum / self.response_count - baseline
+                result['dilation'] = dilation / 1e3
+                result['relative_dilation'] = dilation / baseline
+            if self.peak is not None:
+                result['peak_dilation'] = (self.peak - baseline) / 1e3
+        self.reset()
+        return result
+
+
+# GazeRingBuffer pupil columns and the RECORD_FIELDS they come from
+RECORD_COLUMNS = {'left_pupil': 'LPUPILD', 'left_valid': 'LPUPILV', 'right_pupil': 'RPUPILD', 'right_valid': 'RPUPILV'}
+
+
+def record_pupils(rows):
+    '''pupil columns of RECORD_DTYPE rows (a recording), named as in the ring buffer'''
+    return {name: rows[field] for name, field in RECORD_COLUMNS.items()}
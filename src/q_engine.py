@@ -0,0 +1,77 @@
+"""
+stacked Q-tables for many learners, updated in one NumPy call
+"""
+
+import numpy as np
+
+
+class QEngine:
+    """
+    n_learners independent Q-tables in one (n_learners, n_states, n_actions)
+    array. Every call handles all learners at once: select() does the
+    epsilon-greedy choice and update() the TD update of
+    Learner.run_one_step, one (state, action) cell per learner.
+
+    dimensions   : values of each state dimension, rl_algo.state_dimensions(...)
+    action_space : list of action tuples, rl_algo.action_space
+    gamma, learn_rate, epsilon_decay : scalars, or one value per learner for
+                                       sweeps; epsilon is exp(-steps / epsilon_decay)
+    """
+
+    def __init__(self, n_learners, dimensions, action_space, gamma=0.95, learn_rate=0.8, epsilon_decay=35.0,
+                 seed=None):
+        self.dimensions = [np.asarray(values) for values in dimensions]
+        for values in self.dimensions:
+            if not np.array_equal(values, np.arange(values[0], values[0] + len(values))):
+                raise ValueError("state dimensions must be runs of consecutive integers")
+        self.shape = tuple(len(values) for values in self.dimensions)
+        self.action_space = list(action_space)
+        self.n_learners = n_learners
+        self.n_states = int(np.prod(self.shape))
+        self.n_actions = len(self.action_space)
+        self.Q = np.zeros((n_learners, self.n_states, self.n_actions))
+        self.gamma = np.broadcast_to(np.asarray(gamma, np.float64), (n_learners,)).copy()
+        self.learn_rate = np.broadcast_to(np.asarray(learn_rate, np.float64), (n_learners,)).copy()
+        self.epsilon_decay = np.broadcast_to(np.asarray(epsilon_decay, np.float64), (n_learners,)).copy()
+        self.learners = np.arange(n_learners)
+        self.rng = np.random.default_rng(seed)
+
+    def encode(self, *features):
+        '''Map state features to state indices
+        input param
+            features: one array (or scalar) per state dimension, in the order of
+                      dimensions, e.g. engagement level, familiarity, similarity
+        return, state indices in rl_algo.state_space order
+        '''
+        offsets = [np.asarray(feature) - values[0] for feature, values in zip(features, self.dimensions)]
+        return np.ravel_multi_index(offsets, self.shape)
+
+    def select(self, states, steps):
+        '''Epsilon-greedy actions for every learner
+        input param
+            states: (n_learners,) current state indices
+            steps: (n_learners,) steps taken in the current session, sets epsilon
+        return, (n_learners,) action indices
+        '''
+        explore = self.rng.random(self.n_learners) < np.exp(-np.asarray(steps) / self.epsilon_decay)
+        greedy = np.argmax(self.Q[self.learners, states], axis=1)
+        return np.where(explore, self.rng.integers(0, self.n_actions, self.n_learners), greedy)
+
+    def update(self, states, actions, rewards, next_states, active=None):
+        '''TD update of one cell per learner
+        Q[s, a] = (1 - learn_rate) * Q[s, a] + learn_rate * (r + gamma * max Q[s1, :])
+        input param
+            states, actions, rewards, next_states: (n_learners,) arrays
+            active: optional boolean mask, learners outside it are left unchanged
+        '''
+        learners = self.learners if active is None else self.learners[active]
+        take = slice(None) if active is None else active
+        s, a, s1 = np.asarray(states)[take], np.asarray(actions)[take], np.asarray(next_states)[take]
+        r = np.asarray(rewards, np.float64)[take]
+        learn_rate, gamma = self.learn_rate[learners], self.gamma[learners]
+        target = r + gamma * self.Q[learners, s1].max(axis=1)
+        self.Q[learners, s, a] = (1 - learn_rate) * self.Q[learners, s, a] + learn_rate * target
+
+    def table(self, learner):
+        '''Q-table of one learner, in the layout of rl_algo.Q (for save_q_table)'''
+        return self.Q[learner].copy()
@@ -0,0 +1,181 @@
+"""
+bulk re-scoring of recorded gaze sessions
+splits every gaze recording (see gaze_recording.py) into its pages and
+scores them again with the current calculate_engagement in worker
+processes, in units of --unit-pages pages. One row per page, with its pupil
+dilation features, goes to scores.npz (a column per field) and scores.csv,
+and the normalized scores to cumulative_scores.csv in the layout ui_main
+writes.
+
+Finished units are kept in <out>/parts under a key that covers the
+recording, the page range and the scoring code and intrinsic scores, so an
+interrupted run resumes where it stopped and a change to the scoring
+re-scores everything.
+
+usage: python src/rescore.py [--directory output/recordings] [--out output/rescore] [--workers 4] [--fast]
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from engagement_analysis import EngagementAccumulator, score_fixations
+from gaze_recording import iter_pages, page_offsets, read_info, recordings_directory
+from pupillometry import record_pupils
+from rl_config import config_hash
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+intr_path = os.path.join(parent_dir, 'data', 'intrinsic_scores.csv')
+output_directory = os.path.join(parent_dir, 'output', 'rescore')
+
+COLUMNS = ('participant', 'group', 'page', 'flag', 'raw_score', 'normalized_score')
+PUPIL_COLUMNS = ('dilation', 'peak_dilation', 'blink_rate')
+FLOAT_COLUMNS = ('raw_score', 'normalized_score') + PUPIL_COLUMNS
+GROUPS = {'group1': 'control', 'group2': 'test'}
+# a change to any of these re-scores every unit
+SCORING_FILES = ('engagement_analysis.py', 'fixations.py', 'pupillometry.py', 'Fixpos2Densemap.py',
+                 'gaze_recording.py')
+
+
+def scoring_version(intr_path=intr_path):
+    '''hash of the scoring code and the intrinsic scores'''
+    digest = hashlib.sha256()
+    for path in [os.path.join(script_dir, name) for name in SCORING_FILES] + [intr_path]:
+        with open(path, 'rb') as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def read_intrinsic_scores(path=intr_path):
+    df_intr = pd.read_csv(path)
+    return dict(zip(df_intr['Code'], df_intr['Score'].astype(float)))
+
+
+def score_unit(path, start, stop, offset, fast, intrinsic, part_file):
+    '''
+    Score pages start .. stop-1 of a recording and store the rows in part_file
+    offset: page_offsets entry of page start, read from there instead of the beginning
+    return, dict of COLUMNS arrays
+    '''
+    info = read_info(path)
+    participant = info.get('participant') or os.path.splitext(os.path.basename(path))[0]
+    group = GROUPS.get(info.get('group'), info.get('group', ''))
+    accumulator = EngagementAccumulator()
+    rows = []
+    for number, (marker, samples) in enumerate(islice(iter_pages(path, offset), stop - start), start + 1):
+        accumulator.add_batch(samples["FPOGX"], samples["FPOGY"], samples["TIME"], pupils=record_pupils(samples))
+        _, fixation_data, pupil = accumulator.snapshot_and_reset()
+        raw = score_fixations(fixation_data, fast, pupil)
+        flag = marker.get('flag', '')
+        raw = np.nan if raw is None else raw
+        rows.append((participant, group, marker.get('page', number), flag, raw,
+                     raw - intrinsic[flag] if flag in intrinsic else np.nan)
+                    + tuple(np.nan if pupil[name] is None else pupil[name] for name in PUPIL_COLUMNS))
+    columns = {name: np.array([row[i] for row in rows]) for i, name in enumerate(COLUMNS + PUPIL_COLUMNS)}
+    columns['page'] = columns['page'].astype(np.int64)
+    for name in FLOAT_COLUMNS:
+        columns[name] = columns[name].astype(np.float64)
+    # written atomically, a killed run leaves no partial unit behind
+    with open(part_file + '.tmp', 'wb') as file:
+        np.savez(file, **columns)
+    os.replace(part_file + '.tmp', part_file)
+    return columns
+
+
+def load_part(part_file):
+    with np.load(part_file) as data:
+        return {name: data[name] for name in COLUMNS + PUPIL_COLUMNS}
+
+
+def plan_units(paths, unit_pages, fast, version, parts_directory):
+    '''list of (path, start, stop, offset, part file), unit_pages pages of one recording each,
+    offset being where page start begins in the file (see page_offsets)
+    '''
+    units = []
+    for path in paths:
+        offsets = page_offsets(path)
+        pages = len(offsets)
+        stat = os.stat(path)
+        for start in range(0, pages, unit_pages):
+            stop = min(start + unit_pages, pages)
+            key = config_hash(os.path.abspath(path), stat.st_size, stat.st_mtime_ns, start, stop, fast, version)
+            units.append((path, start, stop, offsets[start], os.path.join(parts_directory, key + '.npz')))
+    return units
+
+
+def write_results(results, out):
+    '''concatenate the unit columns (in unit order) into scores.npz, scores.csv and cumulative_scores.csv'''
+    columns = {name: np.concatenate([result[name] for result in results]) for name in COLUMNS + PUPIL_COLUMNS}
+    with open(os.path.join(out, 'scores.npz.tmp'), 'wb') as file:
+        np.savez(file, **columns)
+    os.replace(os.path.join(out, 'scores.npz.tmp'), os.path.join(out, 'scores.npz'))
+    pd.DataFrame(columns).to_csv(os.path.join(out, 'scores.csv'), index=False)
+
+    # one row per participant: group, then the normalized score of every page
+    with open(os.path.join(out, 'cumulative_scores.csv'), 'w', newline='') as file:
+        writer = csv.writer(file)
+        participants = dict.fromkeys(columns['participant'].tolist())
+        for participant in participants:
+            rows = columns['participant'] == participant
+            order = np.argsort(columns['page'][rows], kind='stable')
+            writer.writerow([columns['group'][rows][0]] + columns['normalized_score'][rows][order].tolist())
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recordings', nargs='*', help='recording files (default: every *.gaze of --directory)')
+    parser.add_argument('--directory', default=recordings_directory)
+    parser.add_argument('--out', default=output_directory)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--unit-pages', type=int, default=20, help='pages per work unit')
+    parser.add_argument('--fast', action='store_true', help='score on the coarse lattice (DensemapScore)')
+    parser.add_argument('--restart', action='store_true', help='ignore the units finished by earlier runs')
+    args = parser.parse_args()
+
+    paths = args.recordings or sorted(glob.glob(os.path.join(args.directory, '*.gaze')))
+    if not paths:
+        parser.error(f"no recordings in {args.directory}")
+    parts_directory = os.path.join(args.out, 'parts')
+    os.makedirs(parts_directory, exist_ok=True)
+
+    start = time.perf_counter()
+    units = plan_units(paths, args.unit_pages, args.fast, scoring_version(), parts_directory)
+    results = [None] * len(units)
+    todo = []
+    for i, (path, first, stop, offset, part_file) in enumerate(units):
+        if os.path.exists(part_file) and not args.restart:
+            results[i] = load_part(part_file)
+        else:
+            todo.append(i)
+    pages = sum(stop - first for _, first, stop, _, _ in units)
+    print(f"{len(paths)} recordings, {pages} pages in {len(units)} units, "
+          f"{len(units) - len(todo)} done already, {len(todo)} to score")
+
+    intrinsic = read_intrinsic_scores()
+    with ProcessPoolExecutor(args.workers) as pool:
+        futures = {pool.submit(score_unit, *units[i][:4], args.fast, intrinsic, units[i][4]): i for i in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if done % 50 == 0 or done == len(futures):
+                print(f"  {done}/{len(futures)} units, {time.perf_counter() - start:.1f} s")
+
+    columns = write_results(results, args.out)
+    elapsed = time.perf_counter() - start
+    scored = sum(units[i][2] - units[i][1] for i in todo)
+    rate = f"{scored / elapsed:,.0f} pages/s scored on {args.workers} workers" if scored else "nothing left to score"
+    print(f"{len(columns['page'])} pages written to {args.out} in {elapsed:.1f} s ({rate})")
+
+
+if __name__ == '__main__':
+    main()
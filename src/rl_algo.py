@@ -1,32 +1,60 @@
 import itertools
-import pandas as pd
 import numpy as np
 import random
 import os
 import glob
+import threading
+import time
 from engagement_analysis import get_current_engagement_score
+from flag_index import FlagIndex, candidate_position
+from checkpoint import CheckpointWriter, load_checkpoint, save_checkpoint
+from rl_config import load_rl_config
+from engagement_calibration import EngagementCalibration, calibration_path
 import pickle
+import metrics
 
-sim_low = -0.13 # X value for the first line (1/3 of total): -0.13180964986483257
-sim_high = 0.10 # X value for the second line (2/3 of total): 0.10018077492713928
+def apply_rl_config(config):
+    '''Set the learning parameters and level thresholds from an rl_model config dict'''
+    global learning_rate, discount_factor, epsilon_decay, sim_low, sim_high, egm_low, egm_high, adaptive_engagement, consider_page
+    learning_rate = config['learning_rate']
+    discount_factor = config['discount_factor']
+    epsilon_decay = config['epsilon_decay']
+    sim_low = config['sim_low'] # X value for the first line (1/3 of total): -0.13180964986483257
+    sim_high = config['sim_high'] # X value for the second line (2/3 of total): 0.10018077492713928
+    egm_low = config['egm_low']
+    egm_high = config['egm_high']
+    adaptive_engagement = config['adaptive_engagement'] # level edges from the score quantiles, see engagement_calibration.py
+    page = bool(config['consider_page'])
+    if state_space is None:
+        consider_page = page # the state space is built below
+    elif page != consider_page:
+        configure(consider_page=page)
 
-egm_high = 2
-egm_low = 1
+consider_page = False # page number as a state dimension, 21 times the states
+max_page = 20
+state_space = None # built by configure()
+
+# rl_model section of config.yaml
+apply_rl_config(load_rl_config())
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(script_dir)
-sim_directory = os.path.join(parent_dir, 'data/similarity') 
+sim_directory = os.path.join(parent_dir, 'data/Similarity')
+sim_matrix_path = os.path.join(parent_dir, 'data/similarity.npy')
 fam_path = os.path.join(parent_dir, 'data/flag_familiarity.csv')
 intr_path = os.path.join(parent_dir, 'data/intrinsic_scores.csv') 
-df_intr = pd.read_csv(intr_path)
-q_table_path = os.path.join(script_dir, 'q_table.pkl')
-scores_record = []
+q_table_path = os.path.join(script_dir, 'q_table.npz')
+legacy_q_table_path = os.path.join(parent_dir, 'q_table.pkl') # pickled by earlier versions, read when no checkpoint exists yet
+checkpoint_every = 10 # Q updates between background checkpoint writes
 
-def save_q_table(q_table, filename=q_table_path):
+def save_q_table(q_table, filename=q_table_path, steps=0):
     """
-    saving Q-table
+    saving Q-table, as a checkpoint for .npz files and pickled otherwise
     """
     try:
+        if filename.endswith('.npz'):
+            save_checkpoint(filename, q_table, state_space, action_space, steps)
+            return
         with open(filename, 'wb') as file:
             pickle.dump(q_table, file)
     except Exception as e:
@@ -34,27 +62,48 @@ def save_q_table(q_table, filename=q_table_path):
 
 def load_q_table(filename=q_table_path):
     """
-    read Q-Table
+    read Q-Table, a checkpoint for .npz files and a pickle otherwise
     """
     if not os.path.exists(filename):
         return None
     try:
+        if filename.endswith('.npz'):
+            return load_checkpoint(filename, state_space, action_space)[0]
         with open(filename, 'rb') as file:
             return pickle.load(file)
     except Exception as e:
         print(f"Error loading Q-table: {e}")
         return None
 
-def initialize():
-    ''' Create state space with dimensions = ['Engagement', 'Familiarity', 'Similarity', 'Boring level']
-        and action space with dimensions = ['Familiarity', 'Similarity']
+def shaped_path(filename):
+    '''Q-table file of the current state space: page-aware tables get a _page suffix
+    so the two shapes never overwrite each other's checkpoint
+    '''
+    if consider_page and filename is not None:
+        root, extension = os.path.splitext(filename)
+        return f"{root}_page{extension}"
+    return filename
+
+def state_dimensions(consider_page=False, max_page=max_page):
+    '''Values of each state dimension
+    input param
+        consider_page: add the page number (0 .. max_page) as a fourth dimension
+    return, list of value lists: engagement, familiarity, similarity (, page)
     '''
     values = [1, 2, 3]  # First dimension values
     familiarity_values = [1, 2]  # Second dimension values (Familiarity)
     similarity_values = [1, 2,3]  # Third dimension values (Similarity)
+    dimensions = [values, familiarity_values, similarity_values]
+    if consider_page:
+        dimensions.append(list(range(0, max_page + 1)))  # Possible page numbers for the fourth dimension
+    return dimensions
 
+def initialize(consider_page=False, max_page=max_page):
+    ''' Create state space with dimensions = ['Engagement', 'Familiarity', 'Similarity'(, 'Page')]
+        and action space with dimensions = ['Familiarity', 'Similarity']
+    '''
     # Create the state space
-    state_space = list(itertools.product(values, familiarity_values, similarity_values))
+    state_space = list(itertools.product(*state_dimensions(consider_page, max_page)))
 
     a_values = [2, 1]  # Updated to reflect new familiarity levels
     action_space = list(itertools.product(a_values, repeat=2))
@@ -81,32 +130,86 @@ def create_flag_list():
     # os.path.basename() extracts the file name from the full path.
     return csv_file_names
 
-total_steps = 0
-flags = create_flag_list()
-state_space, action_space, state_to_index, action_to_index, index_to_state, index_to_action = initialize()
-Q = np.zeros([len(state_space), len(action_space)])
+# the flag list and intrinsic scores are read on first use, see get_flags / get_intrinsic_scores
+flags = None
+intrinsic_scores = None
 
-def familiar(flag):
-    '''Read familiarity table and return familiarity level
-    input param, flag: string, national flag file name
-    return, familiarity level: string
+def get_flags():
+    '''Return the flag list, read from the similarity directory on first use'''
+    global flags
+    if flags is None:
+        flags = create_flag_list()
+    return flags
+
+def get_intrinsic_scores():
+    '''Return {flag code: intrinsic score}, read from intrinsic_scores.csv on first use'''
+    global intrinsic_scores
+    if intrinsic_scores is None:
+        import pandas as pd
+        df_intr = pd.read_csv(intr_path)
+        intrinsic_scores = dict(zip(df_intr['Code'], df_intr['Score'].astype(float)))
+    return intrinsic_scores
+
+q_lock = threading.Lock()
+checkpoint_writers = {}
+
+def configure(consider_page=False, max_page=max_page):
+    '''Build the state space, the index maps and an empty Q for page-aware states or not.
+    Pending checkpoints are written first; the next initialize_learning loads the
+    checkpoint of the new shape (see shaped_path). Learners started before keep
+    states of the old shape, so configure between sessions, not during one.
+    input param
+        consider_page: add the page number (0 .. max_page) as a state dimension
+        max_page: last page number of the page dimension
     '''
-    df_fam = pd.read_csv(fam_path)
-    if flag in df_fam[df_fam['Familiarity Level'] == 'Familiar']['Flag Name'].values:
-        return 2
-    else:
-        return 1
+    global state_space, action_space, state_to_index, action_to_index, index_to_state, index_to_action
+    global Q, q_loaded, q_steps
+    for writer in list(checkpoint_writers.values()):
+        writer.close()
+    with q_lock:
+        globals().update(consider_page=consider_page, max_page=max_page) # the parameters shadow the globals
+        state_space, action_space, state_to_index, action_to_index, index_to_state, index_to_action = \
+            initialize(consider_page, max_page)
+        # one Q-table per process, shared by every participant's Learner
+        Q = np.zeros([len(state_space), len(action_space)])
+        q_loaded = False # Q is read from disk once, later participants continue from memory
+        q_steps = 0 # Q updates so far, stored with each checkpoint
+        checkpoint_writers.clear()
+
+configure(consider_page)
+
+def get_checkpoint_writer(filename):
+    '''Return the CheckpointWriter for a .npz Q-table file, one per file and process'''
+    key = os.path.abspath(filename)
+    with q_lock:
+        if key not in checkpoint_writers:
+            checkpoint_writers[key] = CheckpointWriter(key, state_space, action_space, checkpoint_every)
+        return checkpoint_writers[key]
+
+def get_flag_index():
+    '''Return the FlagIndex of the default learner, building it on first use
+    and reloading familiarity whenever /submit_ratings rewrites the file
+    '''
+    return default_learner.index()
+
+def familiar(flag, index=None):
+    '''Look up familiarity level
+    input param
+        flag: string, national flag file name
+        index: FlagIndex to use, default get_flag_index()
+    return, familiarity level: int, 2 for familiar, 1 otherwise
+    '''
+    return (index or get_flag_index()).familiar(flag)
 
-def similar(current_flag, next_flag):
+def similar(current_flag, next_flag, index=None):
     '''Read similarity table and return similarity level
     input param
         current_flag: string, current national flag file name
         next_flag: string, next national flag file name
+        index: FlagIndex to use, default get_flag_index()
     return, similarity level: string, categorical created by if-else statement
     '''
-    csv_path = os.path.join(sim_directory, current_flag+'.csv')
-    df_sim = pd.read_csv(csv_path)
-    sim = float(df_sim[df_sim["Image"] == next_flag]["Similarity"])
+    sim = (index or get_flag_index()).similarity_between(current_flag, next_flag)
 
     if sim >= sim_high:
         return 3
@@ -115,109 +218,284 @@ def similar(current_flag, next_flag):
     else:
         return 1
 
-def decide_flag(current_flag, action, flags):
+def decide_flag(current_flag, action, flags, index=None, rng=None):
     '''Decide flag by action given
        Filter the familiarity level first, then similarity level next
     input param
         current_flag: string, current flag name
         action: tuple, (familiarity level, similarity level)
+        flags: list, flags to fall back on when no flag matches
+        index: FlagIndex to use, default get_flag_index()
+        rng: random.Random for the fallback when no flag matches, default the random module
     return
         flag_chosen: string, next flag name
     '''
     (familiarity, similarity) = action
 
-    # sort out (un)familiar flags
-    df_fam = pd.read_csv(fam_path)
-    df_fam = df_fam[df_fam['Flag Name'].isin(flags)]
-    df_fam = df_fam[df_fam['Familiarity Level'] == familiarity]
-    familiar_flags = set(df_fam['Flag Name'])
-    # sort out (dis)similar flags
-    sim_pattern = os.path.join(sim_directory, current_flag +'.csv')
-    df_sim = pd.read_csv(sim_pattern)
-
-    df_sim_filter1 = df_sim[df_sim['Image'].isin(familiar_flags)].sort_values(by=['Similarity'])
-    
-    if not df_sim_filter1.empty:
-        if similarity == 3:
-            flag_chosen = df_sim_filter1.iloc[0]['Image']
-        elif similarity == 2:
-            median_index = len(df_sim_filter1) // 2
-            flag_chosen = df_sim_filter1.iloc[median_index]['Image']
-        else:
-            flag_chosen = df_sim_filter1.iloc[-1]['Image']
+    # flags of the requested familiarity, sorted by similarity to current_flag
+    index = index or get_flag_index()
+    candidates = index.candidates(current_flag, familiarity)
+
+    if len(candidates):
+        flag_chosen = index.codes[candidates[candidate_position(len(candidates), similarity)]]
     else:
         print("oopsssss")
-        flag_chosen = random.choice([item for item in flags if item != current_flag])
+        flag_chosen = (rng or random).choice([item for item in flags if item != current_flag])
 
     return flag_chosen
 
-def engagement_level(engagement):
+def next_flag_for(current_flag, a, flags, index=None, rng=None):
+    '''decide_flag by table lookup: same result for the action with index a in action_space
+    input param
+        a: int, action index
+        rng: random.Random for the fallback when no flag matches, default the random module
+    return, next flag name
+    '''
+    index = index or get_flag_index()
+    chosen = index.transition_table(action_space)[index.index[current_flag], a]
+    if chosen >= 0:
+        return index.codes[chosen]
+    print("oopsssss")
+    return (rng or random).choice([item for item in flags if item != current_flag])
+
+engagement_calibration = None
+
+def get_engagement_calibration():
+    '''Return the station-wide EngagementCalibration, loaded from calibration_path on first use'''
+    global engagement_calibration
+    with q_lock:
+        if engagement_calibration is None:
+            engagement_calibration = EngagementCalibration(calibration_path)
+        return engagement_calibration
+
+def make_state(engagement_level, familiarity, similarity, page):
+    '''state tuple of the configured state space, page is dropped unless consider_page'''
+    if consider_page:
+        return (engagement_level, familiarity, similarity, min(page, max_page))
+    return (engagement_level, familiarity, similarity)
+
+def engagement_level(engagement, scores_record=None, edges=None):
     '''Create categorical variable engagement_level by float variable engagement
-    input param, engagement: float
+    input param
+        engagement: float
+        scores_record: list the engagement is appended to (optional)
+        edges: (low, high) level edges, default (egm_low, egm_high)
     return, engagement_level: string
     '''
-    scores_record.append(engagement)
-    if engagement > egm_high:
+    if scores_record is not None:
+        scores_record.append(engagement)
+    low, high = edges or (egm_low, egm_high)
+    if engagement > high:
         engagement_level = 3
-    elif engagement > egm_low and engagement <= egm_high:
+    elif engagement > low and engagement <= high:
         engagement_level = 2
     else:
         engagement_level = 1
 
     return engagement_level
 
-# Global variables to maintain state
-# current_flag = None
-# current_state = None
+class Learner:
+    '''State of one participant's learning session: the flag on screen, the
+    current state, step count, engagement record and a FlagIndex built from
+    the participant's own familiarity file.
+    The Q-table is the module-level Q, shared by all participants in the
+    process (the study learns one policy from everyone) and only read and
+    updated under q_lock.
+    '''
+
+    def __init__(self, fam_path=fam_path, q_table_file=q_table_path,
+                 engagement_source=get_current_engagement_score, transition_log=None, participant='', seed=None,
+                 calibration=None):
+        '''
+        input param
+            fam_path: familiarity CSV of this participant
+            q_table_file: where the shared Q-table is loaded from and saved to; .npz files
+                          are checkpointed in the background, others pickled after every step,
+                          None keeps Q in memory only (simulations)
+            engagement_source: callable returning the engagement score of the page just shown
+            transition_log: optional transitions.TransitionLog every step is appended to
+            participant: id written to the transition log
+            seed: seeds the random fallback of the flag choice
+            calibration: EngagementCalibration for adaptive engagement levels,
+                         default get_engagement_calibration()
+        '''
+        self.fam_path = fam_path
+        self.q_table_file = q_table_file
+        self.checkpoint = None # CheckpointWriter, started by initialize_learning for .npz files
+        self.engagement_source = engagement_source
+        self.transition_log = transition_log
+        self.participant = participant
+        self.rng = random.Random(seed) if seed is not None else None
+        self.calibration = calibration
+        self.engagement_quantiles = None # this participant's scores, for adaptive levels
+        self.flag_index = None
+        self.current_flag = None
+        self.current_state = None
+        self.total_steps = 0
+        self.scores_record = []
+        self.candidates = None # action index -> (next flag, familiarity, similarity) for current_flag
+        self.candidates_key = (None, None) # (flag, transition table) the candidates were resolved for
 
-def initialize_learning():
-    global Q, current_state, total_steps, flags, current_flag
-    loaded_Q = load_q_table(filename = 'q_table.pkl')
-    if loaded_Q is not None:
-        Q = loaded_Q
-    current_flag = random.choice(flags)
-    intr_norm = df_intr[df_intr['Code'] == current_flag]["Score"]
-    engagement = 1 # for debugging purposes
-    # comment for debugging purposes
-    # engagement = get_current_engagement_score(current_flag) - intr_norm
-    # write this in csv
-    current_state = (engagement_level(engagement), familiar(current_flag), random.choice(state_space)[2])
-    total_steps = 0
-    return current_state
+    def index(self):
+        '''Return this learner's FlagIndex, built on first use and refreshed when the familiarity file changes'''
+        if self.flag_index is None:
+            self.flag_index = FlagIndex(get_flags(), sim_directory, self.fam_path, sim_matrix_path)
+        else:
+            self.flag_index.refresh()
+        return self.flag_index
 
-def run_one_step():
-    global current_flag, Q, current_state, total_steps, flags
-    
-    gamma = 0.95
-    learnRate = 0.8
-    epsilon = np.exp(-total_steps / 35.0)
-
-    # for debugging purpose:
-    s = state_to_index.get(current_state)
-    if s is None:
-        print(f"Error: State {current_state} not found in state_to_index.")
-        return None
-    if np.random.rand() < epsilon:
-        a_content = random.choice(action_space)
-        a = action_to_index.get(a_content)
-    else:
-        a = np.argmax(Q[s, :])
-        a_content = index_to_action.get(a)
+    def initialize_learning(self):
+        global Q, q_loaded, q_steps
+        q_table_file = shaped_path(self.q_table_file)
+        if q_table_file is not None and q_table_file.endswith('.npz'):
+            self.checkpoint = get_checkpoint_writer(q_table_file)
+        with q_lock:
+            # with background checkpoints the file can lag behind Q, so only the first learner loads it
+            load = (not q_loaded or self.checkpoint is None) and q_table_file is not None
+            q_loaded = True
+        if load:
+            loaded_Q, steps = None, 0
+            if self.checkpoint is None:
+                loaded_Q = load_q_table(filename = q_table_file)
+            elif os.path.exists(q_table_file):
+                try:
+                    loaded_Q, steps = load_checkpoint(q_table_file, state_space, action_space)
+                except Exception as e:
+                    print(f"Error loading Q-table: {e}")
+            elif not consider_page: # the pickle has no page dimension
+                loaded_Q = load_q_table(filename = legacy_q_table_path)
+            if loaded_Q is not None:
+                with q_lock:
+                    Q = loaded_Q
+                    q_steps = max(q_steps, steps)
+        self.flag_index = FlagIndex(get_flags(), sim_directory, self.fam_path, sim_matrix_path)
+        # all (flag, action) -> next flag answers for this rating, rebuilt if the ratings change
+        self.flag_index.transition_table(action_space)
+        self.current_flag = random.choice(get_flags())
+        engagement = 1 # for debugging purposes
+        # comment for debugging purposes
+        # engagement = get_current_engagement_score(current_flag) - intr_norm
+        # write this in csv
+        if adaptive_engagement:
+            self.calibration = self.calibration or get_engagement_calibration()
+            self.engagement_quantiles = self.calibration.participant()
+        self.current_state = make_state(engagement_level(engagement, self.scores_record, self.engagement_edges()),
+                                        familiar(self.current_flag, self.flag_index), random.choice(state_space)[2], 0)
+        self.total_steps = 0
+        return self.current_state
 
-    next_flag = decide_flag(current_flag, a_content, flags)
-    intr_norm = df_intr[df_intr['Code'] == current_flag.replace(".jpg","")]["Score"]
-    engagement_score_ori = get_current_engagement_score() 
-    r = float(engagement_score_ori - intr_norm)
-    s1_content = (engagement_level(r), familiar(next_flag), similar(current_flag, next_flag))
-    s1 = state_to_index.get(s1_content)
+    def prepare_candidates(self):
+        '''Resolve the next flag of every action for the flag on screen ahead of the next step,
+        so run_one_step is left with the action choice and the Q update
+        return, list of the distinct candidate flags (for the browser to prefetch)
+        '''
+        index = self.index()
+        table = index.transition_table(action_space)
+        if self.candidates_key[0] != self.current_flag or self.candidates_key[1] is not table:
+            row = table[index.index[self.current_flag]]
+            candidates = {}
+            for a, chosen in enumerate(row):
+                # no match falls back to a random flag, drawn only if that action is taken
+                if chosen >= 0:
+                    next_flag = index.codes[chosen]
+                    candidates[a] = (next_flag, familiar(next_flag, index),
+                                     similar(self.current_flag, next_flag, index))
+            self.candidates, self.candidates_key = candidates, (self.current_flag, table)
+        return list(dict.fromkeys(flag for flag, _, _ in self.candidates.values()))
 
-    Q[s, a] = (1 - learnRate) * Q[s, a] + learnRate * (r + gamma * np.max(Q[s1, :]))
+    def candidate(self, a, index):
+        '''(next flag, familiarity, similarity) of action a from the flag on screen'''
+        self.prepare_candidates()
+        if a in self.candidates:
+            return self.candidates[a]
+        next_flag = next_flag_for(self.current_flag, a, get_flags(), index, self.rng)
+        return next_flag, familiar(next_flag, index), similar(self.current_flag, next_flag, index)
 
-    current_flag = next_flag
-    current_state = s1_content
-    total_steps += 1
+    def run_one_step(self):
+        global q_steps
+        gamma = discount_factor
+        learnRate = learning_rate
+        epsilon = np.exp(-self.total_steps / epsilon_decay)
+        index = self.index()
 
-    save_q_table(Q, filename = 'q_table.pkl')
+        # for debugging purpose:
+        s = state_to_index.get(self.current_state)
+        if s is None:
+            print(f"Error: State {self.current_state} not found in state_to_index.")
+            return None
+        if np.random.rand() < epsilon:
+            a_content = random.choice(action_space)
+            a = action_to_index.get(a_content)
+        else:
+            with q_lock:
+                a = np.argmax(Q[s, :])
+            a_content = index_to_action.get(a)
+
+        with metrics.timed('decide'):
+            next_flag, next_familiarity, next_similarity = self.candidate(int(a), index)
+        intr_norm = get_intrinsic_scores().get(self.current_flag.replace(".jpg",""))
+        engagement_score_ori = self.engagement_source()
+        if engagement_score_ori is None or intr_norm is None:
+            # no fixation on the page, or no intrinsic score to normalize it by:
+            # nothing to learn from, move on without a Q update
+            return self.skip_step(next_flag, next_familiarity, next_similarity)
+        r = float(engagement_score_ori - intr_norm)
+        level = engagement_level(r, self.scores_record, self.engagement_edges())
+        if self.engagement_quantiles is not None:
+            self.calibration.record(r, self.engagement_quantiles)
+        s1_content = make_state(level, next_familiarity, next_similarity, self.total_steps + 1)
+        s1 = state_to_index.get(s1_content)
+
+        with metrics.timed('q_update'), q_lock:
+            Q[s, a] = (1 - learnRate) * Q[s, a] + learnRate * (r + gamma * np.max(Q[s1, :]))
+            q_steps += 1
+            q_snapshot, steps = Q.copy(), q_steps
+        metrics.count('q_updates')
+
+        if self.transition_log is not None:
+            with metrics.timed('transition_log'):
+                self.transition_log.log(time.time(), self.participant, self.total_steps, s, int(a), r, s1,
+                                        self.current_flag, next_flag, len(state_space))
+        self.current_flag = next_flag
+        self.current_state = s1_content
+        self.total_steps += 1
+
+        with metrics.timed('checkpoint'):
+            if self.checkpoint is not None:
+                self.checkpoint.update(q_snapshot, steps)
+            elif self.q_table_file is not None:
+                save_q_table(q_snapshot, filename = shaped_path(self.q_table_file))
+
+        return next_flag, self.current_state, r
 
-    return next_flag, current_state, r
+    def skip_step(self, next_flag, next_familiarity, next_similarity):
+        '''Go to next_flag after an unscored page, keeping the engagement level of the current state
+        return, (next flag, next state, None)
+        '''
+        self.current_flag = next_flag
+        self.current_state = make_state(self.current_state[0], next_familiarity, next_similarity,
+                                        self.total_steps + 1)
+        self.total_steps += 1
+        return next_flag, self.current_state, None
 
+    def engagement_edges(self):
+        '''level edges from the scores seen so far, None for the fixed egm_low / egm_high'''
+        if self.engagement_quantiles is None:
+            return None
+        return self.calibration.edges(self.engagement_quantiles)
+
+    def close(self):
+        '''write any Q updates still pending and the engagement calibration, called when the participant's session ends'''
+        if self.checkpoint is not None:
+            self.checkpoint.flush()
+        if self.engagement_quantiles is not None:
+            self.calibration.save()
+
+# learner behind the module-level functions, for the single-participant app
+default_learner = Learner()
+
+def initialize_learning():
+    return default_learner.initialize_learning()
+
+def run_one_step():
+    return default_learner.run_one_step()
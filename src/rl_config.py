@@ -0,0 +1,84 @@
+"""
+rl_model settings from config.yaml
+"""
+
+import hashlib
+import json
+import os
+import re
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+config_path = os.path.join(parent_dir, 'config.yaml')
+# sim_low / sim_high written by calibrate_thresholds.py
+thresholds_path = os.path.join(parent_dir, 'data', 'similarity_thresholds.json')
+
+# values used when config.yaml leaves a setting out (or as "...")
+DEFAULTS = {
+    'learning_rate': 0.8,
+    'discount_factor': 0.95,
+    'epsilon_decay': 35.0,  # epsilon = exp(-steps / epsilon_decay)
+    'sim_low': -0.13,       # similarity cut between level 1 and 2, normally calibrated
+    'sim_high': 0.10,       # similarity cut between level 2 and 3, normally calibrated
+    'egm_low': 1.0,         # engagement cut between level 1 and 2
+    'egm_high': 2.0,        # engagement cut between level 2 and 3
+    'adaptive_engagement': True,  # replace the egm cuts by score terciles once there are scores
+    'consider_page': False,       # page number as a fourth state dimension, see rl_algo.configure
+}
+
+
+def read_config(path=config_path):
+    '''Read the whole config file, {} when it or PyYAML is missing'''
+    if not os.path.exists(path):
+        return {}
+    try:
+        import yaml
+    except ImportError:
+        print("PyYAML is not installed, using default rl_model settings")
+        return {}
+    with open(path) as file:
+        return yaml.safe_load(file) or {}
+
+
+def load_rl_config(path=config_path, thresholds=thresholds_path):
+    '''Return the rl_model settings: DEFAULTS, then the calibrated similarity
+    thresholds, then the numeric and true/false values of config.yaml
+    '''
+    config = dict(DEFAULTS)
+    if thresholds and os.path.exists(thresholds):
+        with open(thresholds) as file:
+            calibrated = json.load(file)
+        config.update({key: float(calibrated[key]) for key in ('sim_low', 'sim_high') if key in calibrated})
+    for key, value in (read_config(path).get('rl_model') or {}).items():
+        if isinstance(value, bool):
+            config[key] = value
+        elif isinstance(value, (int, float)):
+            config[key] = float(value)
+    return config
+
+
+def config_hash(*parts):
+    '''stable short hash of JSON-serializable settings, used to cache sweep runs'''
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def write_rl_config(values, path=config_path):
+    '''Write values into the rl_model section of config.yaml in place,
+    keeping the other lines and the comments of the file
+    '''
+    with open(path) as file:
+        lines = file.read().split('\n')
+    start = next(i for i, line in enumerate(lines) if re.match(r'rl_model:\s*(#.*)?$', line))
+    end = next((i for i in range(start + 1, len(lines)) if lines[i] and not lines[i].startswith(' ')), len(lines))
+    remaining = dict(values)
+    for i in range(start + 1, end):
+        match = re.match(r'(\s+)(\w+):\s*[^#]*?(\s*#.*)?$', lines[i])
+        if match and match.group(2) in remaining:
+            indent, key, comment = match.groups()
+            lines[i] = f"{indent}{key}: {remaining.pop(key):g}{comment or ''}"
+    # keys the section did not have yet go after its last setting
+    last = max(i for i in range(start, end) if lines[i].strip())
+    lines[last + 1:last + 1] = [f"  {key}: {value:g}" for key, value in remaining.items()]
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines))
@@ -0,0 +1,192 @@
+"""
+per-participant sessions for the Flask app
+every participant (one study station) gets its own tracker connection,
+learner state and score record, so one server can run several stations
+
+The Q-table all learners share lives in the server process, so the app is
+served by one process with a thread per request (app.run, or e.g.
+`waitress-serve --threads 8`). A second worker process would keep its own Q
+and overwrite the first one's checkpoints; the registry holds a lock file
+next to the Q-table, so it refuses to start sessions instead.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+import metrics
+from GazepointAPI import ADDRESS, GazepointClient
+from checkpoint import lock_process
+from engagement_analysis import GazeStream
+from gaze_recording import GazeRecorder, recordings_directory
+from rl_algo import Learner, q_table_path
+from transitions import TransitionLog, transitions_path
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+fam_directory = os.path.join(parent_dir, 'data', 'familiarity')
+metrics_directory = os.path.join(parent_dir, 'output', 'metrics')
+IDLE_TIMEOUT = 30 * 60  # s without a request before an abandoned session is closed
+
+
+def parse_address(text, default=ADDRESS):
+    '''parse "host:port" (or just "port") from the opening form, default ADDRESS when empty
+    raise ValueError with a message for the form when the port is not a number 1-65535
+    '''
+    text = (text or '').strip()
+    if not text:
+        return default
+    host, _, port = text.rpartition(':')
+    if not (port.isascii() and port.isdigit()) or not 1 <= int(port) <= 65535:
+        raise ValueError(f"{text!r} is not host:port with a port from 1 to 65535")
+    return (host or default[0], int(port))
+
+
+class ParticipantSession:
+    """
+    participant_id  : random id stored in the Flask session cookie
+    group           : 'group1' (control) or 'group2' (test), as posted by the opening page
+    tracker_address : (host, port) of this station's Gazepoint server
+    lock            : serializes this participant's requests, other participants are not blocked;
+                      reentrant, so a request can end its own session. Handlers check
+                      `closed` once they hold it: the session may have been replaced or
+                      reaped while they waited
+    last_active     : time.monotonic() of the last request, for the idle reaper
+    recording_path  : gaze recording of the session (see gaze_recording), None when not recorded
+    metrics         : stage timings of this participant's page turns, summarized to
+                      <metrics_directory>/<participant_id>.json on close
+    next_image      : control group, learning image drawn ahead for the next page so the
+                      browser can prefetch it
+    """
+
+    def __init__(self, participant_id, group, tracker_address=ADDRESS, fam_directory=fam_directory,
+                 q_table_file=q_table_path, transition_log=None, recordings_directory=None, metrics_directory=None):
+        self.participant_id = participant_id
+        self.group = group
+        self.tracker_address = tracker_address
+        self.lock = threading.RLock()
+        self.closed = False
+        self.last_active = time.monotonic()
+        self.fam_path = os.path.join(fam_directory, participant_id + '.csv')
+        self.metrics = metrics.SessionMetrics(participant_id)
+        self.metrics_directory = metrics_directory
+        self.recording_path = None
+        self.recorder = None
+        if recordings_directory:
+            self.recording_path = os.path.join(recordings_directory, participant_id + '.gaze')
+            self.recorder = GazeRecorder(self.recording_path, info={'participant': participant_id, 'group': group})
+        self.gaze = GazeStream(GazepointClient(tracker_address, recorder=self.recorder))
+        self.learner = Learner(fam_path=self.fam_path, q_table_file=q_table_file,
+                               engagement_source=self.gaze.current_engagement_score,
+                               transition_log=transition_log, participant=participant_id)
+        self.scores_record = []
+        self.next_image = None
+
+    def annotate_page(self, **info):
+        '''store what the page was scored for (page, flag, ...) in the gaze recording'''
+        if self.recorder is not None:
+            self.recorder.annotate(**info)
+
+    def close(self):
+        '''stop the tracker stream, learner and recorder once the request in flight (if any) is done'''
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.gaze.stop()
+            self.learner.close()
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.metrics_directory and metrics.enabled:
+                try:
+                    self.metrics.dump(os.path.join(self.metrics_directory, self.participant_id + '.json'))
+                except OSError as e:
+                    print(f"Error writing session metrics: {e}")
+
+
+class SessionRegistry:
+    """
+    Participant sessions by id. The registry lock is only held to add,
+    look up or remove an entry; page requests run under the participant's
+    own lock. A new participant at a station replaces the previous one, and
+    a session without a request for idle_timeout seconds is closed by a
+    reaper thread. Every session's gaze stream is recorded to
+    recordings_directory and its metrics summary written to
+    metrics_directory, None turns either off.
+    The first session locks q_table_file + '.lock' for the life of the
+    process (see the module docstring).
+    """
+
+    def __init__(self, fam_directory=fam_directory, q_table_file=q_table_path, transitions_path=transitions_path,
+                 recordings_directory=recordings_directory, metrics_directory=metrics_directory,
+                 idle_timeout=IDLE_TIMEOUT):
+        self.fam_directory = fam_directory
+        self.q_table_file = q_table_file
+        self.transitions_path = transitions_path
+        self.recordings_directory = recordings_directory
+        self.metrics_directory = metrics_directory
+        self.idle_timeout = idle_timeout
+        self.transition_log = None
+        self.process_lock = None
+        self.reaper = None
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create(self, group, tracker_address=ADDRESS):
+        '''start a session for a new participant, return it'''
+        os.makedirs(self.fam_directory, exist_ok=True)
+        for directory in (self.recordings_directory, self.metrics_directory):
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        with self.lock:
+            if self.process_lock is None and self.q_table_file:
+                self.process_lock = lock_process(self.q_table_file + '.lock')
+            if self.transition_log is None and self.transitions_path:
+                self.transition_log = TransitionLog(self.transitions_path)
+            if self.reaper is None and self.idle_timeout:
+                self.reaper = threading.Thread(target=self._reap_idle, daemon=True)
+                self.reaper.start()
+        participant = ParticipantSession(uuid.uuid4().hex, group, tracker_address,
+                                         self.fam_directory, self.q_table_file, self.transition_log,
+                                         self.recordings_directory, self.metrics_directory)
+        with self.lock:
+            replaced = [p for p in self.sessions.values() if p.tracker_address == tracker_address]
+            for previous in replaced:
+                del self.sessions[previous.participant_id]
+            self.sessions[participant.participant_id] = participant
+        for previous in replaced:
+            previous.close()
+        return participant
+
+    def get(self, participant_id):
+        with self.lock:
+            participant = self.sessions.get(participant_id)
+        if participant is not None:
+            participant.last_active = time.monotonic()
+        return participant
+
+    def reap(self, now=None):
+        '''close the sessions idle for idle_timeout seconds, return how many'''
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            idle = [p for p in self.sessions.values() if now - p.last_active > self.idle_timeout]
+            for participant in idle:
+                del self.sessions[participant.participant_id]
+        for participant in idle:
+            participant.close()
+        return len(idle)
+
+    def _reap_idle(self):
+        while True:
+            time.sleep(min(60.0, self.idle_timeout / 4))
+            self.reap()
+
+    def remove(self, participant_id):
+        with self.lock:
+            participant = self.sessions.pop(participant_id, None)
+        if participant is not None:
+            participant.close()
+
+    def __len__(self):
+        return len(self.sessions)
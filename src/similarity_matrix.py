@@ -0,0 +1,92 @@
+"""
+binary similarity matrix format
+packs the per-flag similarity CSVs into one float32 .npy matrix plus a
+code -> index sidecar CSV, so consumers can np.load it memory-mapped
+
+usage: python src/similarity_matrix.py [--source "data/Similarity(complete)"] [--out data/similarity.npy]
+"""
+
+import argparse
+import glob
+import os
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+default_source = os.path.join(parent_dir, 'data', 'Similarity(complete)')
+default_matrix_path = os.path.join(parent_dir, 'data', 'similarity.npy')
+
+
+def codes_path(matrix_path):
+    '''return path of the code sidecar belonging to a matrix file'''
+    return os.path.splitext(matrix_path)[0] + '_codes.csv'
+
+
+def read_similarity_csvs(sim_directory, codes):
+    '''Build the similarity matrix of the given flags from their CSV files
+    input param
+        sim_directory: directory with one similarity CSV per flag
+        codes: list of flag codes, row/column order of the result
+    return, matrix: N x N float32, NaN where a CSV has no entry (including the diagonal)
+    '''
+    import pandas as pd
+    index = {code: i for i, code in enumerate(codes)}
+    matrix = np.full((len(codes), len(codes)), np.nan, np.float32)
+    for i, code in enumerate(codes):
+        df_sim = pd.read_csv(os.path.join(sim_directory, code + '.csv'))
+        cols = df_sim['Image'].map(index)
+        known = cols.notna().values
+        matrix[i, cols[known].astype(int).values] = df_sim['Similarity'].values[known]
+    return matrix
+
+
+def compile_similarity(sim_directory, matrix_path):
+    '''Read every <code>.csv in sim_directory and write the N x N matrix
+    input param
+        sim_directory: directory with one similarity CSV per flag
+        matrix_path: output .npy path, the sidecar is written next to it
+    return, codes: list of flag codes in matrix order
+    '''
+    csv_files = sorted(glob.glob(os.path.join(sim_directory, '*.csv')))
+    codes = [os.path.splitext(os.path.basename(f))[0] for f in csv_files]
+    matrix = read_similarity_csvs(sim_directory, codes)
+
+    import pandas as pd
+    np.save(matrix_path, matrix)
+    pd.DataFrame({'Code': codes}).to_csv(codes_path(matrix_path), index_label='Index')
+    return codes
+
+
+def load_similarity(matrix_path=default_matrix_path):
+    '''Open a compiled matrix without copying it into memory
+    return
+        codes: list of flag codes in matrix order
+        matrix: read-only memory-mapped N x N float32 array
+    '''
+    import pandas as pd
+    codes = pd.read_csv(codes_path(matrix_path))['Code'].tolist()
+    matrix = np.load(matrix_path, mmap_mode='r')
+    return codes, matrix
+
+
+def similarity_subset(codes, matrix, flags):
+    '''return the len(flags) x len(flags) block of matrix for the given flags, in that order'''
+    index = {code: i for i, code in enumerate(codes)}
+    rows = np.array([index[flag] for flag in flags], int)
+    return np.asarray(matrix[np.ix_(rows, rows)], np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=default_source, help='directory of per-flag similarity CSVs')
+    parser.add_argument('--out', default=default_matrix_path, help='output .npy path')
+    args = parser.parse_args()
+
+    codes = compile_similarity(args.source, args.out)
+    print(f"wrote {len(codes)} x {len(codes)} matrix to {args.out} and codes to {codes_path(args.out)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+"""
+simulated students for evaluating the flag policy without Flask or a tracker
+a SimulatedStudent answers engagement_source like the eye tracker would,
+driving the same Learner.run_one_step / decide_flag code as the study;
+cohorts of 20-page episodes run across a process pool and the harness
+reports steps/s, convergence curves and final rewards for control vs test
+
+usage: python src/simulator.py [--cohorts 8] [--episodes 200] [--workers 4] [--lockstep] [--out curves.npz]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import rl_algo
+from engagement_calibration import EngagementCalibration
+from q_engine import QEngine
+
+# engagement (after the intrinsic score is removed) of a student, by the
+# familiarity of the flag shown and its similarity level to the previous one
+DEFAULT_STUDENT = {
+    'base': 0.6,
+    'unfamiliar': 0.5,       # novelty bonus for flags the student did not know
+    'similarity': {1: 0.2, 2: 0.6, 3: -0.3},  # related flags help, near repeats bore
+    'fatigue': 0.02,         # lost per page
+    'noise': 0.4,            # standard deviation of the measurement
+    'familiar_fraction': 0.4,
+}
+
+page_num_max = 20  # ui_main.page_num_max, without importing Flask
+
+
+class SimulatedStudent:
+    """
+    One participant: a random familiarity rating, written like
+    /submit_ratings does, and an engagement model over the flags shown.
+    engagement_source is passed to Learner; it scores learner.current_flag,
+    the page just shown, against the page before it.
+    """
+
+    def __init__(self, directory, rng, params=DEFAULT_STUDENT):
+        self.rng = rng
+        self.params = params
+        self.fam_path = os.path.join(directory, f'student_{rng.integers(1 << 62)}.csv')
+        familiar = rng.random(len(rl_algo.get_flags())) < params['familiar_fraction']
+        with open(self.fam_path, 'w') as file:
+            file.write('Flag Name,Familiarity Level\n')
+            file.writelines(f'{flag},{2 if known else 1}\n' for flag, known in zip(rl_algo.get_flags(), familiar))
+        self.intrinsic = rl_algo.get_intrinsic_scores()
+        self.learner = None
+        self.previous_flag = None
+        self.page = 0
+
+    def engagement(self, flag, index):
+        '''raw engagement score of flag, what GazeStream.current_engagement_score would return'''
+        params = self.params
+        value = params['base'] - params['fatigue'] * self.page
+        if rl_algo.familiar(flag, index) == 1:
+            value += params['unfamiliar']
+        if self.previous_flag is not None:
+            value += params['similarity'][rl_algo.similar(self.previous_flag, flag, index)]
+        value += self.rng.normal(0.0, params['noise'])
+        self.previous_flag = flag
+        self.page += 1
+        return value + self.intrinsic.get(flag, 0.0)
+
+    def engagement_source(self):
+        return self.engagement(self.learner.current_flag, self.learner.index())
+
+    def remove(self):
+        os.remove(self.fam_path)
+
+
+def test_episode(student, pages, calibration=None):
+    '''one test-group session, return the rewards run_one_step recorded'''
+    learner = rl_algo.Learner(fam_path=student.fam_path, q_table_file=None,
+                              engagement_source=student.engagement_source, calibration=calibration)
+    student.learner = learner
+    learner.initialize_learning()
+    return [learner.run_one_step()[2] for _ in range(pages)]
+
+
+def control_episode(student, pages, calibration=None):
+    '''one control-group session, random flags as in ui_main.random_image'''
+    index = rl_algo.FlagIndex(rl_algo.get_flags(), rl_algo.sim_directory, student.fam_path, rl_algo.sim_matrix_path)
+    rewards = []
+    for _ in range(pages):
+        flag = random.choice(rl_algo.get_flags())
+        rewards.append(student.engagement(flag, index) - student.intrinsic.get(flag, 0.0))
+    return rewards
+
+
+def run_cohort(seed, episodes, group, pages=page_num_max, params=DEFAULT_STUDENT):
+    '''Run one cohort of students in order, sharing one fresh Q-table as the study does
+    return, (rewards, steps, seconds): rewards is (episodes, pages)
+    '''
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    np.random.seed(seed)  # epsilon-greedy draws in run_one_step
+    with rl_algo.q_lock:
+        rl_algo.Q = np.zeros_like(rl_algo.Q)
+        rl_algo.q_loaded = True
+    rewards = np.empty((episodes, pages))
+    episode = test_episode if group == 'test' else control_episode
+    # the cohort's own station calibration, kept in memory
+    calibration = EngagementCalibration(path=None)
+    with tempfile.TemporaryDirectory(prefix='simulator_') as directory:
+        start = time.perf_counter()
+        for i in range(episodes):
+            student = SimulatedStudent(directory, rng, params)
+            rewards[i] = episode(student, pages, calibration)
+            student.remove()
+        seconds = time.perf_counter() - start
+    return rewards, episodes * pages, seconds
+
+
+def run_lockstep(cohorts, episodes, pages=page_num_max, params=DEFAULT_STUDENT, seed=0, gamma=None,
+                 learn_rate=None, epsilon_decay=None):
+    '''Run test-group cohorts side by side in one process, one QEngine learner per cohort
+    Each step does the action choice and the Q update of every cohort in one
+    call; flag choice and the student model still run per cohort.
+    gamma, learn_rate, epsilon_decay: scalars or one value per cohort, default the rl_model config
+    return, (rewards, steps, seconds): rewards is (cohorts, episodes, pages)
+    '''
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    dimensions = rl_algo.state_dimensions(rl_algo.consider_page, rl_algo.max_page)
+    gamma = rl_algo.discount_factor if gamma is None else gamma
+    learn_rate = rl_algo.learning_rate if learn_rate is None else learn_rate
+    epsilon_decay = rl_algo.epsilon_decay if epsilon_decay is None else epsilon_decay
+    engine = QEngine(cohorts, dimensions, rl_algo.action_space, gamma, learn_rate, epsilon_decay, seed)
+    rewards = np.empty((cohorts, episodes, pages))
+    levels, familiarity, similarity = (np.empty(cohorts, np.intp) for _ in range(3))
+    calibrations = [EngagementCalibration(path=None) for _ in range(cohorts)]
+    with tempfile.TemporaryDirectory(prefix='simulator_') as directory:
+        start = time.perf_counter()
+        for episode in range(episodes):
+            students = [SimulatedStudent(directory, rng, params) for _ in range(cohorts)]
+            indexes = [rl_algo.FlagIndex(rl_algo.get_flags(), rl_algo.sim_directory, student.fam_path,
+                                         rl_algo.sim_matrix_path) for student in students]
+            current = [random.choice(rl_algo.get_flags()) for _ in range(cohorts)]
+            quantiles = [calibration.participant() for calibration in calibrations]
+            edges = [None] * cohorts
+            for l in range(cohorts):
+                if rl_algo.adaptive_engagement:
+                    edges[l] = calibrations[l].edges(quantiles[l])
+                levels[l] = rl_algo.engagement_level(1, edges=edges[l])
+                familiarity[l] = rl_algo.familiar(current[l], indexes[l])
+                similarity[l] = random.choice(rl_algo.state_space)[2]
+            states = engine.encode(*[levels, familiarity, similarity, 0][:len(dimensions)])
+            for page in range(pages):
+                actions = engine.select(states, np.full(cohorts, page))
+                for l, student in enumerate(students):
+                    next_flag = rl_algo.next_flag_for(current[l], actions[l], rl_algo.get_flags(), indexes[l])
+                    r = student.engagement(current[l], indexes[l]) - student.intrinsic.get(current[l], 0.0)
+                    rewards[l, episode, page] = r
+                    if rl_algo.adaptive_engagement:
+                        edges[l] = calibrations[l].edges(quantiles[l])
+                        calibrations[l].record(r, quantiles[l])
+                    levels[l] = rl_algo.engagement_level(r, edges=edges[l])
+                    familiarity[l] = rl_algo.familiar(next_flag, indexes[l])
+                    similarity[l] = rl_algo.similar(current[l], next_flag, indexes[l])
+                    current[l] = next_flag
+                next_states = engine.encode(*[levels, familiarity, similarity,
+                                              min(page + 1, rl_algo.max_page)][:len(dimensions)])
+                engine.update(states, actions, rewards[:, episode, page], next_states)
+                states = next_states
+            for student in students:
+                student.remove()
+        seconds = time.perf_counter() - start
+    return rewards, cohorts * episodes * pages, seconds
+
+
+def run(cohorts, episodes, group, workers, pages=page_num_max, seed=0):
+    '''run cohorts across a process pool, return (rewards, steps/s)'''
+    seeds = [seed + i for i in range(cohorts)]
+    start = time.perf_counter()
+    if workers == 1:
+        results = [run_cohort(s, episodes, group, pages) for s in seeds]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(run_cohort, seeds, [episodes] * cohorts, [group] * cohorts, [pages] * cohorts))
+    elapsed = time.perf_counter() - start
+    rewards = np.stack([r for r, _, _ in results])
+    steps = sum(n for _, n, _ in results)
+    return rewards, steps / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cohorts', type=int, default=8, help='independent Q-tables per group')
+    parser.add_argument('--episodes', type=int, default=200, help='students per cohort')
+    parser.add_argument('--pages', type=int, default=page_num_max)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--lockstep', action='store_true',
+                        help='run the test cohorts side by side on one QEngine instead of a Learner per process')
+    parser.add_argument('--points', type=int, default=10, help='rows of the printed convergence curve')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='save the reward arrays to this .npz file')
+    args = parser.parse_args()
+
+    results = {}
+    for group in ('control', 'test'):
+        if group == 'test' and args.lockstep:
+            rewards, steps, seconds = run_lockstep(args.cohorts, args.episodes, args.pages, seed=args.seed)
+            rate = steps / seconds
+        else:
+            rewards, rate = run(args.cohorts, args.episodes, group, args.workers, args.pages, args.seed)
+        results[group] = rewards
+        print(f"{group:<8} {rewards.size:>9} steps, {rate:>10,.0f} steps/s")
+
+    # mean reward per episode, averaged over cohorts
+    curves = {group: rewards.mean(axis=(0, 2)) for group, rewards in results.items()}
+    print("\nepisode   control      test")
+    for i in np.linspace(0, args.episodes - 1, min(args.points, args.episodes)).astype(int):
+        print(f"{i + 1:>7} {curves['control'][i]:>9.3f} {curves['test'][i]:>9.3f}")
+
+    tail = max(1, args.episodes // 5)
+    print(f"\nfinal reward, mean per episode over the last {tail} episodes of every cohort")
+    print("group         p10     p50     p90    mean")
+    for group, rewards in results.items():
+        final = rewards[:, -tail:].mean(axis=2).ravel()
+        p10, p50, p90 = np.percentile(final, [10, 50, 90])
+        print(f"{group:<8} {p10:>7.3f} {p50:>7.3f} {p90:>7.3f} {final.mean():>7.3f}")
+
+    if args.out:
+        np.savez(args.out, **results)
+        print(f"rewards saved to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
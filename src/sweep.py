@@ -0,0 +1,176 @@
+"""
+hyperparameter sweeps over the rl_model settings
+expands the sweep section of config.yaml into configurations, evaluates each
+in worker processes on simulated students or logged transitions, caches
+finished runs by config hash (reruns only evaluate new points) and ranks them
+
+usage: python src/sweep.py [--config config.yaml] [--method random --samples 20] [--workers 4] [--write-config]
+"""
+
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from rl_config import config_hash, config_path, load_rl_config, read_config, write_rl_config
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+
+
+def expand(space, method='grid', samples=20, seed=0):
+    '''Turn the sweep space into a list of {setting: value} points
+    input param
+        space: {setting: list of values, or {min, max} (grid: also num, default 3)}
+        method: 'grid' for every combination, 'random' for `samples` random draws
+    '''
+    if method == 'grid':
+        axes = {}
+        for key, spec in space.items():
+            if isinstance(spec, dict):
+                axes[key] = np.linspace(spec['min'], spec['max'], spec.get('num', 3)).tolist()
+            else:
+                axes[key] = list(spec)
+        return [dict(zip(axes, values)) for values in itertools.product(*axes.values())]
+    if method == 'random':
+        rng = np.random.default_rng(seed)
+        points = []
+        for _ in range(samples):
+            point = {}
+            for key, spec in space.items():
+                if isinstance(spec, dict):
+                    point[key] = float(rng.uniform(spec['min'], spec['max']))
+                else:
+                    point[key] = float(spec[rng.integers(len(spec))])
+            points.append(point)
+        return points
+    raise ValueError(f"unknown sweep method {method!r}, use grid or random")
+
+
+def evaluate(config, settings):
+    '''Score one rl_model configuration, higher is better
+    simulated: mean reward over the last fifth of the episodes, cohorts of
+               simulated students on QEngine (same seeds for every config)
+    logged: negative mean squared TD error on the last fifth of the logged
+            transitions after replaying the rest; states are logged already
+            encoded, so only learning_rate and discount_factor matter here
+    return, dict with score and detail
+    '''
+    import rl_algo
+    rl_algo.apply_rl_config(config)
+    start = time.perf_counter()
+    if settings['source'] == 'simulated':
+        import simulator
+        rewards, steps, _ = simulator.run_lockstep(settings['cohorts'], settings['episodes'], seed=settings['seed'])
+        tail = max(1, settings['episodes'] // 5)
+        final = rewards[:, -tail:].mean(axis=(1, 2))
+        result = {'score': float(final.mean()), 'cohort_std': float(final.std()), 'steps': steps}
+    elif settings['source'] == 'logged':
+        from offline_trainer import replay
+        from transitions import read_transitions
+        s, a, r, s1 = read_transitions(settings['logs'], len(rl_algo.state_space))
+        split = len(s) - max(1, len(s) // 5)
+        n_states, n_actions = len(rl_algo.state_space), len(rl_algo.action_space)
+        Q = replay(s[:split], a[:split], r[:split], s1[:split], n_states, n_actions,
+                   config['discount_factor'], config['learning_rate'], seed=settings['seed'])
+        td = r[split:] + config['discount_factor'] * Q[s1[split:]].max(axis=1) - Q[s[split:], a[split:]]
+        result = {'score': float(-np.mean(td ** 2)), 'transitions': len(s)}
+    else:
+        raise ValueError(f"unknown sweep source {settings['source']!r}, use simulated or logged")
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def run_point(config, settings, cache_file):
+    '''evaluate in a worker and store the result, written atomically so a killed sweep leaves no partial entry'''
+    result = evaluate(config, settings)
+    record = {'config': config, 'settings': settings, 'result': result}
+    with open(cache_file + '.tmp', 'w') as file:
+        json.dump(record, file, indent=1)
+    os.replace(cache_file + '.tmp', cache_file)
+    return record
+
+
+def sweep_settings(sweep, args):
+    settings = {
+        'source': sweep.get('source', 'simulated'),
+        'cohorts': sweep.get('cohorts', 8),
+        'episodes': sweep.get('episodes', 100),
+        'seed': sweep.get('seed', 0),
+    }
+    if settings['source'] == 'logged':
+        logs = [path if os.path.isabs(path) else os.path.join(parent_dir, path) for path in sweep.get('logs', [])]
+        settings['logs'] = logs
+        # a log that grew since the last sweep gives new cache entries
+        settings['log_sizes'] = [os.path.getsize(path) for path in logs]
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', default=config_path)
+    parser.add_argument('--method', choices=['grid', 'random'], help='overrides sweep.method')
+    parser.add_argument('--samples', type=int, help='overrides sweep.samples')
+    parser.add_argument('--workers', type=int, help='overrides sweep.workers')
+    parser.add_argument('--top', type=int, default=10, help='rows of the ranking to print')
+    parser.add_argument('--write-config', action='store_true',
+                        help='write the best settings into the rl_model section of the config')
+    args = parser.parse_args()
+
+    sweep = read_config(args.config).get('sweep') or {}
+    if not sweep.get('space'):
+        parser.error(f"{args.config} has no sweep.space to search")
+    base = load_rl_config(args.config)
+    settings = sweep_settings(sweep, args)
+    points = expand(sweep['space'], args.method or sweep.get('method', 'grid'),
+                    args.samples or sweep.get('samples', 20), settings['seed'])
+    configs = [{**base, **point} for point in points]
+
+    cache_dir = sweep.get('cache_dir', 'output/sweeps')
+    cache_dir = cache_dir if os.path.isabs(cache_dir) else os.path.join(parent_dir, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_files = [os.path.join(cache_dir, config_hash(config, settings) + '.json') for config in configs]
+
+    records = [None] * len(configs)
+    todo = []
+    for i, cache_file in enumerate(cache_files):
+        if os.path.exists(cache_file):
+            with open(cache_file) as file:
+                records[i] = json.load(file)
+        else:
+            todo.append(i)
+    print(f"{len(configs)} configurations, {len(configs) - len(todo)} cached, {len(todo)} to run "
+          f"({settings['source']})")
+
+    start = time.perf_counter()
+    workers = args.workers or sweep.get('workers', os.cpu_count())
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {i: pool.submit(run_point, configs[i], settings, cache_files[i]) for i in todo}
+        for i, future in futures.items():
+            records[i] = future.result()
+    if todo:
+        print(f"ran {len(todo)} in {time.perf_counter() - start:.1f} s on {workers} workers")
+
+    keys = list(sweep['space'])
+    ranked = sorted(records, key=lambda record: record['result']['score'], reverse=True)
+    print("\nrank " + "".join(f"{key:>17}" for key in keys) + "        score")
+    for rank, record in enumerate(ranked[:args.top], 1):
+        print(f"{rank:>4} " + "".join(f"{record['config'][key]:>17.4g}" for key in keys)
+              + f"  {record['result']['score']:>11.4f}")
+
+    best = {key: ranked[0]['config'][key] for key in keys}
+    with open(os.path.join(cache_dir, 'best.json'), 'w') as file:
+        json.dump({'best': best, 'result': ranked[0]['result'], 'settings': settings}, file, indent=1)
+    print(f"\nbest: {best}")
+    if args.write_config:
+        write_rl_config(best, args.config)
+        print(f"written to the rl_model section of {args.config}")
+
+
+if __name__ == '__main__':
+    main()
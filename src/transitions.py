@@ -0,0 +1,84 @@
+"""
+log of learner transitions, one CSV row per page turn
+read back by offline_trainer.py
+"""
+
+import csv
+import os
+import threading
+
+import numpy as np
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+transitions_path = os.path.join(parent_dir, 'output', 'transitions.csv')
+
+FIELDS = ['time', 'participant', 'step', 'state', 'action', 'reward', 'next_state', 'flag', 'next_flag', 'states']
+# layout of logs written before the states column: always the plain state space
+LEGACY_STATES = 18
+
+
+class TransitionLog:
+    """
+    Appends (s, a, r, s1) transitions to a CSV file shared by every learner
+    of the process. States and actions are stored as indices into
+    rl_algo.state_space and rl_algo.action_space, with the number of states
+    of that state space (18, or more with the page dimension) in `states`
+    so rows of different layouts are never mixed up.
+    A file with an older header is moved aside to <name>.<mtime>.csv first.
+    """
+
+    def __init__(self, path=transitions_path):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not new_file:
+            with open(path, newline='') as file:
+                header = next(csv.reader(file), None)
+            if header != FIELDS:
+                root, extension = os.path.splitext(path)
+                moved = f"{root}.{int(os.path.getmtime(path))}{extension}"
+                os.replace(path, moved)
+                print(f"{path} has an older layout, moved to {moved}")
+                new_file = True
+        # line buffered, every transition reaches the file when it is logged
+        self.file = open(path, 'a', newline='', buffering=1)
+        self.writer = csv.writer(self.file)
+        if new_file:
+            self.writer.writerow(FIELDS)
+
+    def log(self, time, participant, step, state, action, reward, next_state, flag, next_flag, states):
+        with self.lock:
+            self.writer.writerow([f'{time:.3f}', participant, step, state, action, f'{reward:.6g}',
+                                  next_state, flag, next_flag, states])
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_transitions(paths, states):
+    '''Read one or more transition logs
+    input param
+        paths: list of CSV files written by TransitionLog
+        states: number of states of the current state space; rows logged with
+                another layout are skipped (and counted in a message), logs
+                without a states column count as LEGACY_STATES
+    return, (s, a, r, s1): arrays of state index, action index, reward and next state index
+    '''
+    import pandas as pd
+    frames = []
+    for path in paths:
+        frame = pd.read_csv(path)
+        if 'states' not in frame:
+            frame['states'] = LEGACY_STATES
+        frames.append(frame[['state', 'action', 'reward', 'next_state', 'states']])
+    frame = pd.concat(frames, ignore_index=True)
+    match = frame['states'] == states
+    if not match.all():
+        print(f"skipped {int((~match).sum())} of {len(frame)} transitions logged with another state "
+              f"space than the current one ({states} states)")
+        frame = frame[match]
+    return (frame['state'].to_numpy(np.intp), frame['action'].to_numpy(np.intp),
+            frame['reward'].to_numpy(np.float64), frame['next_state'].to_numpy(np.intp))
@@ -5,38 +5,68 @@ main script
 import os
 import random
 import csv
+import threading
 
-from flask import Flask, render_template, request, redirect, url_for
-import pandas as pd
+from flask import Flask, render_template, request, redirect, url_for, session
 
-from rl_algo import initialize_learning, run_one_step
-from engagement_analysis import get_current_engagement_score, start_data_reader
+import metrics
+from assets import get_registry
+from sessions import SessionRegistry, parse_address
 
 app = Flask(__name__)
+# participants are told apart by a signed session cookie; set FLASK_SECRET_KEY to keep
+# them across restarts. Serve with one process and many threads, the shared Q-table
+# lives in this process (see sessions.py)
+app.secret_key = os.environ.get('FLASK_SECRET_KEY') or os.urandom(16).hex()
 
 script_dir = os.path.dirname(os.path.abspath(__file__)) 
-rating_dir = os.path.join(script_dir, 'static', 'rating')
 parent_dir = os.path.dirname(script_dir)
-intr_path = os.path.join(parent_dir, 'data/intrinsic_scores.csv') 
-df_intr = pd.read_csv(intr_path)
 page_num_max = 20
 
-flags = [{"id": idx + 1, 
-          "name": os.path.splitext(filename)[0],  
-          "image": os.path.join('/static/rating', filename), 
-          "info": f"Info about Country{idx + 1}"} 
-         for idx, filename in enumerate(os.listdir(rating_dir))]
+# flag images, intrinsic scores and rating flags, read on first use and reloaded when the files change
+flag_assets = get_registry()
 
-scores_record_random = []
-selected_group = 'default'
+# static URLs versioned with ?v=<content hash> never change, browsers may keep them
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+
+output_dir = os.path.join(parent_dir, 'output')
+registry = SessionRegistry()
+csv_lock = threading.Lock()
 
 def append_scores_to_csv(group_number, scores, file_path):
     # Prepare the row to be appended
     row = [group_number] + scores
-    with open(file_path, 'a', newline='') as file:
+    with csv_lock, open(file_path, 'a', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(row)
 
+@app.after_request
+def cache_versioned_assets(response):
+    if request.path.startswith('/static/') and 'v' in request.args and response.status_code == 200:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE
+    return response
+
+def warm_up():
+    """
+    Load what importing the app leaves for later (pandas, cv2, the flag
+    assets, rl_algo's flag list and intrinsic scores), so the first
+    participant does not wait for it. Run in the background at start-up.
+    """
+    import pandas
+    import rl_algo
+    from Fixpos2Densemap import JetLevelSums
+    flag_assets.refresh()
+    rl_algo.get_flags()
+    rl_algo.get_intrinsic_scores()
+    JetLevelSums()  # imports cv2
+
+def current_participant():
+    """
+    return the ParticipantSession of this browser, None if it has none
+    """
+    participant_id = session.get('participant_id')
+    return registry.get(participant_id) if participant_id else None
+
 @app.route('/')
 def index():
     """
@@ -49,8 +79,12 @@ def submit_group():
     """
     submitting control / test group
     """
-    global selected_group
-    selected_group = request.form.get('group')
+    try:
+        tracker_address = parse_address(request.form.get('tracker'))
+    except ValueError as e:
+        return render_template('opening.html', error=str(e), tracker=request.form.get('tracker')), 400
+    participant = registry.create(request.form.get('group'), tracker_address)
+    session['participant_id'] = participant.participant_id
     return redirect(url_for('rate_flags'))
 
 @app.route('/rate_flags')
@@ -58,16 +92,21 @@ def rate_flags():
     """
     rating familarity level
     """
-    global selected_group
-    return render_template('rate_flags.html', group=selected_group, flags=flags)
+    participant = current_participant()
+    if participant is None:
+        return redirect(url_for('index'))
+    return render_template('rate_flags.html', group=participant.group, flags=flag_assets.rating_flags())
 
 @app.route('/submit_ratings', methods=['POST'])
 def submit_ratings():
     """
     submitting familiarity level
     """
-    global selected_group, current_state
-    
+    participant = current_participant()
+    if participant is None:
+        return redirect(url_for('index'))
+
+    flags = flag_assets.rating_flags()
     flag_id_to_name = {str(flag['id']): flag['name'] for flag in flags}
 
     # Get the IDs of flags marked as familiar
@@ -83,15 +122,15 @@ def submit_ratings():
             # Unfamiliar flags
             familiarity_data.append([flag_id_to_name[flag_id_str], 1])
 
+    import pandas as pd
     df = pd.DataFrame(familiarity_data, columns=['Flag Name', 'Familiarity Level'])
+    df.to_csv(participant.fam_path, index=False)
 
-    parent_dir = os.path.dirname(script_dir)
-    csv_path = os.path.join(parent_dir, 'data', 'flag_familiarity.csv')
-    df.to_csv(csv_path, index=False)
-
-    start_data_reader()
-
-    current_state = initialize_learning()
+    with participant.lock:
+        if participant.closed:  # replaced by a new participant or reaped meanwhile
+            return redirect(url_for('index'))
+        participant.gaze.start()
+        participant.learner.initialize_learning()
 
     return redirect(url_for('view_flag', page_num=1))
 
@@ -102,11 +141,8 @@ def random_image():
     """
     control group
     """
-    images_dir = os.path.join(app.static_folder, 'learningMaterial') 
-    images = os.listdir(images_dir) 
-    random_image = random.choice(images)  
-    image_path = 'learningMaterial/' + random_image 
-    return [url_for('static', filename=image_path), random_image]
+    random_image = random.choice(flag_assets.learning_images())
+    return [flag_assets.image_url(random_image), random_image]
 
 
 @app.route('/start_learning')
@@ -114,44 +150,85 @@ def start_learning():
     """
     test group - starting the algorithm
     """
-    global current_state 
-    current_state = initialize_learning()
+    participant = current_participant()
+    if participant is None:
+        return redirect(url_for('index'))
+    with participant.lock:
+        if participant.closed:
+            return redirect(url_for('index'))
+        participant.learner.initialize_learning()
     return redirect(url_for('view_flag'))
 
 @app.route('/view_flag')
 def view_flag():
-    global selected_group, current_state, scores_record_random
+    participant = current_participant()
+    if participant is None:
+        return redirect(url_for('index'))
     page_num = int(request.args.get('page_num', 1))
 
-    if page_num > page_num_max:
-        output_dir = os.path.join(parent_dir, 'output')
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        file_path = os.path.join(output_dir, 'cumulative_scores.csv')
-        group_number = "control" if selected_group == 'group1' else "test"
-        append_scores_to_csv(group_number, scores_record_random, file_path)
-        
-        scores_record_random = []  # Reset scores for the next turn
-        
-        return redirect(url_for('congrats'))
-
-    elif selected_group == 'group1':  # control group
-        image_url, current_flag = random_image()  # Changed to unpack a tuple returned by random_image()
-        print(df_intr, current_flag.replace(".jpg",""))
-        intr_norm = df_intr[df_intr['Code'] == current_flag.replace(".jpg","")]["Score"]
-        engagement_score_ori = get_current_engagement_score() 
-        engagement_score = float(engagement_score_ori - intr_norm)
-        print("engagement score: ",engagement_score, type(engagement_score))
-        scores_record_random.append(engagement_score)
-    else:
-        # q_table = load_q_table()
-        image_name, current_state, engagement_score = run_one_step()  # test group
-        image_url = url_for('static', filename='learningMaterial/' + image_name + '.jpg')
-        scores_record_random.append(engagement_score)
+    # every stage below is timed for /metrics and the participant's summary
+    with metrics.session(participant.metrics), metrics.timed('page_turn'):
+        return turn_page(participant, page_num)
+
+def turn_page(participant, page_num):
+    """
+    score the page just shown, pick the next one and render it
+    """
+    with participant.lock:
+        if participant.closed:
+            return redirect(url_for('index'))
+        if page_num > page_num_max:
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir, exist_ok=True)
+            file_path = os.path.join(output_dir, 'cumulative_scores.csv')
+            group_number = "control" if participant.group == 'group1' else "test"
+            append_scores_to_csv(group_number, participant.scores_record, file_path)
+
+            registry.remove(participant.participant_id)
+            session.pop('participant_id', None)
+
+            return redirect(url_for('congrats'))
+
+        elif participant.group == 'group1':  # control group
+            # the image drawn (and prefetched) on the previous page, then draw the next one
+            image_url, current_flag = participant.next_image or random_image()  # Changed to unpack a tuple returned by random_image()
+            participant.next_image = random_image()
+            prefetch_urls = [participant.next_image[0]]
+            intr_norm = flag_assets.intrinsic(current_flag)
+            engagement_score_ori = participant.gaze.current_engagement_score()
+            # a page without a fixation is unscored and a flag missing from intrinsic_scores.csv
+            # cannot be normalized, both are NaN in the scores file like rescore writes them
+            if engagement_score_ori is None or intr_norm is None:
+                engagement_score = float('nan')
+            else:
+                engagement_score = float(engagement_score_ori - intr_norm)
+            participant.scores_record.append(engagement_score)
+            participant.annotate_page(page=page_num, flag=current_flag.replace(".jpg",""), normalized=engagement_score)
+        else:
+            scored_flag = participant.learner.current_flag
+            image_name, current_state, engagement_score = participant.learner.run_one_step()  # test group
+            image_url = flag_assets.image_url(image_name)
+            if engagement_score is None:  # unscored page, no Q update was made
+                engagement_score = float('nan')
+            participant.scores_record.append(engagement_score)
+            participant.annotate_page(page=page_num, flag=scored_flag.replace(".jpg",""), normalized=engagement_score)
+            # every flag the next step can pick, so the click only waits for the score and the Q update
+            prefetch_urls = [flag_assets.image_url(flag) for flag in participant.learner.prepare_candidates()
+                             if flag_assets.has_image(flag)]
 
     next_page_num = page_num + 1
-    return render_template('view_flag.html', flag_image_url=image_url, page_num=next_page_num, selected_group=selected_group)
+    if next_page_num > page_num_max:  # the next click ends the study
+        prefetch_urls = []
+    return render_template('view_flag.html', flag_image_url=image_url, page_num=next_page_num, selected_group=participant.group,
+                           prefetch_urls=prefetch_urls)
+
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    process metrics in the Prometheus text format
+    """
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 @app.route('/congrats')
 def congrats():
@@ -163,6 +240,7 @@ def congrats():
     return render_template('congrats.html')
 
 if __name__ == '__main__':
+    threading.Thread(target=warm_up, daemon=True).start()
     app.run(debug=True)
 
 